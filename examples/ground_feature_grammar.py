@@ -0,0 +1,32 @@
+"""
+This script shows how to explore a feature grammar with the context-free grammar machinery when it only uses
+finite-valued atomic features (cf grammar_root), and compute the exact statistics of its tree
+"""
+
+from nltk.grammar import FeatureGrammar
+
+from lm_heuristic.tree.interface.fcfg_grounding import grammar_root
+from lm_heuristic.tree.stats import TreeStats
+
+
+GRAMMAR_FOLDER = "data/fcfg/"
+GRAMMAR_NAME = "agreement"
+NB_SAMPLES = 10
+
+if __name__ == "__main__":
+    with open(GRAMMAR_FOLDER + GRAMMAR_NAME + ".fcfg") as grammar_file:
+        feature_grammar = FeatureGrammar.fromstring(grammar_file.read())
+
+    # CFGrammarNode built from the grounded grammar, or FeatureGrammarNode if the grammar can not be grounded
+    root = grammar_root(feature_grammar, only_keep_valid_node=True)
+    print("Grounded grammar" if hasattr(root, "grounded_grammar") else "Feature grammar (can not be grounded)")
+
+    for leaf in root.random_walks(NB_SAMPLES):
+        print(leaf)
+
+    # Exact statistics if the root can count the leaves of its tree (cf CFGrammarNode.derivation_counter)
+    # (as RessourceDistributor.initialization), sampled statistics otherwise
+    stats = TreeStats(root)
+    if not stats.compute_exact_stats():
+        stats.accumulate_stats(nb_samples=NB_SAMPLES)
+    print("depth : ", stats.depths_info())
@@ -42,4 +42,4 @@ if __name__ == "__main__":
     )
 
     mcts.search(grammar_root, nb_of_tree_walks=10000)
-    print(len(mcts._evaluator._call_history))
\ No newline at end of file
+    print(len(mcts.evaluation_history()))
\ No newline at end of file
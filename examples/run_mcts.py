@@ -35,6 +35,8 @@ if __name__ == "__main__":
         ucb_function=standart_ucb,
         parallel_strategy="none",
         progress_bar=True,
+        # The leaves that only differ by one word are scored together when their parent is expanded
+        lexical_slot_evaluation=True,
     )
 
     best_node, best_value = mcts.search(grammar_root, nb_of_tree_walks=64)
@@ -7,6 +7,7 @@ from nltk.parse import CoreNLPParser
 from lm_heuristic.generation import GPT2Paraphrases
 from lm_heuristic.sentence_score import GPT2Score
 from lm_heuristic.tree_search.evaluator import Evaluator
+from lm_heuristic.tree_search.evaluation_service import EvaluationService
 from lm_heuristic.tree_search.mcts import MonteCarloTreeSearch, AllocationStrategy
 from lm_heuristic.tree_search.random import RandomSearch
 from lm_heuristic.tree.interface.nltk_grammar import FeatureGrammarNode
@@ -25,7 +26,7 @@ class Models:
         self._gpt2_model = None
         self._universal_sentence_encoder = None
         self.paraphrase_generator = None
-        self.montecarlo_searcher = None
+        self.evaluation_service = None
         self.random_searcher = None
         self.parser = None
 
@@ -47,7 +48,7 @@ class Models:
         )
 
     def is_montecarlo_searcher_ready(self):
-        return self.montecarlo_searcher is not None
+        return self.evaluation_service is not None
 
     def load_montecarlo_searcher(self):
         assert not self.is_montecarlo_searcher_ready()
@@ -58,12 +59,20 @@ class Models:
             length_normalization=True,
         )
 
-        evaluator = Evaluator(gpt_2_scorer)
+        # The searches share the scorer through an evaluation service (batches merged, leaves deduplicated)
+        self.evaluation_service = EvaluationService(gpt_2_scorer)
+        self.evaluation_service.build()
+
+    def montecarlo_searcher(self, context=None):
+        """
+        return a new searcher for a task: each task has its own evaluator (memory, top-k) and its own client
+        of the evaluation service, so that concurrent tasks can share the batches of the scorer
+        """
+        assert self.is_montecarlo_searcher_ready()
+        evaluator = Evaluator(self.evaluation_service.client(context))
         evaluator.set_default_value(node=FeatureGrammarNode("DEAD_END", feature_grammar=None), value=0.0)
 
-        self.montecarlo_searcher = MonteCarloTreeSearch(
-            evaluator=evaluator, buffer_size=config["BATCH_SIZE"], progress_bar=False,
-        )
+        return MonteCarloTreeSearch(evaluator=evaluator, buffer_size=config["BATCH_SIZE"], progress_bar=False)
 
     def is_random_searcher_ready(self):
         return self.random_searcher is not None
@@ -50,7 +50,7 @@ def grammar_mcts(self, data):
     self.update_state(state="PROGRESS", meta={"detail": "Perfoming the tree walks ..."})
     return generate_from_grammar(
         grammar_root=FeatureGrammarNode.from_string(data["grammar"]),
-        searcher=models.montecarlo_searcher,
+        searcher=models.montecarlo_searcher(context=data.get("context")),
         nb_tree_walks=data["number_of_tree_walks"],
         keep_top_n=data["keep_top"],
     )
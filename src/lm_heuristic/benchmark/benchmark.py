@@ -72,12 +72,15 @@ class Benchmark:
                         begin_time = time.process_time()
                         best_leaf, best_leaf_value = strategy.search(root_sample, nb_of_tree_walks=k)
                         time_needed = time.process_time() - begin_time
+                        history = strategy.evaluation_history()
 
                         experiment_results = {
                             "strategy": strategy_name,
                             "dataset": sample_name,
                             "input_nb_tree_walks": k,
                             "restart": j,
+                            "nb_of_unique_leaf_eval": history.nb_unique_leaves(),
+                            "eval_call_counter": len(history),
                             "time_needed": time_needed,
                             "best_value": best_leaf_value,
                             "best_leaf": str(best_leaf),
@@ -1,4 +1,5 @@
 from .sentence_score import SentenceScore
 from .bert_score import BertScore, BertInverseScore
 from .gpt2_score import GPT2Score
+from .scoring_stats import ScoringStats
 
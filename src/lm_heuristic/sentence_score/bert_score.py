@@ -75,9 +75,14 @@ class BertScore(SentenceScore):
         full_mask_batch = self._add_context_and_generate_mask_sentences(sentences_token_ids)
 
         mask_log_prob_scores = []
-        for i in tqdm(range(0, len(full_mask_batch), self.batch_size), disable=not self.progress_bar):
-            batch = full_mask_batch[i : i + self.batch_size]
-            mask_log_prob_scores += self._compute_mask_log_prob(batch)
+        if self.packing_length:
+            sequences_lengths = [len(mask_sentence["mask_sentence_token_ids"]) for mask_sentence in full_mask_batch]
+            for first, last, rows_sizes in self._packed_batches(sequences_lengths):
+                mask_log_prob_scores += self._compute_packed_mask_log_prob(full_mask_batch[first:last], rows_sizes)
+        else:
+            for i in tqdm(range(0, len(full_mask_batch), self.batch_size), disable=not self.progress_bar):
+                batch = full_mask_batch[i : i + self.batch_size]
+                mask_log_prob_scores += self._compute_mask_log_prob(batch)
 
         # Gather the result for each input sentence
         sentences_log_prob_scores = np.zeros(len(sentences_token_ids))
@@ -95,29 +100,56 @@ class BertScore(SentenceScore):
 
     def _compute_mask_log_prob(self, batch: List[Dict]) -> List[float]:
         batch_size = len(batch)
-        dict_batch = self._join_list_of_dict(batch)
 
-        input_ids, no_pad_mask = self._pad(
-            sequences=list(
-                map(lambda ids: torch.tensor(ids, device=self.device), dict_batch["mask_sentence_token_ids"],)
-            ),
-            pad_token_id=self.tokenizer.sep_token_id,
-        )
+        with self._stage("padding"):
+            dict_batch = self._join_list_of_dict(batch)
+            flat_ids, offsets = self._flatten(dict_batch["mask_sentence_token_ids"])
+            input_ids, no_pad_mask = self._pad(flat_ids, offsets, pad_token_id=self.tokenizer.sep_token_id)
 
         with torch.no_grad():
-            # contrary to GPT2-based score, we have to provide an attention mask
-            # because BERT will also look on the right side and will see the pad tokens
-            # with no_pad_mask, the model will zero the score of pad tokens at each layer
-            # shape = [batch_size, seq_len, vocab_size]
-            logits = self.model(input_ids, attention_mask=no_pad_mask)[0]
-
-            # Retrieve the logits of mask tokens
-            # mask_pred_logits.shape = [batch_size, vocac_size]
-            mask_pred_logits = logits[range(batch_size), dict_batch["mask_positions"], :]
-
-            # target_score.shape = [batch_size,]
-            target_scores = mask_pred_logits[range(batch_size), dict_batch["mask_target"]]
-            target_log_probs = target_scores - mask_pred_logits.logsumexp(dim=1)
+            with self._stage("forward"):
+                # contrary to GPT2-based score, we have to provide an attention mask
+                # because BERT will also look on the right side and will see the pad tokens
+                # with no_pad_mask, the model will zero the score of pad tokens at each layer
+                # shape = [batch_size, seq_len, vocab_size]
+                logits = self.model(input_ids, attention_mask=no_pad_mask)[0]
+
+            with self._stage("log_prob"):
+                # Retrieve the logits of mask tokens
+                # mask_pred_logits.shape = [batch_size, vocac_size]
+                mask_pred_logits = logits[range(batch_size), dict_batch["mask_positions"], :]
+
+                # target_score.shape = [batch_size,]
+                target_scores = mask_pred_logits[range(batch_size), dict_batch["mask_target"]]
+                target_log_probs = target_scores - mask_pred_logits.logsumexp(dim=1)
+
+        return target_log_probs
+
+    def _compute_packed_mask_log_prob(self, batch: List[Dict], rows_sizes: List[int]) -> List[float]:
+        with self._stage("padding"):
+            dict_batch = self._join_list_of_dict(batch)
+            flat_ids, offsets = self._flatten(dict_batch["mask_sentence_token_ids"])
+            input_ids, position_ids, segment_ids = self._pad_packed(
+                flat_ids, offsets, rows_sizes, pad_token_id=self.tokenizer.sep_token_id
+            )
+            # Block-diagonal attention mask : each mask sentence only attends to itself
+            # shape = [batch_size, seq_len, seq_len]
+            attention_mask = (segment_ids.unsqueeze(2) == segment_ids.unsqueeze(1)) & (segment_ids != -1).unsqueeze(1)
+
+            # Because the sequences are packed in order, the first tokens of the segments
+            # are retrieved in the same order than the mask sentences
+            rows, starts = ((position_ids == 0) & (segment_ids != -1)).nonzero(as_tuple=True)
+            mask_positions = starts + torch.tensor(dict_batch["mask_positions"], device=self.device)
+
+        with torch.no_grad():
+            with self._stage("forward"):
+                logits = self.model(input_ids, attention_mask=attention_mask.float(), position_ids=position_ids)[0]
+
+            with self._stage("log_prob"):
+                # mask_pred_logits.shape = [nb_mask_sentences, vocac_size]
+                mask_pred_logits = logits[rows, mask_positions, :]
+                target_scores = mask_pred_logits[range(len(batch)), dict_batch["mask_target"]]
+                target_log_probs = target_scores - mask_pred_logits.logsumexp(dim=1)
 
         return target_log_probs
 
@@ -4,10 +4,13 @@ Define a sentence scorer based on GPT2 model
 
 from typing import *
 import logging
+import math
 
 import torch
 from tqdm.autonotebook import tqdm
 
+from transformers import BatchEncoding
+
 from .sentence_score import SentenceScore
 
 
@@ -19,44 +22,306 @@ class GPT2Score(SentenceScore):
     Compute the score of a sentence for GPT2 model.
     Because GPT2 has been trained to predict next_tokens given all previous tokens, we use as a score :
     P(sentence) = P(t_n | t_1 .. t_(n-1)) * ... * P(t_1)
+
+    When a context_window is provided, the states of [BOS] + context are computed only once (in set_context)
+    and are reused to score all the sentences, so that only the sentence tokens go through the model.
+    If the context grows while the window start does not move (cf context_stride), only the new context tokens
+    are input to the model to update those cached states. The context window must let enough room in
+    the model window (1024 tokens for GPT2) for the sentences. The cached context can not be used by the packed
+    rows, so context_window and packing_length can not be used together.
     """
 
+    def __init__(self, *args, **kwargs):
+        SentenceScore.__init__(self, *args, **kwargs)
+        assert not (self.context_window and self.packing_length), (
+            "context_window and packing_length can not be used together"
+        )
+        self._context_past: Optional[List[torch.Tensor]] = None
+        self._context_next_log_probs: torch.Tensor
+
+    def set_context(self, context):
+        previous_start, previous_context_ids = self._context_start, self.context_ids
+        SentenceScore.set_context(self, context)
+        if self.context_window:
+            self._update_context_cache(previous_start, previous_context_ids)
+
+    def _update_context_cache(self, previous_start: int, previous_context_ids: List[int]):
+        if (
+            self._context_past is not None
+            and self._context_start == previous_start
+            and self.context_ids[: len(previous_context_ids)] == previous_context_ids
+        ):
+            # Same window as before : only the new context tokens need to be input
+            new_ids = self.context_ids[len(previous_context_ids) :]
+            past = self._context_past
+        else:
+            new_ids = [self.tokenizer.bos_token_id] + self.context_ids
+            past = None
+
+        if new_ids == []:
+            return
+
+        with torch.no_grad():
+            logits, self._context_past = self.model(
+                torch.tensor([new_ids], device=self.device), past=past, use_cache=True
+            )[:2]
+            # Scores of the first sentence token, which is predicted from the last context token
+            self._context_next_log_probs = torch.nn.LogSoftmax(dim=0)(logits[0, -1])
+
     def _compute_transformers_log_prob_scores(self, sentences_token_ids: List[List[int]]) -> List[float]:
         log_prob_scores = []
 
+        if self.context_window:
+            for i in tqdm(range(0, len(sentences_token_ids), self.batch_size), disable=not self.progress_bar):
+                batch = sentences_token_ids[i : i + self.batch_size]
+                log_prob_scores += self._compute_single_cached_batch(batch)
+            return log_prob_scores
+
+        if self.packing_length:
+            prefix_length = 1 + len(self.context_ids)
+            sequences_lengths = [prefix_length + len(sentence_token_ids) for sentence_token_ids in sentences_token_ids]
+            for first, last, rows_sizes in self._packed_batches(sequences_lengths):
+                log_prob_scores += self._compute_single_packed_batch(sentences_token_ids[first:last], rows_sizes)
+            return log_prob_scores
+
         for i in tqdm(range(0, len(sentences_token_ids), self.batch_size), disable=not self.progress_bar):
             batch = sentences_token_ids[i : i + self.batch_size]
             log_prob_scores += self._compute_single_batch(batch)
 
         return log_prob_scores
 
+    def _flat_input_ids(self, sentences_token_ids: List[List[int]]) -> Tuple[List[int], List[int]]:
+        # Prepare the input ids : [BOS] context sentence
+        prefix_ids = [self.tokenizer.bos_token_id] + self.context_ids
+        flat_ids: List[int] = []
+        offsets = [0]
+        for sentence_token_ids in sentences_token_ids:
+            flat_ids += prefix_ids
+            flat_ids += sentence_token_ids
+            offsets.append(len(flat_ids))
+        return flat_ids, offsets
+
     def _compute_single_batch(self, sentences_token_ids: List[List[int]]) -> List[float]:
-        # Prepare the input ids
-        tokens_ids = [
-            [self.tokenizer.bos_token_id] + self.context_ids + sentence_token_ids
-            for sentence_token_ids in sentences_token_ids
-        ]
-
-        input_ids, no_pad_mask = self._pad(
-            sequences=list(map(lambda ids: torch.tensor(ids, device=self.device), tokens_ids)),
-            pad_token_id=self.tokenizer.eos_token_id,
-        )
+        with self._stage("padding"):
+            flat_ids, offsets = self._flat_input_ids(sentences_token_ids)
+            input_ids, no_pad_mask = self._pad(flat_ids, offsets, pad_token_id=self.tokenizer.eos_token_id)
 
         # Compute all prediction logits by batch of batch_size
         with torch.no_grad():
-            # shape = [batch_size, seq_len, vocab_size]
-            pred_logits = self.model(input_ids)[0]
-            pred_scores = torch.nn.LogSoftmax(dim=2)(pred_logits)
+            with self._stage("forward"):
+                # shape = [batch_size, seq_len, vocab_size]
+                pred_logits = self.model(input_ids)[0]
+
+            with self._stage("log_prob"):
+                pred_scores = torch.nn.LogSoftmax(dim=2)(pred_logits)
+
+                # Align input and target
+                target_ids = input_ids[:, 1:]
+                pred_scores = pred_scores[:, :-1, :]
+
+                # Retrieve the token scores corresponding to the target id
+                tokens_scores = pred_scores.gather(dim=2, index=target_ids.unsqueeze(2)).squeeze(2)
+
+                # Zeros the score of pad tokens
+                tokens_scores *= no_pad_mask[:, 1:]
+
+                # Return the sum of tokens scores without taking into account context token
+                return torch.sum(tokens_scores[:, len(self.context_ids):], dim=1).tolist()
+
+    def _compute_single_cached_batch(self, sentences_token_ids: List[List[int]]) -> List[float]:
+        if self._context_past is None:
+            # set_context was never called
+            self.set_context(self.context)
+
+        with self._stage("padding"):
+            flat_ids, offsets = self._flatten(sentences_token_ids)
+            input_ids, no_pad_mask = self._pad(flat_ids, offsets, pad_token_id=self.tokenizer.eos_token_id)
+
+        with torch.no_grad():
+            with self._stage("forward"):
+                # The cached states are shared by all the sentences of the batch
+                past = self._expand_past(self._context_past, len(sentences_token_ids))
+                pred_logits = self.model(input_ids, past=past, use_cache=False)[0]
+
+            with self._stage("log_prob"):
+                pred_scores = torch.nn.LogSoftmax(dim=2)(pred_logits)
+
+                # The first token is predicted from the context, the following ones from the previous token
+                first_tokens_scores = self._context_next_log_probs[input_ids[:, 0]] * no_pad_mask[:, 0]
+                target_ids = input_ids[:, 1:]
+                tokens_scores = pred_scores[:, :-1, :].gather(dim=2, index=target_ids.unsqueeze(2)).squeeze(2)
+                tokens_scores *= no_pad_mask[:, 1:]
+
+                return (first_tokens_scores + torch.sum(tokens_scores, dim=1)).tolist()
+
+    @staticmethod
+    def _expand_past(past: List[torch.Tensor], batch_size: int) -> List[torch.Tensor]:
+        """
+        Share the cached states of a single sequence with all the sequences of a batch (without copying them).
+        The cached states are used with the layout of transformers 3.0.x: one tensor per layer of shape
+        [2 (key and value), 1, nb_heads, seq_len, head_size], given back to the model with the past argument.
+        """
+        assert all(
+            isinstance(layer_past, torch.Tensor) and layer_past.dim() == 5 and layer_past.shape[:2] == (2, 1)
+            for layer_past in past
+        ), "Unsupported layout of the GPT2 cached states (past), the cached context needs transformers 3.0.x"
+        return [layer_past.expand(-1, batch_size, -1, -1, -1) for layer_past in past]
+
+    def _compute_single_packed_batch(self, sentences_token_ids: List[List[int]], rows_sizes: List[int]) -> List[float]:
+        with self._stage("padding"):
+            flat_ids, offsets = self._flat_input_ids(sentences_token_ids)
+            input_ids, position_ids, segment_ids = self._pad_packed(
+                flat_ids, offsets, rows_sizes, pad_token_id=self.tokenizer.eos_token_id
+            )
+            # Each token can only attend to the previous tokens of its own segment
+            attention_mask = (segment_ids.unsqueeze(2) == segment_ids.unsqueeze(1)).tril()
+
+        with torch.no_grad():
+            with self._stage("forward"):
+                pred_logits = self._packed_forward(input_ids, position_ids, attention_mask)
+
+            with self._stage("log_prob"):
+                pred_scores = torch.nn.LogSoftmax(dim=2)(pred_logits)
+
+                # Align input and target
+                target_ids = input_ids[:, 1:]
+                pred_scores = pred_scores[:, :-1, :]
+                tokens_scores = pred_scores.gather(dim=2, index=target_ids.unsqueeze(2)).squeeze(2)
+
+                # Only keep the sentence tokens (ie: not the BOS, context and pad tokens)
+                # and sum their scores by segment
+                target_segment_ids = segment_ids[:, 1:]
+                is_sentence_token = (target_segment_ids != -1) & (position_ids[:, 1:] > len(self.context_ids))
+                sentences_scores = torch.zeros(len(sentences_token_ids), dtype=tokens_scores.dtype, device=self.device)
+                sentences_scores.index_add_(0, target_segment_ids[is_sentence_token], tokens_scores[is_sentence_token])
+
+                return sentences_scores.tolist()
+
+    # /////////////////////////////////////////////////////////////////
+    # Score several continuations of a same left part
+    # /////////////////////////////////////////////////////////////////
+
+    def score_continuations(self, left: str, continuations: List[str]) -> List[float]:
+        """
+        Return the same scores as compute_score([left + " " + continuation for continuation in continuations])
+        (or compute_score(continuations) if left is empty) but [BOS] context left is only input once to the model.
+        - the first token of each continuation is scored from the next token distribution of the left part,
+        so if all continuations are single tokens, no other forward pass is needed
+        - the multi-token continuations are arranged in a trie and only its branches (continuations that
+        are not the prefix of another one) are input to the model, from the cached states of the left part
+        """
+        assert self.is_already_built, "You have to first build the model."
+
+        with self._stage("total"):
+            with self._stage("tokenization"):
+                # Same tokenization as in compute_score : with BPE, a space is needed before the words
+                space = " " if self.context_ids != [] else ""
+                left_encoding: BatchEncoding = self.tokenizer(space + left if left else "", add_special_tokens=False)
+                continuations_space = " " if left else space
+                encoding: BatchEncoding = self.tokenizer(
+                    [continuations_space + continuation for continuation in continuations], add_special_tokens=False
+                )
+                left_ids = left_encoding["input_ids"]
+
+            with torch.no_grad():
+                with self._stage("forward"):
+                    prefix_ids = [self.tokenizer.bos_token_id] + self.context_ids + left_ids
+                    logits, past = self.model(torch.tensor([prefix_ids], device=self.device), use_cache=True)[:2]
+
+                with self._stage("log_prob"):
+                    prefix_scores = torch.nn.LogSoftmax(dim=1)(logits[0])
+                    # Sum of the scores of the left tokens, without taking into account context tokens
+                    left_scores = prefix_scores[len(self.context_ids) : -1].gather(
+                        dim=1, index=torch.tensor(left_ids, dtype=torch.long, device=self.device).unsqueeze(1)
+                    )
+                    left_score = torch.sum(left_scores).item()
+
+                continuations_scores = self._compute_continuations_log_prob(encoding["input_ids"], past, prefix_scores[-1])
+
+            with self._stage("normalization"):
+                left_tokens = left_encoding.tokens()
+                normalized_scores = [
+                    math.exp(self.score_normalization(left_score + score, left_tokens + encoding.tokens(i)))
+                    for i, score in enumerate(continuations_scores)
+                ]
+
+        if self.stats is not None:
+            self.stats.record_call(len(continuations))
+
+        return normalized_scores
+
+    def _compute_continuations_log_prob(
+        self, continuations_ids: List[List[int]], past: List[torch.Tensor], next_token_scores: torch.Tensor
+    ) -> List[float]:
+        # Build the trie of the continuations and retrieve for each continuation a branch that contains it
+        trie: Dict[int, Dict] = dict()
+        for token_ids in continuations_ids:
+            node = trie
+            for token_id in token_ids:
+                node = node.setdefault(token_id, dict())
+
+        continuations_branches = []
+        for token_ids in continuations_ids:
+            node, branch = trie, list(token_ids)
+            for token_id in token_ids:
+                node = node[token_id]
+            while node:
+                token_id = next(iter(node))
+                branch.append(token_id)
+                node = node[token_id]
+            continuations_branches.append(tuple(branch))
+
+        # Only the branches with more than one token need to be input to the model
+        # For each of them, keep the cumulated scores of its tokens (the first token excepted)
+        branches = [branch for branch in dict.fromkeys(continuations_branches) if len(branch) > 1]
+        cumulated_scores: Dict[Tuple[int, ...], List[float]] = dict()
+        for i in range(0, len(branches), self.batch_size):
+            batch = branches[i : i + self.batch_size]
+            with self._stage("padding"):
+                flat_ids, offsets = self._flatten(batch)
+                input_ids, no_pad_mask = self._pad(flat_ids, offsets, pad_token_id=self.tokenizer.eos_token_id)
+
+            with self._stage("forward"):
+                batch_past = self._expand_past(past, len(batch))
+                pred_logits = self.model(input_ids, past=batch_past, use_cache=False)[0]
+
+            with self._stage("log_prob"):
+                pred_scores = torch.nn.LogSoftmax(dim=2)(pred_logits)
+                tokens_scores = pred_scores[:, :-1, :].gather(dim=2, index=input_ids[:, 1:].unsqueeze(2)).squeeze(2)
+                tokens_scores *= no_pad_mask[:, 1:]
+                for branch, branch_scores in zip(batch, torch.cumsum(tokens_scores, dim=1).tolist()):
+                    cumulated_scores[branch] = branch_scores
 
-            # Align input and target
-            target_ids = input_ids[:, 1:]
-            pred_scores = pred_scores[:, :-1, :]
+        continuations_scores = []
+        for token_ids, branch in zip(continuations_ids, continuations_branches):
+            if len(token_ids) == 0:
+                continuations_scores.append(0.0)
+                continue
+            score = next_token_scores[token_ids[0]].item()
+            if len(token_ids) > 1:
+                score += cumulated_scores[branch][len(token_ids) - 2]
+            continuations_scores.append(score)
 
-            # Retrieve the token scores corresponding to the target id
-            tokens_scores = pred_scores.gather(dim=2, index=target_ids.unsqueeze(2)).squeeze(2)
+        return continuations_scores
 
-            # Zeros the score of pad tokens
-            tokens_scores *= no_pad_mask[:, 1:]
+    def _packed_forward(
+        self, input_ids: torch.Tensor, position_ids: torch.Tensor, attention_mask: torch.Tensor
+    ) -> torch.Tensor:
+        """
+        GPT2Model flattens its attention mask to [batch_size, seq_len], so in order to use a block-diagonal mask
+        the embeddings, the blocks and the head of the model are called directly, the [batch_size, seq_len, seq_len]
+        mask (which must therefore already be causal) being given to each block as an additive mask.
+        The model is not modified, so it can be shared between scorers and threads.
+        """
+        transformer = getattr(self.model, "transformer", None)
+        assert transformer is not None and all(
+            hasattr(transformer, name) for name in ["wte", "wpe", "drop", "h", "ln_f"]
+        ), "Packing is not supported by this GPT2 implementation"
 
-        # Return the sum of tokens scores without taking into account context token
-        return torch.sum(tokens_scores[:, len(self.context_ids):], dim=1).tolist()
+        hidden_states = transformer.drop(transformer.wte(input_ids) + transformer.wpe(position_ids))
+        # shape = [batch_size, 1, seq_len, seq_len], broadcasted over the heads
+        additive_mask = (1.0 - attention_mask.unsqueeze(1).to(hidden_states.dtype)) * -10000.0
+        for block in transformer.h:
+            outputs = block(hidden_states, attention_mask=additive_mask)
+            hidden_states = outputs[0] if isinstance(outputs, (tuple, list)) else outputs
+        return self.model.lm_head(transformer.ln_f(hidden_states))
@@ -0,0 +1,118 @@
+"""
+Define a statistics object that keeps track of where the time is spent inside a sentence scorer
+"""
+
+from typing import *
+import time
+
+
+class _Stage:
+    """
+    Context manager that adds the wall and CPU time spent inside to one stage of a ScoringStats object
+    """
+
+    __slots__ = ("_stats", "_name", "_begin_wall_time", "_begin_cpu_time")
+
+    def __init__(self, stats: "ScoringStats", name: str):
+        self._stats = stats
+        self._name = name
+
+    def __enter__(self):
+        self._begin_wall_time = time.perf_counter()
+        self._begin_cpu_time = time.process_time()
+
+    def __exit__(self, *args):
+        self._stats.add_stage_time(
+            self._name,
+            time.perf_counter() - self._begin_wall_time,
+            time.process_time() - self._begin_cpu_time,
+        )
+
+
+class ScoringStats:
+    """
+    Statistics accumulated by a SentenceScore object over all its calls to compute_score:
+    - the wall time and the CPU time spent in each stage of the pipeline
+      (tokenization, padding, forward, log_prob, normalization, plus total)
+    - the number of sentences scored and the number of tokens that were input to the model
+    - the padding ratio, ie: the proportion of pad tokens in the batches input to the model
+    - the histogram of the batch sizes
+
+    Wall time is measured with time.perf_counter so that the time spent waiting on other threads
+    is taken into account. CPU time is the process time (all threads included).
+    """
+
+    STAGES = ("tokenization", "padding", "forward", "log_prob", "normalization", "total")
+
+    def __init__(self):
+        self.wall_time: Dict[str, float]
+        self.cpu_time: Dict[str, float]
+        self.nb_calls: int
+        self.nb_sentences: int
+        self.nb_tokens: int
+        self.nb_pad_tokens: int
+        self.batch_size_histogram: Dict[int, int]
+        self.reset()
+
+    def reset(self):
+        self.wall_time = {stage: 0.0 for stage in self.STAGES}
+        self.cpu_time = {stage: 0.0 for stage in self.STAGES}
+        self.nb_calls = 0
+        self.nb_sentences = 0
+        self.nb_tokens = 0
+        self.nb_pad_tokens = 0
+        self.batch_size_histogram = dict()
+
+    def stage(self, name: str) -> _Stage:
+        return _Stage(self, name)
+
+    def add_stage_time(self, name: str, wall_time: float, cpu_time: float):
+        self.wall_time[name] = self.wall_time.get(name, 0.0) + wall_time
+        self.cpu_time[name] = self.cpu_time.get(name, 0.0) + cpu_time
+
+    def record_call(self, nb_sentences: int):
+        self.nb_calls += 1
+        self.nb_sentences += nb_sentences
+
+    def record_batch(self, batch_size: int, nb_tokens: int, nb_padded_tokens: int):
+        """
+        :param batch_size: number of sequences in the batch
+        :param nb_tokens: number of real tokens in the batch
+        :param nb_padded_tokens: size of the batch once padded (batch_size * max_seq_len)
+        """
+        self.nb_tokens += nb_tokens
+        self.nb_pad_tokens += nb_padded_tokens - nb_tokens
+        self.batch_size_histogram[batch_size] = self.batch_size_histogram.get(batch_size, 0) + 1
+
+    def padding_ratio(self) -> float:
+        nb_input_tokens = self.nb_tokens + self.nb_pad_tokens
+        return self.nb_pad_tokens / nb_input_tokens if nb_input_tokens else 0.0
+
+    def sentences_per_second(self) -> float:
+        return self.nb_sentences / self.wall_time["total"] if self.wall_time["total"] else 0.0
+
+    def summary(self) -> Dict:
+        """
+        Return a snapshot of the statistics as a plain dictionary (times in ms)
+        """
+        return {
+            "wall_time_ms": {stage: 1000 * value for stage, value in self.wall_time.items()},
+            "cpu_time_ms": {stage: 1000 * value for stage, value in self.cpu_time.items()},
+            "nb_calls": self.nb_calls,
+            "nb_sentences": self.nb_sentences,
+            "nb_tokens": self.nb_tokens,
+            "nb_pad_tokens": self.nb_pad_tokens,
+            "padding_ratio": self.padding_ratio(),
+            "batch_size_histogram": dict(sorted(self.batch_size_histogram.items())),
+            "sentences_per_second": self.sentences_per_second(),
+        }
+
+    def print_stats(self):
+        for stage in self.wall_time:
+            print(
+                "Time spent in %s : %0.2f ms (wall) / %0.2f ms (cpu)"
+                % (stage, self.wall_time[stage] * 1000, self.cpu_time[stage] * 1000)
+            )
+        print("Sentences scored : %d (%0.1f sentences / s)" % (self.nb_sentences, self.sentences_per_second()))
+        print("Tokens processed : %d (padding ratio : %0.2f)" % (self.nb_tokens, self.padding_ratio()))
+        print("Batch size histogram : %s" % str(dict(sorted(self.batch_size_histogram.items()))))
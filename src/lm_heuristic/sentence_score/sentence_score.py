@@ -4,15 +4,20 @@ Define an abstract class from which all transformers-based sentence scorer must
 
 from abc import ABC, abstractmethod
 from typing import *
+from itertools import accumulate, chain
+from contextlib import nullcontext
 import logging
+import threading
 import numpy as np
 import math
 
 from transformers import AutoModelWithLMHead, AutoTokenizer, PreTrainedTokenizer, PreTrainedModel, BatchEncoding
 
 import torch
+from tqdm.autonotebook import tqdm
 
 from .unigram import load_unigram
+from .scoring_stats import ScoringStats
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +32,10 @@ class SentenceScore(ABC):
     studied by in Jey Han Lau, Carlos Armendariz, Shalom Lappin, Matthew Purver, and Chang Shu
     and presented in the paper (2020) "How Furiously Can Colorless Green Ideas Sleep? Sentence
     Acceptability in Context."
+
+    The padded batches are assembled in buffers that are reused from one batch to the other (cf _pad).
+    Each thread gets its own buffers, so a same scorer can be shared by several threads
+    (ie: ParallelEvalBuffer with parallel_strategy="multithread", EvaluationService).
     """
 
     def __init__(
@@ -38,7 +47,20 @@ class SentenceScore(ABC):
         progress_bar: bool = False,
         load_unigram_file: bool = False,
         normalization_strategy="LP",
+        track_stats: bool = False,
+        packing_length: int = None,
+        context_window: int = None,
+        context_stride: int = 1,
     ):
+        """
+        :param track_stats: if True, keep in self.stats a ScoringStats object that accumulates
+        the time spent in each stage of compute_score along with token and batch statistics
+        :param packing_length: if provided, several short sequences are packed in a same row of at most
+        packing_length tokens (each sequence only attending to itself), batch_size is then a number of rows
+        :param context_window: if provided, only the last tokens of the context are kept (at most context_window)
+        :param context_stride: when the context grows over context_window, the window start is moved forward
+        by multiples of context_stride tokens (so that the same window can be reused while the context grows)
+        """
         self.model_name = model_name
         self.batch_size = batch_size
         self.progress_bar = progress_bar
@@ -52,6 +74,12 @@ class SentenceScore(ABC):
 
         self.context = None
         self.context_ids: List[int] = []
+        assert not context_window or 1 <= context_stride <= context_window, (
+            "context_stride must be between 1 and context_window"
+        )
+        self.context_window = context_window
+        self.context_stride = context_stride
+        self._context_start = 0  # position of the first kept context token in the full context
         self.tokenizer: PreTrainedTokenizer
 
         self.load_unigram_file = load_unigram_file
@@ -60,6 +88,26 @@ class SentenceScore(ABC):
             self.unigram_total = sum(self.unigram_count.values())
 
         self.normalization_strategy = normalization_strategy
+        self.packing_length = packing_length
+        if self.model is not None:
+            self._check_packing_length()
+
+        # Flat buffers in which the padded batches are assembled (see _pad), by thread: they are freed with their
+        # thread, kept between two batches and only reallocated when a bigger batch comes
+        self._local = threading.local()
+
+        self.stats: Optional[ScoringStats] = ScoringStats() if track_stats else None
+        self._no_stage = nullcontext()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # The buffers of the threads are not pickled (ie: scorer sent to a spawned evaluation process)
+        state = self.__dict__.copy()
+        del state["_local"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        self._local = threading.local()
 
     def build(self):
         if self.is_already_built:
@@ -70,11 +118,30 @@ class SentenceScore(ABC):
         self.model = AutoModelWithLMHead.from_pretrained(self.model_name)
         self.model.to(self.device)
         self.model.eval()
+        self._check_packing_length()
         return self
 
+    def _check_packing_length(self):
+        # The packed rows must fit in the position embeddings of the model
+        config = self.model.config
+        max_length = getattr(config, "n_positions", None) or getattr(config, "max_position_embeddings", None)
+        assert not self.packing_length or not max_length or self.packing_length <= max_length, (
+            "packing_length (%d) must not exceed the maximal sequence length of the model (%d)"
+            % (self.packing_length, max_length)
+        )
+
     def set_context(self, context):
         self.context = context
-        self.context_ids = self.tokenizer(context, add_special_tokens=False)["input_ids"] if self.context else []
+        context_ids = self.tokenizer(context, add_special_tokens=False)["input_ids"] if self.context else []
+        self._context_start = self._context_window_start(len(context_ids))
+        self.context_ids = context_ids[self._context_start :]
+
+    def _context_window_start(self, nb_context_tokens: int) -> int:
+        if not self.context_window or nb_context_tokens <= self.context_window:
+            return 0
+        # Smallest multiple of context_stride that keeps at most context_window tokens
+        nb_strides = -(-(nb_context_tokens - self.context_window) // self.context_stride)
+        return nb_strides * self.context_stride
 
     @abstractmethod
     def _compute_transformers_log_prob_scores(self, sentences_token_ids: List[List[int]]) -> List[float]:
@@ -116,39 +183,181 @@ class SentenceScore(ABC):
 
         sentences = [text] if isinstance(text, str) else text
 
-        if self.context_ids != []:
-            # Because in BPE, tokenisation is different if there is a space before a word
-            sentences = [" " + sentence for sentence in sentences]
+        with self._stage("total"):
+            with self._stage("tokenization"):
+                if self.context_ids != []:
+                    # Because in BPE, tokenisation is different if there is a space before a word
+                    sentences = [" " + sentence for sentence in sentences]
 
-        # We can not directly input the special tokens because we first have to insert the context
-        encoding: BatchEncoding = self.tokenizer(sentences, add_special_tokens=False)
-        raw_sentences_score = self._compute_transformers_log_prob_scores(encoding["input_ids"])
+                # We can not directly input the special tokens because we first have to insert the context
+                encoding: BatchEncoding = self.tokenizer(sentences, add_special_tokens=False)
 
-        normalized_sentences_scores = []
-        for i, sentence_score in enumerate(raw_sentences_score):
-            normalized_sentences_scores.append(math.exp(self.score_normalization(sentence_score, encoding.tokens(i))))
+            raw_sentences_score = self._compute_transformers_log_prob_scores(encoding["input_ids"])
+
+            with self._stage("normalization"):
+                normalized_sentences_scores = []
+                for i, sentence_score in enumerate(raw_sentences_score):
+                    normalized_sentences_scores.append(
+                        math.exp(self.score_normalization(sentence_score, encoding.tokens(i)))
+                    )
+
+        if self.stats is not None:
+            self.stats.record_call(len(sentences))
 
         return normalized_sentences_scores[0] if isinstance(text, str) else normalized_sentences_scores
 
     def __call__(self, sentences):
         return self.compute_score(sentences)
 
+    def _stage(self, name: str):
+        """
+        Return a context manager that accumulates the time spent inside in the given stage
+        (does nothing if the stats are not tracked)
+        """
+        return self.stats.stage(name) if self.stats is not None else self._no_stage
+
     @staticmethod
-    def _pad(sequences: List[torch.Tensor], pad_token_id) -> Tuple[torch.Tensor, torch.Tensor]:
+    def _flatten(sequences: List[List[int]]) -> Tuple[List[int], List[int]]:
+        """
+        Concatenate the sequences into a single list of token ids
+        and return it along with the offsets at which each sequence starts (plus the total length)
+        """
+        offsets = [0]
+        offsets.extend(accumulate(map(len, sequences)))
+        return list(chain.from_iterable(sequences)), offsets
+
+    def _reserve_buffer(self, name: str, size: int, dtype: torch.dtype, staging=False) -> torch.Tensor:
+        """
+        Return the first size elements of a flat buffer of the current thread (reallocated when it is too small).
+        The staging buffers are on the host (pinned memory if the model is on a GPU), so that numpy can write in them.
+        """
+        buffers = getattr(self._local, "buffers", None)
+        if buffers is None:
+            buffers = self._local.buffers = dict()
+        buffer = buffers.get(name)
+        if buffer is None or buffer.numel() < size:
+            new_size = max(size, 2 * buffer.numel()) if buffer is not None else size
+            if staging:
+                pin_memory = torch.device(self.device).type == "cuda"
+                buffer = torch.empty(new_size, dtype=dtype, pin_memory=pin_memory)
+            else:
+                buffer = torch.empty(new_size, dtype=dtype, device=self.device)
+            buffers[name] = buffer
+        return buffer[:size]
+
+    def _token_range(self, size: int) -> np.ndarray:
+        # 0, 1, ..., size - 1 (kept by the current thread)
+        token_range = getattr(self._local, "token_range", None)
+        if token_range is None or len(token_range) < size:
+            new_size = max(size, 2 * len(token_range)) if token_range is not None else size
+            token_range = self._local.token_range = np.arange(new_size)
+        return token_range[:size]
+
+    def _to_device(self, name: str, staging_buffer: torch.Tensor) -> torch.Tensor:
+        # Copy of a staging buffer in a device buffer of the current thread (no copy if the model is on the host)
+        if torch.device(self.device).type == "cpu":
+            return staging_buffer
+        return self._reserve_buffer(name, staging_buffer.numel(), staging_buffer.dtype).copy_(staging_buffer)
+
+    def _assemble(
+        self, flat_ids: List[int], offsets: List[int], pad_token_id: int
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        # Return the padded input ids, the no pad mask and the flat position of each token in the batch (cf _pad)
+        nb_sequences = len(offsets) - 1
+        max_seq_len = max(end - start for start, end in zip(offsets, offsets[1:]))
+        size = nb_sequences * max_seq_len
+
+        # The token ids and their flat positions are written in place in the staging buffers
+        ids_staging = self._reserve_buffer("ids_staging", len(flat_ids), torch.long, staging=True)
+        positions_staging = self._reserve_buffer("positions_staging", len(flat_ids), torch.long, staging=True)
+        ids_staging.numpy()[:] = flat_ids
+        positions, token_range = positions_staging.numpy(), self._token_range(len(flat_ids))
+        for row, (start, end) in enumerate(zip(offsets, offsets[1:])):
+            np.add(token_range[start:end], row * max_seq_len - start, out=positions[start:end])
+        ids = self._to_device("ids", ids_staging)
+        positions = self._to_device("positions", positions_staging)
+
+        # Views on the front of the flat buffers, so that the batch tensors stay contiguous
+        input_ids = self._reserve_buffer("input_ids", size, torch.long)
+        no_pad_mask = self._reserve_buffer("no_pad_mask", size, torch.float)
+        input_ids.fill_(pad_token_id).index_copy_(0, positions, ids)
+        no_pad_mask.zero_().index_fill_(0, positions, 1.0)
+
+        if self.stats is not None:
+            self.stats.record_batch(nb_sequences, len(flat_ids), size)
+
+        return input_ids.view(nb_sequences, max_seq_len), no_pad_mask.view(nb_sequences, max_seq_len), positions
+
+    def _pad(self, flat_ids: List[int], offsets: List[int], pad_token_id: int) -> Tuple[torch.Tensor, torch.Tensor]:
         """
-        rewrite torch.nn.utils.rnn.pad_sequence so that it return a boolean mask of pad position
-        the advantage is that we can avoid to add custom pad token to the model and pad directly
-        with any token we want
+        Assemble a padded batch from the concatenation of all its sequences (flat_ids) and the offsets
+        at which each sequence starts (the last offset being len(flat_ids)). Also return a mask of non pad
+        positions, so that we can pad directly with any token we want without adding a custom pad token to the model.
+
+        The token ids are written in buffers that are reused from one batch to the other by the same thread:
+        the returned tensors are only valid until the next call to _pad from this thread.
         """
-        max_seq_len = max([s.size(0) for s in sequences])
-        out_tensor = sequences[0].data.new(len(sequences), max_seq_len).fill_(pad_token_id)  # type:ignore
-        mask = torch.zeros((len(sequences), max_seq_len), device=sequences[0].device)
-        for i, tensor in enumerate(sequences):
-            length = tensor.size(0)
-            out_tensor[i, :length] = tensor
-            mask[i, :length] = 1
+        input_ids, no_pad_mask, _ = self._assemble(flat_ids, offsets, pad_token_id)
+        return input_ids, no_pad_mask
 
-        return out_tensor, mask
+    def _pack(self, sequences_lengths: List[int]) -> List[int]:
+        """
+        Greedily pack consecutive sequences in rows of at most packing_length tokens
+        (a longer sequence gets its own row) and return the number of sequences in each row
+        """
+        rows_sizes: List[int] = []
+        row_length = 0
+        for length in sequences_lengths:
+            if rows_sizes and row_length + length <= self.packing_length:
+                rows_sizes[-1] += 1
+                row_length += length
+            else:
+                rows_sizes.append(1)
+                row_length = length
+        return rows_sizes
+
+    def _packed_batches(self, sequences_lengths: List[int]) -> Iterator[Tuple[int, int, List[int]]]:
+        """
+        Split the packed rows by batch of batch_size rows and for each batch yield
+        the index of its first and last (excluded) sequences along with its rows sizes
+        """
+        rows_sizes = self._pack(sequences_lengths)
+        first = 0
+        for i in tqdm(range(0, len(rows_sizes), self.batch_size), disable=not self.progress_bar):
+            batch_rows_sizes = rows_sizes[i : i + self.batch_size]
+            last = first + sum(batch_rows_sizes)
+            yield first, last, batch_rows_sizes
+            first = last
+
+    def _pad_packed(
+        self, flat_ids: List[int], offsets: List[int], rows_sizes: List[int], pad_token_id: int
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        """
+        Same as _pad except that the sequences are first packed in rows (rows_sizes[i] consecutive sequences in row i).
+        Return the padded input ids along with:
+        - the position ids, which restart from 0 at the beginning of each sequence
+        - the segment ids, ie: the index of the sequence each token belongs to (-1 for pad tokens)
+        """
+        row_offsets = [offsets[i] for i in accumulate([0] + rows_sizes)]
+        input_ids, _, positions = self._assemble(flat_ids, row_offsets, pad_token_id)
+
+        # Position and segment ids of the tokens, written in the staging buffers as the token ids (cf _assemble)
+        position_ids_staging = self._reserve_buffer("position_ids_staging", len(flat_ids), torch.long, staging=True)
+        segment_ids_staging = self._reserve_buffer("segment_ids_staging", len(flat_ids), torch.long, staging=True)
+        token_range = self._token_range(len(flat_ids))
+        token_position_ids, token_segment_ids = position_ids_staging.numpy(), segment_ids_staging.numpy()
+        for sequence, (start, end) in enumerate(zip(offsets, offsets[1:])):
+            np.subtract(token_range[start:end], start, out=token_position_ids[start:end])
+            token_segment_ids[start:end] = sequence
+
+        size = input_ids.numel()
+        position_ids = self._reserve_buffer("position_ids", size, torch.long).zero_()
+        position_ids.index_copy_(0, positions, self._to_device("position_ids_device", position_ids_staging))
+        segment_ids = self._reserve_buffer("segment_ids", size, torch.long).fill_(-1)
+        segment_ids.index_copy_(0, positions, self._to_device("segment_ids_device", segment_ids_staging))
+
+        position_ids, segment_ids = position_ids.view_as(input_ids), segment_ids.view_as(input_ids)
+        return input_ids, position_ids, segment_ids
 
     # /////////////////////////////////////////////////////////////////
     # Define some methods to make it easier to test the sentence scorer
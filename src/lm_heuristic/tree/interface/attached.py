@@ -0,0 +1,31 @@
+"""
+Define a helper to keep the objects derived from a grammar (compiled tables, indexes, memo tables, ...)
+on the grammar object itself, so that they are only built once per grammar and freed with it
+"""
+
+from typing import *
+
+T = TypeVar("T")
+
+
+def attached(
+    obj: Any,
+    attribute: str,
+    factory: Callable[[], T],
+    is_stale: Callable[[T], bool] = None,
+    discard: Callable[[T], None] = None,
+) -> T:
+    """
+    return the object kept on obj under attribute, it is created by factory the first time
+    :param is_stale: if provided and it returns True for the kept object, a new one is created
+    :param discard: called on the stale object before it is replaced (ie: to release its resources)
+    """
+    value = getattr(obj, attribute, None)
+    if value is not None and is_stale is not None and is_stale(value):
+        if discard is not None:
+            discard(value)
+        value = None
+    if value is None:
+        value = factory()
+        setattr(obj, attribute, value)
+    return value
@@ -0,0 +1,235 @@
+"""
+Define a derivation counter : a dynamic programming analysis over the tables of a compiled context-free grammar
+that gives exact statistics on the tree of the derivations and a uniform leaf sampler
+"""
+
+from typing import *
+from collections import OrderedDict
+import random
+
+from .attached import attached
+from .compiled_cfg import CompiledCFG
+
+# Number of derivation counters kept on a compiled grammar (cf derivation_counter)
+MAX_DERIVATION_COUNTERS = 64
+
+
+class DerivationCounter:
+    """
+    Count the leaves of the tree built from a derivation (tuple of symbol ids) by a left to right CFGrammarNode
+    (with shrink), by depth and up to max_depth (root's depth = 1, as in TreeStats).
+
+    Each expansion of a non terminal symbol with the closure tables of the compiled grammar adds one level
+    to the tree, except the expansions of the symbols whose closure has a single right hand side: their node
+    is shrunk, unless it is the last expansion of the derivation (the leaf is then the single child of its parent).
+    So for each non terminal symbol A and each number of levels L, the analysis counts the derivations of A
+    adding L levels (and among them, the ones whose last expansion is shrunk):
+    - with big ints, counts[A][L] is the number of derivations (leaves)
+    - with floats, probabilities[A][L] is the probability that a random walk (uniform choice among the children
+    at each node, cf Node.random_walk) reaches a leaf after L levels
+
+    The derivations are counted (if the grammar is ambiguous, a same string can be counted several times).
+    The counts are then used to sample the leaves uniformly (among the leaves up to max_depth).
+    """
+
+    def __init__(self, compiled_cfg: CompiledCFG, ids: Tuple[int, ...], max_depth: int = 50):
+        self.compiled_cfg = compiled_cfg
+        self.ids = ids
+        self.max_depth = max_depth
+        self._max_levels = max_depth - 1
+
+        nb_nonterminals = compiled_cfg.nb_nonterminals
+        self._rhs_list = [compiled_cfg.closure_rhs(-idx - 1) for idx in range(nb_nonterminals)]
+        self._rhs_nonterminals = [
+            [[-symbol_id - 1 for symbol_id in rhs if symbol_id < 0] for rhs in rhs_list] for rhs_list in self._rhs_list
+        ]
+        # Number of levels added by the expansion of each symbol (0 if its node is shrunk)
+        self._costs = [0 if len(rhs_list) == 1 else 1 for rhs_list in self._rhs_list]
+        self._order = self._expansion_order()
+
+        self._root_nonterminals = [-symbol_id - 1 for symbol_id in ids if symbol_id < 0]
+        self.counts, self._last_shrunk_counts, self._prefixes, self._root_prefix = self._run(0, 1, uniform_walk=False)
+        self.probabilities, self._last_shrunk_probabilities, _, self._root_walk_prefix = self._run(
+            0.0, 1.0, uniform_walk=True
+        )
+
+        self.depth_counts = self._by_depth(self.counts, self._last_shrunk_counts, self._root_prefix)
+        self.walk_depth_probabilities = self._by_depth(
+            self.probabilities, self._last_shrunk_probabilities, self._root_walk_prefix
+        )
+        self.nb_leaves = sum(self.depth_counts.values())
+        # Probability that a random walk goes deeper than max_depth (0 if all the leaves were counted)
+        self.truncated_probability = max(0.0, 1.0 - sum(self.walk_depth_probabilities.values()))
+
+    def _expansion_order(self) -> List[int]:
+        """
+        The derivations of a shrunk symbol adding L levels depend on the derivations of its right hand side
+        adding L levels too: at each level, the shrunk symbols are processed after the symbols they depend on
+        (there is no cycle between the productive shrunk symbols)
+        """
+        order = [idx for idx, cost in enumerate(self._costs) if cost == 1]
+        visited = [cost == 1 for cost in self._costs]
+
+        def visit(idx: int):
+            visited[idx] = True
+            for nonterminal in self._rhs_nonterminals[idx][0]:
+                if not visited[nonterminal]:
+                    visit(nonterminal)
+            order.append(idx)
+
+        for idx, is_visited in enumerate(visited):
+            if not is_visited:
+                visit(idx)
+        return order
+
+    def _run(self, zero, one, uniform_walk: bool):
+        nb_levels = self._max_levels + 1
+        totals = [[zero] * nb_levels for _ in self._rhs_list]
+        last_shrunk = [[zero] * nb_levels for _ in self._rhs_list]
+        # prefixes[A][r][j][s] : weight of the derivations of the j first non terminal symbols of the r-th
+        # right hand side of A adding s levels
+        prefixes = [[self._new_prefix(nts, zero, one) for nts in rhs_nts] for rhs_nts in self._rhs_nonterminals]
+
+        for level in range(nb_levels):
+            for idx in self._order:
+                rhs_list, cost = self._rhs_list[idx], self._costs[idx]
+                if not rhs_list or level < cost:
+                    continue
+
+                weight = one / len(rhs_list) if uniform_walk else one
+                for nts, prefix in zip(self._rhs_nonterminals[idx], prefixes[idx]):
+                    if not nts:
+                        if level == cost:
+                            totals[idx][level] += weight
+                            if cost == 0:
+                                last_shrunk[idx][level] += weight
+                        continue
+                    self._extend_prefix(prefix, nts, totals, level - cost)
+                    totals[idx][level] += weight * prefix[-1][level - cost]
+                    last_shrunk[idx][level] += weight * self._convolve(prefix[-2], last_shrunk[nts[-1]], level - cost)
+
+        root_prefix = self._new_prefix(self._root_nonterminals, zero, one)
+        for level in range(nb_levels):
+            self._extend_prefix(root_prefix, self._root_nonterminals, totals, level)
+        return totals, last_shrunk, prefixes, root_prefix
+
+    def _new_prefix(self, nonterminals: List[int], zero, one) -> List[List]:
+        return [[one] + [zero] * self._max_levels] + [[zero] * (self._max_levels + 1) for _ in nonterminals]
+
+    @staticmethod
+    def _convolve(left: List, right: List, level: int):
+        return sum(left[level - t] * right[t] for t in range(level + 1))
+
+    def _extend_prefix(self, prefix: List[List], nonterminals: List[int], totals: List[List], level: int):
+        for j, nonterminal in enumerate(nonterminals):
+            prefix[j + 1][level] = self._convolve(prefix[j], totals[nonterminal], level)
+
+    def _by_depth(self, totals: List[List], last_shrunk: List[List], root_prefix: List[List]) -> Dict[int, Any]:
+        if not self._root_nonterminals:
+            return {1: root_prefix[0][0]}
+        by_depth: Dict[int, Any] = dict()
+        for level in range(self._max_levels + 1):
+            shrunk = self._convolve(root_prefix[-2], last_shrunk[self._root_nonterminals[-1]], level)
+            for depth, weight in [(level + 1, root_prefix[-1][level] - shrunk), (level + 2, shrunk)]:
+                if weight and depth <= self.max_depth:
+                    by_depth[depth] = by_depth.get(depth, 0) + weight
+        return by_depth
+
+    def sample(self) -> Optional[Tuple[int, ...]]:
+        """
+        return a leaf (tuple of symbol ids) drawn uniformly among the leaves up to max_depth (None if there is not any)
+        """
+        if self.nb_leaves == 0:
+            return None
+        if not self._root_nonterminals:
+            return self.ids
+
+        nonterminals, prefix = self._root_nonterminals, self._root_prefix
+        candidates = []
+        for level in range(self._max_levels + 1):
+            shrunk = self._convolve(prefix[-2], self._last_shrunk_counts[nonterminals[-1]], level)
+            if level + 1 <= self.max_depth:
+                candidates.append(((level, False), prefix[-1][level] - shrunk))
+            if level + 2 <= self.max_depth:
+                candidates.append(((level, True), shrunk))
+        level, last_is_shrunk = _weighted_choice(candidates)
+
+        expansions = iter(self._sample_sequence(nonterminals, prefix, level, last_is_shrunk))
+        return self._substitute(self.ids, expansions)
+
+    def _sample_sequence(
+        self, nonterminals: List[int], prefix: List[List], level: int, last_is_shrunk: Optional[bool]
+    ) -> List[Tuple[int, ...]]:
+        expansions: List[Tuple[int, ...]] = [()] * len(nonterminals)
+        for j in reversed(range(len(nonterminals))):
+            nonterminal = nonterminals[j]
+            totals, shrunk = self.counts[nonterminal], self._last_shrunk_counts[nonterminal]
+            if j == len(nonterminals) - 1 and last_is_shrunk is not None:
+                weights = shrunk if last_is_shrunk else [total - s for total, s in zip(totals, shrunk)]
+                flag = last_is_shrunk
+            else:
+                weights, flag = totals, None
+            t = _weighted_choice([(t, prefix[j][level - t] * weights[t]) for t in range(level + 1)])
+            expansions[j] = self._sample_nonterminal(nonterminal, t, flag)
+            level -= t
+        return expansions
+
+    def _sample_nonterminal(self, nonterminal: int, level: int, last_is_shrunk: Optional[bool]) -> Tuple[int, ...]:
+        rhs_list, cost = self._rhs_list[nonterminal], self._costs[nonterminal]
+        candidates = []
+        for r, nts in enumerate(self._rhs_nonterminals[nonterminal]):
+            if not nts:
+                weight = 1 if level == cost and last_is_shrunk in (None, cost == 0) else 0
+            else:
+                prefix = self._prefixes[nonterminal][r]
+                weight = prefix[-1][level - cost]
+                if last_is_shrunk is not None:
+                    shrunk = self._convolve(prefix[-2], self._last_shrunk_counts[nts[-1]], level - cost)
+                    weight = shrunk if last_is_shrunk else weight - shrunk
+            candidates.append((r, weight))
+        r = _weighted_choice(candidates)
+
+        rhs, nts = rhs_list[r], self._rhs_nonterminals[nonterminal][r]
+        if not nts:
+            return rhs
+        expansions = self._sample_sequence(nts, self._prefixes[nonterminal][r], level - cost, last_is_shrunk)
+        return self._substitute(rhs, iter(expansions))
+
+    @staticmethod
+    def _substitute(ids: Tuple[int, ...], expansions: Iterator[Tuple[int, ...]]) -> Tuple[int, ...]:
+        leaf: List[int] = []
+        for symbol_id in ids:
+            if symbol_id >= 0:
+                leaf.append(symbol_id)
+            else:
+                leaf.extend(next(expansions))
+        return tuple(leaf)
+
+
+def _weighted_choice(candidates: List[Tuple[Any, int]]) -> Any:
+    # Exact choice with big int weights
+    threshold = random.randrange(sum(weight for _, weight in candidates))
+    for candidate, weight in candidates:
+        if threshold < weight:
+            return candidate
+        threshold -= weight
+    raise ValueError("Empty weighted choice")
+
+
+def derivation_counter(compiled_cfg: CompiledCFG, ids: Tuple[int, ...], max_depth: int = 50) -> DerivationCounter:
+    """
+    return the derivation counter of a derivation (only computed once per derivation and max_depth,
+    the MAX_DERIVATION_COUNTERS most recently used counters being kept on the compiled grammar)
+    """
+    counters: "OrderedDict[Tuple[Tuple[int, ...], int], DerivationCounter]" = attached(
+        compiled_cfg, "_derivation_counters", OrderedDict
+    )
+    key = (ids, max_depth)
+    counter = counters.get(key)
+    if counter is None:
+        counter = DerivationCounter(compiled_cfg, ids, max_depth)
+        counters[key] = counter
+        if len(counters) > MAX_DERIVATION_COUNTERS:
+            counters.popitem(last=False)
+    counters.move_to_end(key)
+    return counter
@@ -0,0 +1,135 @@
+"""
+Define a random leaf sampler that works directly on the tables of a compiled context-free grammar
+"""
+
+from typing import *
+import random
+
+import numpy as np
+
+from .attached import attached
+from .compiled_cfg import CompiledCFG
+
+
+class CFGSampler:
+    """
+    Sample random leaves from a derivation (tuple of symbol ids) the same way as a left to right random walk
+    (at each step, a uniformly chosen production rule is applied to the leftmost non terminal symbol),
+    but without building any intermediate node : the symbols that remain to be expanded are kept in a stack.
+
+    The single-choice chains are resolved with the closures of the compiled grammar, which does not change
+    the distribution of the leaves. A sampled leaf is None if the walk meets a DEAD_END.
+    """
+
+    def __init__(self, compiled_cfg: CompiledCFG):
+        self.compiled_cfg = compiled_cfg
+        # The right hand sides are stored reversed so that they can be directly pushed on the stack
+        self._reversed_closures = [
+            tuple(rhs[::-1] for rhs in compiled_cfg.closure_rhs(-idx - 1))
+            for idx in range(compiled_cfg.nb_nonterminals)
+        ]
+        # Tables used by sample_many (cf _build_rule_tables), only built at its first call
+        self._nb_rules: np.ndarray
+        self._rule_offsets: np.ndarray
+        self._rule_lengths: np.ndarray
+        self._rule_symbols: Optional[np.ndarray] = None
+
+    def sample(self, ids: Tuple[int, ...]) -> Optional[Tuple[int, ...]]:
+        reversed_closures = self._reversed_closures
+        choice = random.choice
+        leaf: List[int] = []
+        stack = list(ids[::-1])
+        while stack:
+            symbol_id = stack.pop()
+            if symbol_id >= 0:
+                leaf.append(symbol_id)
+                continue
+            rhs_list = reversed_closures[-symbol_id - 1]
+            if not rhs_list:
+                return None
+            stack.extend(choice(rhs_list))
+        return tuple(leaf)
+
+    def sample_many(
+        self, ids: Tuple[int, ...], nb_samples: int, rng: Optional[np.random.Generator] = None
+    ) -> List[Optional[Tuple[int, ...]]]:
+        """
+        Sample nb_samples leaves at once: the walks are vectorized across the batch. The stacks of all the samples
+        are kept in a single array and, at each step, the top symbol of every unfinished sample is popped
+        (terminal symbols are appended to the leaves, production rules are drawn and pushed for non terminal ones).
+
+        :param rng: numpy generator of the draws. By default, it is seeded from the random module,
+        so that the samples are reproducible with random.seed (as with sample)
+        """
+        if rng is None:
+            rng = np.random.default_rng(random.getrandbits(64))
+        if self._rule_symbols is None:
+            self._build_rule_tables()
+        nb_rules, rule_offsets = self._nb_rules, self._rule_offsets
+        rule_symbols, rule_lengths = self._rule_symbols, self._rule_lengths
+
+        stacks = np.empty((nb_samples, max(2 * len(ids), 16)), dtype=np.int64)
+        stacks[:, : len(ids)] = ids[::-1]
+        stack_sizes = np.full(nb_samples, len(ids), dtype=np.int64)
+        leaves = np.empty((nb_samples, 16), dtype=np.int64)
+        leaf_sizes = np.zeros(nb_samples, dtype=np.int64)
+        dead_ends = np.zeros(nb_samples, dtype=bool)
+
+        rows = np.flatnonzero(stack_sizes)
+        while rows.size:
+            stack_sizes[rows] -= 1
+            symbols = stacks[rows, stack_sizes[rows]]
+
+            is_terminal = symbols >= 0
+            terminal_rows = rows[is_terminal]
+            if terminal_rows.size:
+                if leaf_sizes[terminal_rows].max() >= leaves.shape[1]:
+                    leaves = np.concatenate([leaves, np.empty_like(leaves)], axis=1)
+                leaves[terminal_rows, leaf_sizes[terminal_rows]] = symbols[is_terminal]
+                leaf_sizes[terminal_rows] += 1
+
+            nonterminal_rows = rows[~is_terminal]
+            nonterminals = -symbols[~is_terminal] - 1
+            counts = nb_rules[nonterminals]
+            is_dead_end = counts == 0
+            if is_dead_end.any():
+                dead_ends[nonterminal_rows[is_dead_end]] = True
+                stack_sizes[nonterminal_rows[is_dead_end]] = 0
+                nonterminal_rows, nonterminals, counts = (
+                    nonterminal_rows[~is_dead_end], nonterminals[~is_dead_end], counts[~is_dead_end],
+                )
+
+            if nonterminal_rows.size:
+                rules = rule_offsets[nonterminals] + (rng.random(nonterminal_rows.size) * counts).astype(np.int64)
+                lengths = rule_lengths[rules]
+                sizes = stack_sizes[nonterminal_rows]
+                while (sizes + lengths).max() > stacks.shape[1]:
+                    stacks = np.concatenate([stacks, np.empty_like(stacks)], axis=1)
+                for position in range(lengths.max()):
+                    pushed = lengths > position
+                    stacks[nonterminal_rows[pushed], sizes[pushed] + position] = rule_symbols[rules[pushed], position]
+                stack_sizes[nonterminal_rows] += lengths
+
+            rows = np.flatnonzero(stack_sizes)
+
+        return [
+            None if dead_end else tuple(leaf[:size].tolist())
+            for leaf, size, dead_end in zip(leaves, leaf_sizes, dead_ends)
+        ]
+
+    def _build_rule_tables(self):
+        # The reversed right hand sides of all the non terminal symbols, padded in a single array
+        rules = [rhs for rhs_list in self._reversed_closures for rhs in rhs_list]
+        self._nb_rules = np.array([len(rhs_list) for rhs_list in self._reversed_closures], dtype=np.int64)
+        self._rule_offsets = np.concatenate([[0], np.cumsum(self._nb_rules)[:-1]]).astype(np.int64)
+        self._rule_lengths = np.array([len(rhs) for rhs in rules], dtype=np.int64)
+        self._rule_symbols = np.zeros((len(rules), max([1] + [len(rhs) for rhs in rules])), dtype=np.int64)
+        for idx, rhs in enumerate(rules):
+            self._rule_symbols[idx, : len(rhs)] = rhs
+
+
+def cfg_sampler(compiled_cfg: CompiledCFG) -> CFGSampler:
+    """
+    return the sampler of a compiled grammar (it is only built once and then kept on the compiled grammar)
+    """
+    return attached(compiled_cfg, "_sampler", lambda: CFGSampler(compiled_cfg))
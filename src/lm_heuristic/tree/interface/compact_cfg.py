@@ -0,0 +1,166 @@
+"""
+Define a compact variant of CFGrammarNode in which a derivation is stored as a tuple of small integers
+"""
+
+from typing import *
+import os
+
+from nltk import CFG
+from nltk.grammar import Nonterminal
+
+from lm_heuristic.tree.node import Node
+from .compiled_cfg import CompiledCFG, compile_cfg, leftmost_nonterminal
+from .cfg_sampler import cfg_sampler
+from .cfg_counting import DerivationCounter, derivation_counter
+
+
+class CompactCFGrammarNode(Node):
+    """
+    Represent the same derivations as CFGrammarNode (same children, strings and fingerprints) with a compact node:
+    - the derivation is a tuple of symbol ids (cf CFGSymbolTable), the children come from the tables of a CompiledCFG
+    - the index of the leftmost non terminal symbol (-1 for a terminal node) is computed once at construction
+    (the fingerprint, used as hash, is computed once when it is first needed, cf Node.fingerprint)
+    - __slots__ are used instead of a __dict__
+    Unlike CFGrammarNode, the shrink option is passed down to the children.
+
+    With left_to_right_generation, random_walk directly samples the leaf from the tables of the grammar (cf CFGSampler)
+    instead of building all the children of each node of the walk.
+    """
+
+    __slots__ = (
+        "compiled_cfg",
+        "ids",
+        "left_to_right_generation",
+        "shrink",
+        "_leftmost_nonterminal",
+        "_children",
+        "_fingerprint",
+    )
+
+    def __init__(
+        self,
+        ids: Tuple[int, ...],
+        compiled_cfg: CompiledCFG,
+        left_to_right_generation: bool = True,
+        shrink: bool = True,
+        leftmost_nonterminal_from: int = 0,
+    ):
+        """
+        :param ids: ordered sequence of symbol ids representing the current derivation string
+        :param compiled_cfg: compiled grammar
+        :param leftmost_nonterminal_from: index from which to look for the leftmost non terminal symbol
+        (all the symbols before are known to be terminal)
+        """
+        self.compiled_cfg = compiled_cfg
+        self.ids = ids
+        self.left_to_right_generation = left_to_right_generation
+        self.shrink = shrink
+        self._leftmost_nonterminal = leftmost_nonterminal(ids, leftmost_nonterminal_from)
+        self._children: Optional[List["CompactCFGrammarNode"]] = None
+
+    @classmethod
+    def from_string(cls, str_grammar: str, **kwargs) -> "CompactCFGrammarNode":
+        compiled_cfg = compile_cfg(CFG.fromstring(str_grammar))
+        return cls((compiled_cfg.start_id,), compiled_cfg, **kwargs)
+
+    @classmethod
+    def from_cfg_file(cls, path: str, **kwargs) -> "CompactCFGrammarNode":
+        """
+        :param path: path to file containing a context-free grammar
+        :return: new Derivation tree node
+        """
+        assert os.path.exists(path)
+        with open(path) as file:
+            str_grammar = file.read()
+        return cls.from_string(str_grammar, **kwargs)
+
+    @property
+    def symbols(self) -> Tuple[Union[str, Nonterminal], ...]:
+        return tuple(map(self.compiled_cfg.symbol, self.ids))
+
+    def is_terminal(self) -> bool:
+        return self._leftmost_nonterminal < 0
+
+    def children(self) -> List["CompactCFGrammarNode"]:  # type: ignore
+        if not self._children:
+            self._children = (
+                self.compute_children_left_to_right() if self.left_to_right_generation else self.compute_all_children()
+            )
+        if (len(self._children) == 1) and (not self._children[0].is_terminal()) and (self.shrink):
+            self._children = self._children[0].children()
+
+        return self._children
+
+    def _new_node(self, ids: Tuple[int, ...], leftmost_nonterminal_from: int = 0) -> "CompactCFGrammarNode":
+        return CompactCFGrammarNode(
+            ids, self.compiled_cfg, self.left_to_right_generation, self.shrink, leftmost_nonterminal_from
+        )
+
+    def _dead_end(self) -> List["CompactCFGrammarNode"]:
+        return [self._new_node((self.compiled_cfg.dead_end_id,))]
+
+    def compute_children_left_to_right(self) -> List["CompactCFGrammarNode"]:
+        idx = self._leftmost_nonterminal
+        prefix, suffix = self.ids[:idx], self.ids[idx + 1 :]
+        # With shrink, the single-choice chains starting from the symbol are already resolved in its closure
+        rhs_list = (self.compiled_cfg.closure_rhs if self.shrink else self.compiled_cfg.production_rhs)(self.ids[idx])
+        child_nodes = [self._new_node(prefix + rhs + suffix, idx) for rhs in rhs_list]
+        return child_nodes if len(child_nodes) != 0 else self._dead_end()
+
+    def compute_all_children(self) -> List["CompactCFGrammarNode"]:
+        child_nodes = []
+        for idx, symbol_id in enumerate(self.ids):
+            if symbol_id >= 0:
+                continue
+            prefix, suffix = self.ids[:idx], self.ids[idx + 1 :]
+            for rhs in self.compiled_cfg.production_rhs(symbol_id):
+                child_nodes.append(self._new_node(prefix + rhs + suffix, min(idx, self._leftmost_nonterminal)))
+        return child_nodes if len(child_nodes) != 0 else self._dead_end()
+
+    def random_walk(self, debug=False) -> "CompactCFGrammarNode":
+        if not self.left_to_right_generation or debug:
+            return Node.random_walk(self, debug)
+
+        return self._leaf(cfg_sampler(self.compiled_cfg).sample(self.ids))
+
+    def random_walks(self, nb_walks: int) -> List["CompactCFGrammarNode"]:  # type: ignore
+        if not self.left_to_right_generation:
+            return Node.random_walks(self, nb_walks)
+        return list(map(self._leaf, cfg_sampler(self.compiled_cfg).sample_many(self.ids, nb_walks)))
+
+    def derivation_counter(self, max_depth: int = 50) -> Optional[DerivationCounter]:
+        """
+        Same as CFGrammarNode.derivation_counter
+        """
+        if not self.left_to_right_generation or not self.shrink:
+            return None
+        return derivation_counter(self.compiled_cfg, self.ids, max_depth)
+
+    def uniform_random_walk(self, max_depth: int = 50) -> "CompactCFGrammarNode":
+        counter = self.derivation_counter(max_depth)
+        assert counter is not None, "Uniform random walks require left to right generation with shrink"
+        return self._leaf(counter.sample())
+
+    def _leaf(self, leaf_ids: Optional[Tuple[int, ...]]) -> "CompactCFGrammarNode":
+        return self._new_node(leaf_ids, len(leaf_ids)) if leaf_ids is not None else self._dead_end()[0]
+
+    def lexical_slot(self) -> Optional[Tuple[str, List[str]]]:
+        """
+        Same as CFGrammarNode.lexical_slot
+        """
+        non_terminal_indexes = [idx for idx, symbol_id in enumerate(self.ids) if symbol_id < 0]
+        if len(non_terminal_indexes) != 1:
+            return None
+
+        idx = non_terminal_indexes[0]
+        rhs_list = self.compiled_cfg.production_rhs(self.ids[idx])
+        if not rhs_list or any(len(rhs) == 0 or min(rhs) < 0 for rhs in rhs_list):
+            return None
+
+        to_string = self.compiled_cfg.to_string
+        left = to_string(self.ids[:idx])[:-1]
+        right = self.ids[idx + 1 :]
+        return left, [to_string(rhs + right) for rhs in rhs_list]
+
+    def __str__(self):
+        return self.compiled_cfg.to_string(self.ids)
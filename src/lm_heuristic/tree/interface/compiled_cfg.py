@@ -0,0 +1,239 @@
+"""
+Define a compiled version of a nltk context-free grammar : the production rules are stored in
+integer-indexed tables that are built once, so that expanding a derivation does not depend on nltk lookups
+"""
+
+from typing import *
+import logging
+import math
+
+from nltk import CFG
+from nltk.grammar import Nonterminal
+
+from .attached import attached
+logger = logging.getLogger(__name__)
+
+DEAD_END = "DEAD_END"
+
+
+def leftmost_nonterminal(ids: Tuple[int, ...], start: int = 0) -> int:
+    """
+    return the index of the leftmost non terminal symbol id (from start), -1 if there is not any
+    """
+    for idx in range(start, len(ids)):
+        if ids[idx] < 0:
+            return idx
+    return -1
+
+
+class CFGSymbolTable:
+    """
+    Map the symbols of a nltk context-free grammar to small integers:
+    - the terminal symbols to ids >= 0
+    - the non terminal symbols to ids < 0 (the n-th non terminal symbol being -n - 1)
+    so that a derivation can be stored as a tuple of int and the terminality of a symbol checked with a comparison.
+
+    The right hand sides of the production rules are encoded the same way and grouped by left hand side.
+    """
+
+    def __init__(self, cfg: CFG):
+        self.cfg = cfg
+        self._terminals: List[str] = []
+        self._nonterminals: List[Nonterminal] = []
+        self._ids: Dict[Union[str, Nonterminal], int] = dict()
+        self._nonterminals_str: List[str] = []
+
+        self.dead_end_id = self.symbol_id(DEAD_END)
+        self.start_id = self.symbol_id(cfg.start())
+
+        encoded_productions = [
+            (self.symbol_id(production.lhs()), tuple(map(self.symbol_id, production.rhs())))
+            for production in cfg.productions()
+        ]
+        productions: List[List[Tuple[int, ...]]] = [[] for _ in self._nonterminals]
+        for lhs_id, rhs_ids in encoded_productions:
+            productions[-lhs_id - 1].append(rhs_ids)
+        self._productions: List[Tuple[Tuple[int, ...], ...]] = list(map(tuple, productions))
+
+    def symbol_id(self, symbol: Union[str, Nonterminal]) -> int:
+        symbol_id = self._ids.get(symbol)
+        if symbol_id is None:
+            if isinstance(symbol, Nonterminal):
+                self._nonterminals.append(symbol)
+                self._nonterminals_str.append(str(symbol))
+                symbol_id = -len(self._nonterminals)
+            else:
+                self._terminals.append(symbol)
+                symbol_id = len(self._terminals) - 1
+            self._ids[symbol] = symbol_id
+        return symbol_id
+
+    @property
+    def nb_nonterminals(self) -> int:
+        return len(self._nonterminals)
+
+    def symbol(self, symbol_id: int) -> Union[str, Nonterminal]:
+        return self._terminals[symbol_id] if symbol_id >= 0 else self._nonterminals[-symbol_id - 1]
+
+    def production_rhs(self, nonterminal_id: int) -> Tuple[Tuple[int, ...], ...]:
+        """
+        return the (encoded) right hand sides of all the production rules of a non terminal symbol
+        """
+        return self._productions[-nonterminal_id - 1]
+
+    def to_string(self, symbol_ids: Tuple[int, ...]) -> str:
+        terminals, nonterminals = self._terminals, self._nonterminals_str
+        return " ".join([terminals[i] if i >= 0 else nonterminals[-i - 1] for i in symbol_ids]) + "."
+
+
+class CompiledCFG(CFGSymbolTable):
+    """
+    In addition to the integer production tables of CFGSymbolTable, a compiled grammar precomputes for each
+    non terminal symbol A the closure of its unit / single-choice chains, ie: the children of a derivation
+    whose leftmost non terminal symbol is A once the shrink option has been applied.
+    If A has a single production rule A -> w B v (w only made of terminal symbols), the derivation has a single child
+    whose leftmost non terminal is B, so it is replaced by the children coming from B, and so on.
+
+    An empty closure means that the children are a DEAD_END node (A, or a symbol of its chain, has no production
+    rule, or the chain is a cycle).
+
+    Before that, the grammar is analysed (cf analyse):
+    - the productive non terminal symbols (from which a terminal string can be derived) and, for each of them,
+    the minimum derivation length (number of production rules) and the minimum length of the derived strings
+    - the reachable non terminal symbols (that appear in a derivation of a terminal string from the start symbol)
+    The production rules that contain an unproductive symbol are removed from the tables, so that the children
+    that can never lead to a terminal string are dropped at expansion time (only an unproductive start symbol
+    still leads to a DEAD_END). The problems found are reported (logger warning) when the grammar is compiled.
+
+    Both tables are also available with the nltk symbols (production_symbols, closure_symbols) for CFGrammarNode.
+    """
+
+    def __init__(self, cfg: CFG):
+        CFGSymbolTable.__init__(self, cfg)
+        self.min_derivation_length: List[float]
+        self.min_yield_length: List[float]
+        self.reachable: List[bool]
+        self.analyse()
+        report = self.report()
+        if report:
+            logger.warning("Problems found in the grammar:\n%s", report)
+
+        self._closures: List[Optional[Tuple[Tuple[int, ...], ...]]] = [None] * len(self._productions)
+        for nonterminal_index in range(len(self._productions)):
+            self._compute_closure(nonterminal_index, set())
+
+        to_symbols = lambda rhs_list: tuple(tuple(map(self.symbol, rhs)) for rhs in rhs_list)
+        self._production_symbols = {
+            nonterminal: to_symbols(self._productions[idx]) for idx, nonterminal in enumerate(self._nonterminals)
+        }
+        self._closure_symbols = {
+            nonterminal: to_symbols(self._closures[idx]) for idx, nonterminal in enumerate(self._nonterminals)
+        }
+
+    def analyse(self):
+        """
+        Compute the minimum derivation / yield lengths (inf for an unproductive symbol) with a fixed point iteration,
+        remove the production rules that contain an unproductive symbol, and compute the reachable symbols
+        """
+        nb_nonterminals = self.nb_nonterminals
+        self.min_derivation_length = [math.inf] * nb_nonterminals
+        self.min_yield_length = [math.inf] * nb_nonterminals
+        changed = True
+        while changed:
+            changed = False
+            for idx, rhs_list in enumerate(self._productions):
+                for rhs in rhs_list:
+                    derivation_length, yield_length = 1, 0
+                    for symbol_id in rhs:
+                        if symbol_id >= 0:
+                            yield_length += 1
+                        else:
+                            derivation_length += self.min_derivation_length[-symbol_id - 1]
+                            yield_length += self.min_yield_length[-symbol_id - 1]
+                    if derivation_length < self.min_derivation_length[idx]:
+                        self.min_derivation_length[idx] = derivation_length
+                        changed = True
+                    if yield_length < self.min_yield_length[idx]:
+                        self.min_yield_length[idx] = yield_length
+                        changed = True
+
+        self._unpruned_productions = self._productions
+        self._productions = [
+            tuple(rhs for rhs in rhs_list if all(map(self.is_productive, rhs))) for rhs_list in self._productions
+        ]
+
+        self.reachable = [False] * nb_nonterminals
+        stack = [self.start_id]
+        while stack:
+            idx = -stack.pop() - 1
+            if self.reachable[idx]:
+                continue
+            self.reachable[idx] = True
+            stack.extend(symbol_id for rhs in self._productions[idx] for symbol_id in rhs if symbol_id < 0)
+
+    def is_productive(self, symbol_id: int) -> bool:
+        return symbol_id >= 0 or self.min_derivation_length[-symbol_id - 1] < math.inf
+
+    def report(self) -> str:
+        """
+        return a description of the dead (unproductive, without production rule) and unreachable symbols
+        (empty string if there is not any)
+        """
+        without_rule, unproductive, unreachable = [], [], []
+        for idx, nonterminal in enumerate(self._nonterminals):
+            if not self._unpruned_productions[idx]:
+                without_rule.append(str(nonterminal))
+            elif not self.is_productive(-idx - 1):
+                unproductive.append(str(nonterminal))
+            elif not self.reachable[idx]:
+                unreachable.append(str(nonterminal))
+        nb_pruned_rules = sum(map(len, self._unpruned_productions)) - sum(map(len, self._productions))
+
+        lines = []
+        if without_rule:
+            lines.append("- non terminal symbols without production rule: %s" % ", ".join(without_rule))
+        if unproductive:
+            lines.append("- unproductive non terminal symbols: %s" % ", ".join(unproductive))
+        if nb_pruned_rules:
+            lines.append("- %d production rules can never lead to a terminal string and were removed" % nb_pruned_rules)
+        if unreachable:
+            lines.append("- unreachable non terminal symbols: %s" % ", ".join(unreachable))
+        return "\n".join(lines)
+
+    def _compute_closure(self, nonterminal_index: int, in_progress: Set[int]) -> Tuple[Tuple[int, ...], ...]:
+        closure = self._closures[nonterminal_index]
+        if closure is not None:
+            return closure
+        if nonterminal_index in in_progress:  # cycle of single-choice rules : no leaf can be reached
+            return ()
+
+        in_progress.add(nonterminal_index)
+        closure = self._productions[nonterminal_index]
+        if len(closure) == 1:
+            rhs = closure[0]
+            idx = leftmost_nonterminal(rhs)
+            if idx >= 0:
+                prefix, suffix = rhs[:idx], rhs[idx + 1 :]
+                closure = tuple(
+                    prefix + sub_rhs + suffix for sub_rhs in self._compute_closure(-rhs[idx] - 1, in_progress)
+                )
+        in_progress.discard(nonterminal_index)
+
+        self._closures[nonterminal_index] = closure
+        return closure
+
+    def closure_rhs(self, nonterminal_id: int) -> Tuple[Tuple[int, ...], ...]:
+        return self._closures[-nonterminal_id - 1]  # type: ignore
+
+    def production_symbols(self, nonterminal: Nonterminal) -> Tuple[Tuple[Union[str, Nonterminal], ...], ...]:
+        return self._production_symbols.get(nonterminal, ())
+
+    def closure_symbols(self, nonterminal: Nonterminal) -> Tuple[Tuple[Union[str, Nonterminal], ...], ...]:
+        return self._closure_symbols.get(nonterminal, ())
+
+
+def compile_cfg(cfg: CFG) -> CompiledCFG:
+    """
+    return the compiled version of a nltk grammar (it is only compiled once and then kept on the grammar object)
+    """
+    return attached(cfg, "_compiled_cfg", lambda: CompiledCFG(cfg))
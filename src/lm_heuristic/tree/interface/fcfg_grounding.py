@@ -0,0 +1,219 @@
+"""
+Ground a feature grammar that only uses finite-valued atomic features into an equivalent context-free grammar,
+so that it can be explored with the CFGrammarNode machinery (compiled tables, sampler, derivation counter)
+"""
+
+from typing import *
+import itertools
+import logging
+
+from nltk import CFG
+from nltk.featstruct import FeatDict, find_variables, substitute_bindings, unify
+from nltk.grammar import FeatureGrammar, FeatStructNonterminal, Nonterminal, Production, TYPE
+from nltk.sem.logic import Variable
+
+from lm_heuristic.tree.node import Node
+from .fcfg_index import production_index
+from .nltk_grammar import CFGrammarNode, FeatureGrammarNode
+
+logger = logging.getLogger(__name__)
+
+
+class GroundedGrammar:
+    """
+    Context-free grammar produced by ground_feature_grammar: each non terminal symbol stands for a ground
+    instantiation of a category of the feature grammar (cf feature_symbol for the mapping back)
+    """
+
+    def __init__(self, cfg: CFG, feature_symbols: Dict[Nonterminal, FeatStructNonterminal]):
+        self.cfg = cfg
+        self._feature_symbols = feature_symbols
+
+    def feature_symbol(self, nonterminal: Nonterminal) -> FeatStructNonterminal:
+        """
+        return the ground feature structure symbol (original category + feature values) of a non terminal symbol
+        """
+        return self._feature_symbols[nonterminal]
+
+    def category(self, nonterminal: Nonterminal) -> str:
+        return self._feature_symbols[nonterminal][TYPE]
+
+
+def _feature_domains(feature_grammar: FeatureGrammar) -> Optional[Dict[Any, Set[Any]]]:
+    """
+    return the ground atomic values used for each feature in the grammar,
+    None if the grammar uses a non atomic feature value or a variable category
+    """
+    domains: Dict[Any, Set[Any]] = dict()
+    for production in feature_grammar.productions():
+        for symbol in (production.lhs(),) + production.rhs():
+            if isinstance(symbol, str):
+                continue
+            for feature, value in symbol.items():
+                if isinstance(value, FeatDict) or (feature == TYPE and isinstance(value, Variable)):
+                    return None
+                if not isinstance(value, Variable):
+                    domains.setdefault(feature, set()).add(value)
+    return domains
+
+
+def _variable_domains(
+    symbols: List[FeatStructNonterminal], domains: Dict[Any, Set[Any]]
+) -> Dict[Variable, Set[Any]]:
+    # A variable can take any value used in the grammar for the features it appears in
+    variable_domains: Dict[Variable, Set[Any]] = dict()
+    for symbol in symbols:
+        for feature, value in symbol.items():
+            if isinstance(value, Variable):
+                variable_domains.setdefault(value, set()).update(domains.get(feature, ()))
+    return variable_domains
+
+
+def ground_feature_grammar(
+    feature_grammar: FeatureGrammar, max_productions: int = 10000
+) -> Optional[GroundedGrammar]:
+    """
+    Enumerate the ground instantiations of the categories that are reachable from the start symbol:
+    each production rule is unified with each reachable ground symbol, and the variables of the right hand side
+    that remain free are replaced by all the values of their features. The unproductive and unreachable
+    symbols are then removed.
+
+    :param max_productions: maximal number of ground production rules
+    :return: the equivalent context-free grammar, or None if the grammar can not be grounded (non atomic feature
+    values, variable that can take no value, start symbol with variables) or if the grounding is too large
+    """
+    domains = _feature_domains(feature_grammar)
+    start = feature_grammar.start()
+    if domains is None:
+        logger.info("The feature grammar can not be grounded: it uses non atomic feature values or variable categories")
+        return None
+    if find_variables(start):
+        logger.info("The feature grammar can not be grounded: its start symbol contains variables")
+        return None
+
+    index = production_index(feature_grammar)
+    nonterminals: Dict[str, Nonterminal] = dict()
+    feature_symbols: Dict[Nonterminal, FeatStructNonterminal] = dict()
+    productions: List[Production] = []
+    worklist: List[FeatStructNonterminal] = []
+
+    def nonterminal(symbol: FeatStructNonterminal) -> Nonterminal:
+        name = repr(symbol)
+        if name not in nonterminals:
+            nonterminals[name] = Nonterminal(name)
+            feature_symbols[nonterminals[name]] = symbol
+            worklist.append(symbol)
+        return nonterminals[name]
+
+    start_nonterminal = nonterminal(start)
+    while worklist:
+        symbol = worklist.pop()
+        lhs = nonterminal(symbol)
+        for production in index.candidates(symbol):
+            bindings: Dict[Variable, Any] = dict()
+            if unify(production.lhs(), symbol, bindings=bindings) is None:
+                continue
+            rhs = [
+                rhs_symbol if isinstance(rhs_symbol, str) else substitute_bindings(rhs_symbol, bindings)
+                for rhs_symbol in production.rhs()
+            ]
+            variable_domains = _variable_domains(
+                [rhs_symbol for rhs_symbol in rhs if not isinstance(rhs_symbol, str)], domains
+            )
+            if any(len(values) == 0 for values in variable_domains.values()):
+                logger.info("The feature grammar can not be grounded: a variable of %s can take no value", production)
+                return None
+
+            variables = list(variable_domains)
+            for values in itertools.product(*[sorted(variable_domains[var], key=repr) for var in variables]):
+                assignment = dict(zip(variables, values))
+                ground_rhs = [
+                    rhs_symbol
+                    if isinstance(rhs_symbol, str)
+                    else nonterminal(substitute_bindings(rhs_symbol, assignment))
+                    for rhs_symbol in rhs
+                ]
+                productions.append(Production(lhs, ground_rhs))
+                if len(productions) > max_productions:
+                    logger.info("The grounding of the feature grammar exceeds %d production rules", max_productions)
+                    return None
+
+    productions = _useful_productions(productions, start_nonterminal)
+    if not productions:
+        logger.info("The grounded grammar can not produce any sentence")
+        return None
+    used = {production.lhs() for production in productions}
+    return GroundedGrammar(
+        CFG(start_nonterminal, productions),
+        {nonterminal: symbol for nonterminal, symbol in feature_symbols.items() if nonterminal in used},
+    )
+
+
+def _useful_productions(productions: List[Production], start: Nonterminal) -> List[Production]:
+    """
+    Only keep the production rules whose symbols are all productive and that are reachable from start
+    """
+    productive: Set[Nonterminal] = set()
+    changed = True
+    while changed:
+        changed = False
+        for production in productions:
+            if production.lhs() not in productive and all(
+                isinstance(symbol, str) or symbol in productive for symbol in production.rhs()
+            ):
+                productive.add(production.lhs())
+                changed = True
+    is_productive = lambda symbol: isinstance(symbol, str) or symbol in productive
+    productions = [
+        production
+        for production in productions
+        if production.lhs() in productive and all(map(is_productive, production.rhs()))
+    ]
+
+    by_lhs: Dict[Nonterminal, List[Production]] = dict()
+    for production in productions:
+        by_lhs.setdefault(production.lhs(), []).append(production)
+    reachable: Set[Nonterminal] = set()
+    stack = [start] if start in productive else []
+    while stack:
+        nonterminal = stack.pop()
+        if nonterminal in reachable:
+            continue
+        reachable.add(nonterminal)
+        stack.extend(
+            symbol for production in by_lhs[nonterminal] for symbol in production.rhs() if not isinstance(symbol, str)
+        )
+    return [production for production in productions if production.lhs() in reachable]
+
+
+def grammar_root(
+    feature_grammar: FeatureGrammar, max_productions: int = 10000, left_to_right_generation: bool = True, **kwargs
+) -> Node:
+    """
+    return a CFGrammarNode built from the grounded grammar if the feature grammar can be grounded
+    (the GroundedGrammar is attached to the root as grounded_grammar),
+    otherwise (fallback) a FeatureGrammarNode, kwargs being passed to its constructor
+
+    :param kwargs: only the options of FeatureGrammarNode (only_keep_valid_node, unification, nb_filtering_workers,
+    filtering_timeout, keep_unchecked_children). They have no effect on a grounded grammar: only its productive and reachable production rules
+    are kept, so a valid leaf can be reached from each of its derivations.
+    """
+    unknown_kwargs = set(kwargs) - {
+        "only_keep_valid_node",
+        "unification",
+        "nb_filtering_workers",
+        "filtering_timeout",
+        "keep_unchecked_children",
+    }
+    assert not unknown_kwargs, "Unknown options of FeatureGrammarNode: %s" % ", ".join(sorted(unknown_kwargs))
+
+    grounded_grammar = ground_feature_grammar(feature_grammar, max_productions)
+    if grounded_grammar is None:
+        return FeatureGrammarNode(
+            feature_grammar.start(), feature_grammar, left_to_right_generation=left_to_right_generation, **kwargs
+        )
+    root = CFGrammarNode(
+        grounded_grammar.cfg.start(), grounded_grammar.cfg, left_to_right_generation=left_to_right_generation
+    )
+    root.grounded_grammar = grounded_grammar  # type: ignore
+    return root
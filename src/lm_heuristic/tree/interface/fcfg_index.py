@@ -0,0 +1,112 @@
+"""
+Define an index over the production rules of a feature grammar that discards, before any unification,
+the production rules whose left hand side can not unify with a symbol because of a ground atomic feature
+"""
+
+from typing import *
+
+from nltk.featstruct import FeatDict
+from nltk.grammar import FeatureGrammar, FeatStructNonterminal, Production, TYPE
+from nltk.sem.logic import SubstituteBindingsI, Variable
+
+from .attached import attached
+
+
+def _ground_atomic_features(fstruct: FeatStructNonterminal) -> Iterator[Tuple[Any, Any]]:
+    for feature, value in fstruct.items():
+        if feature == TYPE or isinstance(value, (Variable, FeatDict, SubstituteBindingsI)):
+            continue
+        try:
+            hash(value)
+        except TypeError:
+            continue
+        yield feature, value
+
+
+class ProductionIndex:
+    """
+    For each category (type of the non terminal symbols), the index maps the ground atomic values of each
+    discriminating feature (a top-level feature that has a ground atomic value in at least one left hand side)
+    to the production rules that are compatible with it: the ones whose left hand side has the same value,
+    a variable or no value for this feature.
+    The candidates of a symbol are the production rules of its category that are compatible with all its
+    ground atomic values (in the same order as FeatureGrammar.productions).
+
+    The prefilter hit rate is the proportion of the failed unifications that have been avoided
+    (the callers report the unifications that still fail with record_failure).
+    """
+
+    def __init__(self, feature_grammar: FeatureGrammar):
+        self.feature_grammar = feature_grammar
+        # type -> (production rules, feature -> value -> compatible production indexes, feature -> wildcard indexes)
+        self._categories: Dict[Any, Tuple[List[Production], Dict[Any, Dict[Any, Set[int]]], Dict[Any, Set[int]]]]
+        self._categories = dict()
+
+        self.nb_lookups = 0
+        self.nb_productions = 0
+        self.nb_skipped_productions = 0
+        self.nb_failed_unifications = 0
+
+    def _category(self, category: Any, symbol: FeatStructNonterminal):
+        entry = self._categories.get(category)
+        if entry is None:
+            productions = list(self.feature_grammar.productions(lhs=symbol))
+            values: Dict[Any, Dict[Any, Set[int]]] = dict()
+            ground: Dict[Any, Set[int]] = dict()
+            for idx, production in enumerate(productions):
+                for feature, value in _ground_atomic_features(production.lhs()):
+                    values.setdefault(feature, dict()).setdefault(value, set()).add(idx)
+                    ground.setdefault(feature, set()).add(idx)
+            # The production rules without a ground value for the feature are compatible with any value
+            all_indexes = set(range(len(productions)))
+            wildcards = {feature: all_indexes - indexes for feature, indexes in ground.items()}
+            for feature, value_indexes in values.items():
+                for indexes in value_indexes.values():
+                    indexes |= wildcards[feature]
+            entry = (productions, values, wildcards)
+            self._categories[category] = entry
+        return entry
+
+    def candidates(self, symbol: FeatStructNonterminal) -> List[Production]:
+        category = symbol.get(TYPE)
+        if category is None or isinstance(category, (Variable, FeatDict)):  # no index without a ground category
+            return list(self.feature_grammar.productions(lhs=symbol))
+
+        productions, values, wildcards = self._category(category, symbol)
+        compatible: Optional[Set[int]] = None
+        for feature, value in _ground_atomic_features(symbol):
+            value_indexes = values.get(feature)
+            if value_indexes is None:
+                continue
+            indexes = value_indexes.get(value, wildcards[feature])
+            compatible = indexes if compatible is None else compatible & indexes
+
+        self.nb_lookups += 1
+        self.nb_productions += len(productions)
+        if compatible is None:
+            return productions
+        self.nb_skipped_productions += len(productions) - len(compatible)
+        return [productions[idx] for idx in sorted(compatible)]
+
+    def record_failure(self):
+        self.nb_failed_unifications += 1
+
+    def hit_rate(self) -> float:
+        nb_failures = self.nb_skipped_productions + self.nb_failed_unifications
+        return self.nb_skipped_productions / nb_failures if nb_failures else 1.0
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        return {
+            "lookups": self.nb_lookups,
+            "productions": self.nb_productions,
+            "skipped_productions": self.nb_skipped_productions,
+            "failed_unifications": self.nb_failed_unifications,
+            "hit_rate": round(self.hit_rate(), 3),
+        }
+
+
+def production_index(feature_grammar: FeatureGrammar) -> ProductionIndex:
+    """
+    return the production index of a feature grammar (it is only built once and then kept on the grammar object)
+    """
+    return attached(feature_grammar, "_production_index", lambda: ProductionIndex(feature_grammar))
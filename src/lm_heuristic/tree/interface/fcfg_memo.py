@@ -0,0 +1,97 @@
+"""
+Define a memo table for the valid leaf search of FeatureGrammarNode: the feature structure symbols that are known
+to have no valid leaf (nogoods) and sample leaves of the symbols that have one
+"""
+
+from typing import *
+from collections import OrderedDict
+import re
+
+from nltk.grammar import FeatureGrammar, FeatStructNonterminal
+
+from .attached import attached
+_VARIABLE_REGEX = re.compile(r"\?[A-Za-z_]\w*")
+
+
+def canonical_key(symbol: FeatStructNonterminal) -> str:
+    """
+    return a string that represents the symbol up to a renaming of its variables
+    (the variables are renamed ?0, ?1, ... in their order of appearance)
+    """
+    names: Dict[str, str] = dict()
+    return _VARIABLE_REGEX.sub(lambda match: names.setdefault(match.group(0), "?%d" % len(names)), repr(symbol))
+
+
+class FeatureGrammarMemo:
+    """
+    Whether a symbol has a valid leaf only depends on the symbol up to a renaming of its variables,
+    so the result of the search is stored under the canonical key of the symbol:
+    - None for a nogood: the symbol is known to have no valid leaf
+    - otherwise the list of the (at most max_solutions) different leaves found for it
+
+    The table keeps at most max_entries symbols (the least recently used ones are evicted).
+    """
+
+    def __init__(self, max_entries: int = 100000, max_solutions: int = 8):
+        self.max_entries = max_entries
+        self.max_solutions = max_solutions
+        self._table: "OrderedDict[str, Optional[List[str]]]" = OrderedDict()
+
+        self.nb_nogood_hits = 0
+        self.nb_solution_hits = 0
+        self.nb_misses = 0
+
+    def lookup(self, key: str) -> Tuple[bool, Optional[List[str]]]:
+        """
+        return (False, None) if the symbol is unknown, (True, None) for a nogood and (True, leaves) otherwise
+        """
+        if key not in self._table:
+            self.nb_misses += 1
+            return False, None
+
+        self._table.move_to_end(key)
+        solutions = self._table[key]
+        if solutions is None:
+            self.nb_nogood_hits += 1
+        else:
+            self.nb_solution_hits += 1
+        return True, solutions
+
+    def add_nogood(self, key: str):
+        self._set(key, None)
+
+    def add_solution(self, key: str, leaf: str):
+        solutions = self._table.get(key)
+        if solutions is None:
+            self._set(key, [leaf])
+        elif leaf not in solutions and len(solutions) < self.max_solutions:
+            solutions.append(leaf)
+
+    def _set(self, key: str, value: Optional[List[str]]):
+        self._table[key] = value
+        self._table.move_to_end(key)
+        if len(self._table) > self.max_entries:
+            self._table.popitem(last=False)
+
+    def clear(self):
+        self._table.clear()
+        self.nb_nogood_hits = self.nb_solution_hits = self.nb_misses = 0
+
+    def __len__(self):
+        return len(self._table)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._table),
+            "nogoods": sum(solutions is None for solutions in self._table.values()),
+            "nogood_hits": self.nb_nogood_hits,
+            "solution_hits": self.nb_solution_hits,
+            "misses": self.nb_misses,
+        }
+
+
+def feature_grammar_memo(feature_grammar: FeatureGrammar) -> FeatureGrammarMemo:
+    """
+    return the memo table of a feature grammar (it is only created once and then kept on the grammar object)
+    """
+    return attached(feature_grammar, "_memo", FeatureGrammarMemo)
@@ -0,0 +1,185 @@
+"""
+Define a process pool that checks in parallel which derivations of a feature grammar can reach a valid leaf
+(used by FeatureGrammarNode to filter its children when only_keep_valid_node is set)
+"""
+
+from typing import *
+from collections import deque
+import logging
+import multiprocessing
+import multiprocessing.connection
+import time
+import weakref
+
+from nltk.grammar import FeatureGrammar
+
+from .attached import attached
+logger = logging.getLogger(__name__)
+
+
+def can_start_workers() -> bool:
+    """
+    return False in a daemonic process (ie: a Celery prefork worker of the server), which is not allowed
+    to start child processes: the derivations must then be filtered serially
+    """
+    return not multiprocessing.current_process().daemon
+
+
+def _work(connection, start, productions):
+    """
+    Loop of a worker: the feature grammar is rebuilt once (from its start symbol and production rules),
+    then each received derivation is checked until the connection is closed
+    """
+    from .nltk_grammar import FeatureGrammarNode
+
+    feature_grammar = FeatureGrammar(start, productions)
+    while True:
+        try:
+            symbols, unification = connection.recv()
+        except EOFError:
+            break
+        try:
+            node = FeatureGrammarNode(symbols, feature_grammar, unification=unification)
+            connection.send((True, node.has_valid_leaf()))
+        except Exception as exception:  # pylint: disable=broad-except
+            connection.send((False, exception))
+
+
+class _Worker:
+    """
+    A worker process and the derivation it is currently checking (index in the batch and deadline)
+    """
+
+    def __init__(self, context, start, productions):
+        self.connection, worker_connection = context.Pipe()
+        self.process = context.Process(target=_work, args=(worker_connection, start, productions), daemon=True)
+        self.process.start()
+        worker_connection.close()
+        self.task: Optional[int] = None
+        self.deadline = 0.0
+
+    def submit(self, task: int, symbols: tuple, unification: str, timeout: float):
+        self.connection.send((symbols, unification))
+        self.task = task
+        self.deadline = time.monotonic() + timeout
+
+    def terminate(self):
+        self.process.terminate()
+        self.process.join()
+        self.connection.close()
+
+
+def _terminate_workers(workers: List[_Worker]):
+    for worker in workers:
+        worker.terminate()
+    workers.clear()
+
+
+class ValidLeafPool:
+    """
+    Each worker rebuilds the feature grammar once (from its start symbol and production rules) and keeps
+    its own memo table (cf FeatureGrammarMemo) across the tasks. Only the symbols of the derivations
+    are sent to the workers, one derivation at a time.
+
+    Each derivation has timeout seconds to be checked, counted from the time it is sent to a worker.
+    A derivation that is not checked in time is reported as unknown (None), and only the worker that was
+    checking it is restarted: the other workers keep their memo tables. The workers are terminated by close,
+    or when the pool is garbage collected.
+
+    The workers are started with the "spawn" method: forking a process that has already loaded torch
+    (ie: the server, with its language model) is not safe. A script that filters the derivations in parallel
+    must therefore protect its entry point with if __name__ == "__main__". The workers can not be started
+    from a daemonic process (cf can_start_workers).
+    """
+
+    def __init__(self, feature_grammar: FeatureGrammar, nb_workers: int, timeout: float = 10.0):
+        assert nb_workers > 0, "nb_workers must be positive"
+        self.feature_grammar = feature_grammar
+        self.nb_workers = nb_workers
+        self.timeout = timeout
+        self._context = multiprocessing.get_context("spawn")
+        self._workers: List[_Worker] = []
+        self._finalizer = weakref.finalize(self, _terminate_workers, self._workers)
+
+        self.nb_checks = 0
+        self.nb_timeouts = 0
+        self.nb_restarts = 0
+
+    def _new_worker(self) -> _Worker:
+        return _Worker(self._context, self.feature_grammar.start(), self.feature_grammar.productions())
+
+    def _get_workers(self) -> List[_Worker]:
+        if not self._workers:
+            assert can_start_workers(), "A daemonic process can not start the filtering workers"
+            logger.info("Start %d processes to filter the feature grammar derivations", self.nb_workers)
+            if not self._finalizer.alive:
+                self._finalizer = weakref.finalize(self, _terminate_workers, self._workers)
+            self._workers.extend(self._new_worker() for _ in range(self.nb_workers))
+        return self._workers
+
+    def _restart(self, idx: int):
+        self._workers[idx].terminate()
+        self._workers[idx] = self._new_worker()
+        self.nb_restarts += 1
+
+    def has_valid_leaf(self, derivations: List[tuple], unification: str = "nltk") -> List[Optional[bool]]:
+        """
+        :param derivations: tuples of symbols
+        :return: for each derivation (in the same order), whether it has a valid leaf,
+        None if it could not be checked before the timeout
+        """
+        workers = self._get_workers()
+        valid: List[Optional[bool]] = [None] * len(derivations)
+        pending = deque(range(len(derivations)))
+
+        while True:
+            for worker in workers:
+                if worker.task is None and pending:
+                    task = pending.popleft()
+                    worker.submit(task, derivations[task], unification, self.timeout)
+            busy = [worker for worker in workers if worker.task is not None]
+            if not busy:
+                break
+
+            next_deadline = min(worker.deadline for worker in busy)
+            ready = multiprocessing.connection.wait(
+                [worker.connection for worker in busy], timeout=max(0.0, next_deadline - time.monotonic())
+            )
+            for worker in busy:
+                if worker.connection in ready:
+                    succeeded, result = worker.connection.recv()
+                    if not succeeded:
+                        # The other workers may still be checking derivations of this batch
+                        self.close()
+                        raise result
+                    valid[worker.task] = result  # type: ignore
+                    worker.task = None
+
+            now = time.monotonic()
+            for idx, worker in enumerate(workers):
+                if worker.task is not None and worker.deadline <= now:
+                    logger.warning(
+                        "Timeout when searching a valid leaf for the derivation: %s", derivations[worker.task]
+                    )
+                    self.nb_timeouts += 1
+                    self._restart(idx)
+
+        self.nb_checks += len(derivations)
+        return valid
+
+    def close(self):
+        self._finalizer()
+
+
+def valid_leaf_pool(feature_grammar: FeatureGrammar, nb_workers: int, timeout: float = 10.0) -> ValidLeafPool:
+    """
+    return the process pool of a feature grammar (it is only created once and then kept on the grammar object,
+    a new one is created if the number of workers or the timeout change)
+    """
+    return attached(
+        feature_grammar,
+        "_valid_leaf_pool",
+        lambda: ValidLeafPool(feature_grammar, nb_workers, timeout),
+        is_stale=lambda pool: pool.nb_workers != nb_workers or pool.timeout != timeout,
+        discard=ValidLeafPool.close,
+    )
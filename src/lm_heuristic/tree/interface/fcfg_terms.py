@@ -0,0 +1,320 @@
+"""
+Define a term-based unification engine for feature grammars, used by FeatureGrammarNode
+instead of the nltk featstruct functions (rename_variables, unify, substitute_bindings)
+"""
+
+from typing import *
+import re
+
+from nltk.featstruct import FeatDict, FeatStruct, Feature, CustomFeatureValue
+from nltk.grammar import FeatureGrammar, Production
+from nltk.sem.logic import SubstituteBindingsI, Variable
+
+from .attached import attached
+from .fcfg_index import production_index
+
+VAR, ATOM, STRUCT = 0, 1, 2
+
+
+class UnsupportedFeatureStructure(Exception):
+    """
+    Raised when a feature structure uses a construction that the term engine does not handle
+    (feature lists, features with custom unification or default values, custom feature values)
+    """
+
+
+class TermStore:
+    """
+    Array-backed store of terms. Each cell is a variable, an atom (base value) or a feature structure
+    (class + dict feature id -> cell), and ref[cell] is the cell it has been bound / merged to (itself if none).
+
+    The unification is destructive but every modification is recorded on a trail,
+    so that the store can be restored to a previous mark (cf mark and undo) after each production rule tried.
+    """
+
+    __slots__ = ("ref", "kind", "value", "trail")
+
+    def __init__(self):
+        self.ref: List[int] = []
+        self.kind: List[int] = []
+        self.value: List[Any] = []
+        # int: binding of a cell to undo, (cell, feature id): feature added to a structure
+        self.trail: List[Union[int, Tuple[int, int]]] = []
+
+    def new_cell(self, kind: int, value: Any) -> int:
+        cell = len(self.ref)
+        self.ref.append(cell)
+        self.kind.append(kind)
+        self.value.append(value)
+        return cell
+
+    def deref(self, cell: int) -> int:
+        ref = self.ref
+        while ref[cell] != cell:
+            cell = ref[cell]
+        return cell
+
+    def mark(self) -> Tuple[int, int]:
+        return len(self.ref), len(self.trail)
+
+    def undo(self, mark: Tuple[int, int]):
+        nb_cells, trail_size = mark
+        trail, ref, value = self.trail, self.ref, self.value
+        while len(trail) > trail_size:
+            entry = trail.pop()
+            if isinstance(entry, int):
+                ref[entry] = entry
+            else:
+                del value[entry[0]][1][entry[1]]
+        del ref[nb_cells:]
+        del self.kind[nb_cells:]
+        del value[nb_cells:]
+
+    def _bind(self, cell: int, target: int):
+        self.ref[cell] = target
+        self.trail.append(cell)
+
+    def unify(self, cell1: int, cell2: int) -> bool:
+        """
+        Unify the two terms, the most recent cells being bound to the oldest ones
+        (ie: the cells of the production rules to the cells of the derivation)
+        """
+        cell1, cell2 = self.deref(cell1), self.deref(cell2)
+        if cell1 == cell2:
+            return True
+        if cell1 > cell2:
+            cell1, cell2 = cell2, cell1
+        kind1, kind2 = self.kind[cell1], self.kind[cell2]
+
+        if kind2 == VAR:
+            self._bind(cell2, cell1)
+            return True
+        if kind1 == VAR:
+            self._bind(cell1, cell2)
+            return True
+        if kind1 == ATOM and kind2 == ATOM:
+            return self.value[cell1] == self.value[cell2]
+        if kind1 == STRUCT and kind2 == STRUCT:
+            # The most recent structure is forwarded to the oldest one, which receives its features
+            self._bind(cell2, cell1)
+            features1 = self.value[cell1][1]
+            for feature_id, sub_cell2 in list(self.value[cell2][1].items()):
+                sub_cell1 = features1.get(feature_id)
+                if sub_cell1 is None:
+                    features1[feature_id] = sub_cell2
+                    self.trail.append((cell1, feature_id))
+                elif not self.unify(sub_cell1, sub_cell2):
+                    return False
+            return True
+        return False  # A structure and a base value
+
+
+class _Template:
+    """
+    A production rule compiled once: its cells (with local indexes) are copied into the store
+    each time the rule is tried, which gives fresh variables without renaming them
+    """
+
+    __slots__ = ("cells", "lhs", "rhs")
+
+    def __init__(self, production: Production, unifier: "FeatureUnifier"):
+        store = TermStore()
+        var_cells: Dict[Variable, int] = dict()
+        self.lhs = unifier.compile(production.lhs(), store, var_cells)
+        self.rhs = [
+            symbol if isinstance(symbol, str) else unifier.compile(symbol, store, var_cells)
+            for symbol in production.rhs()
+        ]
+        self.cells = list(zip(store.kind, store.value))
+
+    def instantiate(self, store: TermStore) -> Tuple[int, List[Union[str, int]]]:
+        offset = len(store.ref)
+        for kind, value in self.cells:
+            if kind == STRUCT:
+                value = (value[0], {feature_id: cell + offset for feature_id, cell in value[1].items()})
+            store.new_cell(kind, value)
+        return self.lhs + offset, [symbol if isinstance(symbol, str) else symbol + offset for symbol in self.rhs]
+
+
+class FeatureUnifier:
+    """
+    Compute the children of a FeatureGrammarNode derivation with terms instead of nltk feature structures:
+    - the feature names are interned (the structures map feature ids to cells)
+    - the production rules are compiled once into templates, and only the candidates given
+    by the production index (cf ProductionIndex) are unified
+    - the derivation is compiled once per node; each production rule is then unified against it
+    in the same store and the store is restored afterwards, so a failed unification does not copy anything
+    - only the symbols of a child that have been modified by the unification are converted back to nltk
+    feature structures, the other siblings are shared with the parent
+
+    The children are the same as with the nltk functions, up to the names of the variables: when two variables
+    are unified, the variable of the derivation is kept (instead of the variable of the production rule).
+    """
+
+    def __init__(self, feature_grammar: FeatureGrammar):
+        self.feature_grammar = feature_grammar
+        self._features: List[Union[str, Feature]] = []
+        self._feature_ids: Dict[Union[str, Feature], int] = dict()
+        self._templates: Dict[Production, _Template] = dict()
+
+    def feature_id(self, feature: Union[str, Feature]) -> int:
+        feature_id = self._feature_ids.get(feature)
+        if feature_id is None:
+            if not isinstance(feature, str) and (type(feature) is not Feature or feature.default is not None):
+                raise UnsupportedFeatureStructure("Unsupported feature: %r" % feature)
+            feature_id = len(self._features)
+            self._features.append(feature)
+            self._feature_ids[feature] = feature_id
+        return feature_id
+
+    def compile(
+        self,
+        value: Any,
+        store: TermStore,
+        var_cells: Dict[Variable, int],
+        memo: Dict[int, int] = None,
+        used_var_cells: Set[int] = None,
+    ) -> int:
+        """
+        Add a feature value to the store and return its cell (the reentrant structures are only added once)
+        :param var_cells: cells of the variables already in the store (completed with the new ones)
+        :param used_var_cells: if given, completed with the cells of the variables used by the value
+        """
+        if isinstance(value, Variable):
+            cell = var_cells.get(value)
+            if cell is None:
+                cell = store.new_cell(VAR, value)
+                var_cells[value] = cell
+            if used_var_cells is not None:
+                used_var_cells.add(cell)
+            return cell
+
+        if isinstance(value, FeatDict):
+            memo = memo if memo is not None else dict()
+            cell = memo.get(id(value))
+            if cell is None:
+                features: Dict[int, int] = dict()
+                cell = store.new_cell(STRUCT, (type(value), features))
+                memo[id(value)] = cell
+                for feature, sub_value in value.items():
+                    features[self.feature_id(feature)] = self.compile(
+                        sub_value, store, var_cells, memo, used_var_cells
+                    )
+            return cell
+
+        if isinstance(value, (FeatStruct, CustomFeatureValue, SubstituteBindingsI)):
+            raise UnsupportedFeatureStructure("Unsupported feature value: %r" % value)
+        return store.new_cell(ATOM, value)
+
+    def template(self, production: Production) -> _Template:
+        template = self._templates.get(production)
+        if template is None:
+            template = _Template(production, self)
+            self._templates[production] = template
+        return template
+
+    def compute_children(self, symbols: tuple, left_to_right_generation: bool = False) -> List[tuple]:
+        """
+        return the derivations (tuples of symbols) produced by applying one production rule
+        to one non terminal symbol of the derivation (only the leftmost one with left_to_right_generation)
+        """
+        store = TermStore()
+        var_cells: Dict[Variable, int] = dict()
+        roots: List[Optional[int]] = []
+        symbol_vars: List[Set[int]] = []
+        for symbol in symbols:
+            used_var_cells: Set[int] = set()
+            if not isinstance(symbol, str):
+                roots.append(self.compile(symbol, store, var_cells, None, used_var_cells))
+            else:
+                roots.append(None)
+            symbol_vars.append(used_var_cells)
+        derivation_size = len(store.ref)
+        used_names = {var.name for var in var_cells}
+
+        index = production_index(self.feature_grammar)
+        children = []
+        for idx, symbol in enumerate(symbols):
+            if isinstance(symbol, str):
+                continue
+            for production in index.candidates(symbol):
+                mark = store.mark()
+                lhs, rhs = self.template(production).instantiate(store)
+                if store.unify(lhs, roots[idx]):
+                    children.append(
+                        self._read_child(store, symbols, roots, symbol_vars, idx, rhs, derivation_size, used_names)
+                    )
+                else:
+                    index.record_failure()
+                store.undo(mark)
+            if left_to_right_generation:
+                break
+        return children
+
+    def _read_child(
+        self,
+        store: TermStore,
+        symbols: tuple,
+        roots: List[Optional[int]],
+        symbol_vars: List[Set[int]],
+        idx: int,
+        rhs: List[Union[str, int]],
+        derivation_size: int,
+        used_names: Set[str],
+    ) -> tuple:
+        memo: Dict[int, Any] = dict()
+        fresh_vars: Dict[int, Variable] = dict()
+        used_names = set(used_names)
+        ref, kind, value, features = store.ref, store.kind, store.value, self._features
+
+        def read(cell: int) -> Any:
+            cell = store.deref(cell)
+            cell_kind = kind[cell]
+            if cell_kind == ATOM:
+                return value[cell]
+            if cell_kind == VAR:
+                if cell < derivation_size:
+                    return value[cell]
+                if cell not in fresh_vars:
+                    fresh_vars[cell] = _fresh_variable(value[cell], used_names)
+                return fresh_vars[cell]
+            fstruct = memo.get(cell)
+            if fstruct is None:
+                fstruct_class, cell_features = value[cell]
+                fstruct = fstruct_class()
+                memo[cell] = fstruct
+                for feature_id, sub_cell in cell_features.items():
+                    fstruct[features[feature_id]] = read(sub_cell)
+            return fstruct
+
+        def read_sibling(position: int) -> Any:
+            symbol = symbols[position]
+            if isinstance(symbol, str) or all(ref[cell] == cell for cell in symbol_vars[position]):
+                return symbol  # not modified by the unification: shared with the parent
+            return read(roots[position])  # type: ignore
+
+        siblings_before = [read_sibling(position) for position in range(idx)]
+        new_rhs = [symbol if isinstance(symbol, str) else read(symbol) for symbol in rhs]
+        siblings_after = [read_sibling(position) for position in range(idx + 1, len(symbols))]
+        return tuple(siblings_before + new_rhs + siblings_after)
+
+
+_TRAILING_DIGITS = re.compile(r"(?<!\d)\d+$")
+
+
+def _fresh_variable(variable: Variable, used_names: Set[str]) -> Variable:
+    # Same naming scheme as nltk rename_variables
+    name, number = _TRAILING_DIGITS.sub("", variable.name), 2
+    if not name:
+        name = "?"
+    while "%s%d" % (name, number) in used_names:
+        number += 1
+    used_names.add("%s%d" % (name, number))
+    return Variable("%s%d" % (name, number))
+
+
+def feature_unifier(feature_grammar: FeatureGrammar) -> FeatureUnifier:
+    """
+    return the term unifier of a feature grammar (it is only created once and then kept on the grammar object)
+    """
+    return attached(feature_grammar, "_unifier", lambda: FeatureUnifier(feature_grammar))
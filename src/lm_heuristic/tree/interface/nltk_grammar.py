@@ -4,6 +4,7 @@ Define interface that constructs tree.Node object from a nltk.grammar object.
 
 from typing import *
 from functools import wraps
+import logging
 import random
 import os
 
@@ -14,6 +15,15 @@ from nltk.featstruct import find_variables, unify, rename_variables, substitute_
 from nltk.sem import Variable
 
 from lm_heuristic.tree.node import Node
+from .compiled_cfg import CompiledCFG, compile_cfg
+from .cfg_sampler import cfg_sampler
+from .cfg_counting import DerivationCounter, derivation_counter
+from .fcfg_memo import canonical_key, feature_grammar_memo
+from .fcfg_terms import UnsupportedFeatureStructure, feature_unifier
+from .fcfg_index import production_index
+from .fcfg_parallel import can_start_workers, valid_leaf_pool
+
+logger = logging.getLogger(__name__)
 
 ######################################################################
 ## Context free grammar --> tree.Node
@@ -36,15 +46,22 @@ class CFGrammarNode(Node):
 
     Two CFGrammarNode that represent a same string will have the same hashing value even if they have
     been produced by different parents.
+
+    The children are generated from the tables of the compiled grammar (cf CompiledCFG) which is built
+    once per nltk grammar.
     """
 
-    def __init__(self, symbols: tuple, cfg: CFG, left_to_right_generation=True, shrink=True):
+    def __init__(
+        self, symbols: tuple, cfg: CFG, left_to_right_generation=True, shrink=True, compiled_cfg: CompiledCFG = None
+    ):
         """
         :param symbols ordered sequences of symbol representing the current derivation string
         :param cfg : reference to context free grammar containing the production rules
+        :param compiled_cfg: compiled version of cfg (computed from cfg if not provided)
         """
         Node.__init__(self)
         self.cfg = cfg
+        self.compiled_cfg = compiled_cfg if compiled_cfg or cfg is None else compile_cfg(cfg)
         self.symbols = (symbols,) if not isinstance(symbols, tuple) else symbols
         self._children = None
         self.left_to_right_generation = left_to_right_generation
@@ -97,13 +114,14 @@ class CFGrammarNode(Node):
             idx_left_nt_symb += 1
 
         symbol = self.symbols[idx_left_nt_symb]
+        prefix, suffix = self.symbols[:idx_left_nt_symb], self.symbols[idx_left_nt_symb + 1 :]
 
-        for production in self.cfg.productions(lhs=symbol):
+        # With shrink, the single-choice chains starting from the symbol are already resolved in its closure
+        rhs_list = (self.compiled_cfg.closure_symbols if self.shrink else self.compiled_cfg.production_symbols)(symbol)
+        for rhs in rhs_list:
             child_nodes.append(
                 CFGrammarNode(
-                    self.symbols[:idx_left_nt_symb] + production.rhs() + self.symbols[idx_left_nt_symb + 1 :],
-                    self.cfg,
-                    self.left_to_right_generation,
+                    prefix + rhs + suffix, self.cfg, self.left_to_right_generation, compiled_cfg=self.compiled_cfg,
                 )
             )
 
@@ -119,24 +137,85 @@ class CFGrammarNode(Node):
         child_nodes = []
         for idx, symbol in enumerate(self.symbols):
             if isinstance(symbol, nltk.grammar.Nonterminal):
-                productions = self.cfg.productions(lhs=symbol)
-                for production in productions:
+                for rhs in self.compiled_cfg.production_symbols(symbol):
                     child_nodes.append(
                         CFGrammarNode(
-                            self.symbols[:idx] + production.rhs() + self.symbols[idx + 1 :],
+                            self.symbols[:idx] + rhs + self.symbols[idx + 1 :],
                             self.cfg,
                             self.left_to_right_generation,
+                            compiled_cfg=self.compiled_cfg,
                         )
                     )
 
         return child_nodes if len(child_nodes) != 0 else [CFGrammarNode(("DEAD_END",), None)]
 
+    def random_walk(self, debug=False) -> "CFGrammarNode":
+        # The left to right random walks are directly sampled from the tables of the compiled grammar
+        if not self.left_to_right_generation or debug or self.compiled_cfg is None:
+            return Node.random_walk(self, debug)
+        return self._leaf(cfg_sampler(self.compiled_cfg).sample(self._ids()))
+
+    def random_walks(self, nb_walks: int) -> List["CFGrammarNode"]:  # type: ignore
+        if not self.left_to_right_generation or self.compiled_cfg is None:
+            return Node.random_walks(self, nb_walks)
+        return list(map(self._leaf, cfg_sampler(self.compiled_cfg).sample_many(self._ids(), nb_walks)))
+
+    def derivation_counter(self, max_depth: int = 50) -> Optional[DerivationCounter]:
+        """
+        return the exact counts of the leaves of the node's subtree up to max_depth (cf DerivationCounter),
+        None if they can not be computed (only available for left to right generation with shrink)
+        """
+        if not self.left_to_right_generation or not self.shrink or self.compiled_cfg is None:
+            return None
+        return derivation_counter(self.compiled_cfg, self._ids(), max_depth)
+
+    def uniform_random_walk(self, max_depth: int = 50) -> "CFGrammarNode":
+        """
+        return a leaf drawn uniformly among the leaves of the node's subtree up to max_depth
+        """
+        counter = self.derivation_counter(max_depth)
+        assert counter is not None, "Uniform random walks require left to right generation with shrink"
+        return self._leaf(counter.sample())
+
+    def _ids(self) -> Tuple[int, ...]:
+        return tuple(map(self.compiled_cfg.symbol_id, self.symbols))
+
+    def _leaf(self, leaf_ids: Optional[Tuple[int, ...]]) -> "CFGrammarNode":
+        if leaf_ids is None:
+            return CFGrammarNode(("DEAD_END",), None)
+        return CFGrammarNode(
+            tuple(map(self.compiled_cfg.symbol, leaf_ids)),
+            self.cfg,
+            self.left_to_right_generation,
+            compiled_cfg=self.compiled_cfg,
+        )
+
+    def lexical_slot(self) -> Optional[Tuple[str, List[str]]]:
+        """
+        If the children of the node are leaves that only differ by the word chosen for its single
+        non terminal symbol (ie: N -> 'dog' | 'cat' | ...), return the text on the left of this symbol
+        and, for each child (in the same order), the rest of its text.
+        Otherwise return None.
+        """
+        non_terminal_indexes = [idx for idx, symbol in enumerate(self.symbols) if isinstance(symbol, Nonterminal)]
+        if len(non_terminal_indexes) != 1:
+            return None
+
+        idx = non_terminal_indexes[0]
+        rhs_list = self.compiled_cfg.production_symbols(self.symbols[idx])
+        if not rhs_list:
+            return None
+        for rhs in rhs_list:
+            if len(rhs) == 0 or any(isinstance(symbol, Nonterminal) for symbol in rhs):
+                return None
+
+        left = " ".join(map(str, self.symbols[:idx]))
+        right = self.symbols[idx + 1 :]
+        return left, [" ".join(map(str, rhs + right)) + "." for rhs in rhs_list]
+
     def __str__(self):
         return " ".join(map(str, self.symbols)) + "."
 
-    def __hash__(self):
-        return hash(self.__str__())
-
 
 ######################################################################
 ## Feature based grammar --> tree.Node
@@ -170,6 +249,13 @@ class FeatureGrammarNode(Node):
     If we try to compute the children of an non terminal node and it happened that this node 
     has no valid children because of current variable bindings, it will return a special DEAD_END
     node.
+
+    With left_to_right_generation, only the leftmost non terminal symbol is expanded: each derivation
+    is then reached by a single path from the root.
+
+    The children inherit the left_to_right_generation, unification and filtering options (nb_filtering_workers,
+    filtering_timeout, keep_unchecked_children) of their parent, but not only_keep_valid_node: only the children
+    of the node on which it is set are filtered.
     """
 
     def __init__(
@@ -177,18 +263,41 @@ class FeatureGrammarNode(Node):
         symbols: Union[Tuple[FeatStructNonterminal], FeatStructNonterminal],
         feature_grammar: FeatureGrammar,
         only_keep_valid_node: bool = False,
+        left_to_right_generation: bool = False,
+        unification: str = "nltk",
+        nb_filtering_workers: int = 0,
+        filtering_timeout: float = 10.0,
+        keep_unchecked_children: bool = True,
     ):
         """
         :param symbols ordered sequences of symbol representing the current derivation string
         :param feature_grammar : reference to ntlk feature grammar containing the production rules
         :param only_keep_valid_node: bool, if true when asking for the children, will filter the one from which no valid leaf can be reached
+        :param left_to_right_generation: bool, if true only the leftmost non terminal symbol is expanded (as in CFGrammarNode)
+        :param unification: "nltk" to compute the children with the nltk featstruct functions or "terms" to use
+        the faster term-based engine (cf FeatureUnifier). Both give the same children up to the names
+        of their variables, so the strings and fingerprints of the non terminal nodes differ between them.
+        The nltk functions are also used when the grammar contains feature structures that the term engine
+        does not handle.
+        :param nb_filtering_workers: if positive, the children are filtered (cf only_keep_valid_node) in parallel
+        by a pool of nb_filtering_workers processes (cf ValidLeafPool). They are filtered serially in a daemonic
+        process (ie: a Celery worker), which can not start the pool.
+        :param filtering_timeout: maximal time (in seconds) to check each child in parallel
+        :param keep_unchecked_children: whether the children that could not be checked before filtering_timeout
+        are kept (they are not known to have no valid leaf) or removed
         """
+        assert unification in ["terms", "nltk"], "unification must be either terms or nltk"
         Node.__init__(self)
         self.feature_grammar = feature_grammar
         self.symbols = (symbols,) if not isinstance(symbols, tuple) else symbols
         self._children: List["FeatureGrammarNode"]
         self._children_have_been_computed = False
         self.only_keep_valid_node = only_keep_valid_node
+        self.left_to_right_generation = left_to_right_generation
+        self.unification = unification
+        self.nb_filtering_workers = nb_filtering_workers
+        self.filtering_timeout = filtering_timeout
+        self.keep_unchecked_children = keep_unchecked_children
 
     @classmethod
     def from_string(cls, str_grammar: str, **kwargs) -> "FeatureGrammarNode":
@@ -209,16 +318,74 @@ class FeatureGrammarNode(Node):
     def children(self) -> List["FeatureGrammarNode"]:  # type: ignore
         if not self._children_have_been_computed:
             non_filter_children = self.compute_children()
-            if self.only_keep_valid_node:
-                self._children = [child for child in non_filter_children if child.find_random_valid_leaf()]
+            if self.only_keep_valid_node and self.nb_filtering_workers > 0 and can_start_workers():
+                self._children = self._filter_children_in_parallel(non_filter_children)
+            elif self.only_keep_valid_node:
+                self._children = [child for child in non_filter_children if child.has_valid_leaf()]
             else:
                 self._children = non_filter_children
             self._children_have_been_computed = True
 
         return self._children
 
-    # TODO compute children from left -> right as in CFG
+    def _filter_children_in_parallel(self, children: List["FeatureGrammarNode"]) -> List["FeatureGrammarNode"]:
+        # The dead end has no valid leaf and is not sent to the workers
+        children = [child for child in children if child.feature_grammar is not None]
+        pool = valid_leaf_pool(self.feature_grammar, self.nb_filtering_workers, self.filtering_timeout)
+        valid = pool.has_valid_leaf([child.symbols for child in children], self.unification)
+        nb_unchecked = valid.count(None)
+        if nb_unchecked:
+            logger.warning(
+                "%d children could not be checked before the timeout, they are %s",
+                nb_unchecked,
+                "kept" if self.keep_unchecked_children else "removed",
+            )
+        return [
+            child
+            for child, is_valid in zip(children, valid)
+            if is_valid or (is_valid is None and self.keep_unchecked_children)
+        ]
+
+    def close(self):
+        """
+        Terminate the processes that filter the children of the nodes of the grammar (cf nb_filtering_workers),
+        they are otherwise terminated when the grammar is garbage collected
+        """
+        pool = getattr(self.feature_grammar, "_valid_leaf_pool", None)
+        if pool is not None:
+            pool.close()
+
     def compute_children(self) -> List["FeatureGrammarNode"]:
+        """
+        return the derivations produced by applying one production rule to one non terminal symbol
+        (only to the leftmost one with left_to_right_generation). The bindings computed when unifying
+        the production rule are propagated to all the other symbols of the derivation.
+        """
+        if self.unification == "terms":
+            try:
+                child_list = [
+                    self._new_child(symbols)
+                    for symbols in feature_unifier(self.feature_grammar).compute_children(
+                        self.symbols, self.left_to_right_generation
+                    )
+                ]
+                return child_list if len(child_list) != 0 else [FeatureGrammarNode("DEAD_END", None)]
+            except UnsupportedFeatureStructure:
+                self.unification = "nltk"
+        return self.compute_children_with_nltk()
+
+    def _new_child(self, symbols: tuple) -> "FeatureGrammarNode":
+        return FeatureGrammarNode(
+            symbols,
+            self.feature_grammar,
+            left_to_right_generation=self.left_to_right_generation,
+            unification=self.unification,
+            nb_filtering_workers=self.nb_filtering_workers,
+            filtering_timeout=self.filtering_timeout,
+            keep_unchecked_children=self.keep_unchecked_children,
+        )
+
+    def compute_children_with_nltk(self) -> List["FeatureGrammarNode"]:
         child_list: List["FeatureGrammarNode"] = []
 
         # First we retrieve all variables used in current derivation
@@ -227,13 +394,15 @@ class FeatureGrammarNode(Node):
             if not isinstance(symbol, str):
                 used_vars |= find_variables(symbol)
 
+        index = production_index(self.feature_grammar)
         for idx, symbol in enumerate(self.symbols):
             if isinstance(symbol, str):
                 continue
 
             # For each non terminal symbol in current derivation , we select a production rule
-            # that has a left hand side matching this symbol
-            for production in self.feature_grammar.productions(lhs=symbol):
+            # that has a left hand side matching this symbol (the index discards the production rules
+            # whose left hand side has an incompatible ground atomic feature)
+            for production in index.candidates(symbol):
 
                 # We rename all the variable in the production rules to avoid name conflicts
                 # TODO put this after a check to avoid to do it if not neccessary
@@ -247,6 +416,7 @@ class FeatureGrammarNode(Node):
                 new_bindings = dict()
                 lhs = unify(lhs, symbol, bindings=new_bindings)
                 if lhs is None:  # Unification failed
+                    index.record_failure()
                     continue
 
                 # Propagate the bindings to the siblings
@@ -256,34 +426,58 @@ class FeatureGrammarNode(Node):
                 new_rhs = [substitute_bindings(rhs_symb, bindings=new_bindings) for rhs_symb in rhs]
 
                 # Create the new child
-                new_child = FeatureGrammarNode(
-                    tuple(new_siblings[:idx] + new_rhs + new_siblings[idx + 1 :]), self.feature_grammar,
-                )
+                new_child = self._new_child(tuple(new_siblings[:idx] + new_rhs + new_siblings[idx + 1 :]))
                 child_list.append(new_child)
 
+            # In left to right generation, a leftmost symbol without valid production rule is a dead end
+            if self.left_to_right_generation:
+                break
+
         return child_list if len(child_list) != 0 else [FeatureGrammarNode("DEAD_END", None)]
 
-    def find_random_valid_leaf(self):
-        leaves = []
+    def find_random_valid_leaf(self) -> Optional[str]:
+        """
+        return a random valid leaf (each non terminal symbol being derived independently), None if there is not any.
+        The symbols without valid leaf are memorized for the whole grammar (cf FeatureGrammarMemo)
+        so that each of them is only explored once.
+        """
+        return self._find_valid_leaf(random_leaf=True)
+
+    def has_valid_leaf(self) -> bool:
+        # Any valid leaf will do: the leaves already found for the symbols are reused
+        return self._find_valid_leaf(random_leaf=False) is not None
+
+    def _find_valid_leaf(self, random_leaf: bool) -> Optional[str]:
         if str(self) == "DEAD_END.":
             return None
 
+        memo = feature_grammar_memo(self.feature_grammar)
+        leaves = []
         for symbol in self.symbols:
             if not isinstance(symbol, Nonterminal):
                 leaves.append(symbol)
                 continue
 
-            children_symbol = FeatureGrammarNode(symbol, self.feature_grammar).children()
+            key = canonical_key(symbol)
+            known, solutions = memo.lookup(key)
+            if known and solutions is None:
+                return None
+            if known and not random_leaf:
+                leaves.append(random.choice(solutions))
+                continue
+
+            children_symbol = FeatureGrammarNode(symbol, self.feature_grammar, unification=self.unification).children()
             random.shuffle(children_symbol)
             leaf = None
             for child in children_symbol:
-                leaf = child.find_random_valid_leaf()
+                leaf = child._find_valid_leaf(random_leaf)
                 if leaf:
                     break
             if not leaf:
+                memo.add_nogood(key)
                 return None
-            else:
-                leaves.append(leaf)
+            memo.add_solution(key, leaf)
+            leaves.append(leaf)
         return " ".join(leaves)
 
     def find_random_valid_leaf_debug(self) -> Union["FeatureGrammarNode", None]:
@@ -305,9 +499,6 @@ class FeatureGrammarNode(Node):
 
         return None
 
-    def __hash__(self):
-        return hash(self.symbols)
-
     def __str__(self):
         if self.is_terminal():
             return " ".join(self.symbols) + "."
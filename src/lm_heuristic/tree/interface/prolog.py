@@ -83,5 +83,3 @@ class PrologGrammarNode(Node):
     def __str__(self):
         return " ".join(map(str, self.symbols)) + "."
 
-    def __hash__(self):
-        return hash(self.__str__())
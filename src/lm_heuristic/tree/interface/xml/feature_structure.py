@@ -16,6 +16,32 @@ def copy_features(body):
         mirrors.append({"str": body["body_symbols"][i], "features": body["body_features"][i].get_mirror(variables)})
     return mirrors
 
+def resolve(term, memo=None, visiting=None):
+    """
+    Return a term without bound variables (each one is replaced by its value) that shares with the
+    given term all its sub-terms that do not contain any bound variable
+    """
+    memo = {} if memo is None else memo
+    visiting = set() if visiting is None else visiting
+    if term.isConst:
+        return term
+    if id(term) in memo:
+        return memo[id(term)]
+    if term.isVar:
+        if term.ref is None or id(term) in visiting:
+            # A cycle of bindings is a same variable (its bindings are reverted after the unification)
+            return term
+        visiting.add(id(term))
+        resolved = resolve(term.ref, memo, visiting)
+        visiting.discard(id(term))
+    else:
+        features = {f: resolve(term.features[f], memo, visiting) for f in term.features}
+        unchanged = all(features[f] is term.features[f] for f in features)
+        resolved = term if unchanged else PStruct(features)
+    memo[id(term)] = resolved
+    return resolved
+
+
 def is_symbol_terminal(symbol):
     return (symbol["str"].startswith('"') or symbol["str"].startswith("'"))
 
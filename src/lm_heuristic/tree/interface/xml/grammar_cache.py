@@ -0,0 +1,161 @@
+"""
+Define a cache for the grammars parsed from XML (draw.io) files: the parsed grammar (bodies with their
+feature structures) is pickled in a cache file whose name contains the hash of the XML content
+"""
+
+from typing import *
+from collections import OrderedDict, abc
+from functools import lru_cache
+import hashlib
+import logging
+import os
+import pickle
+
+from . import feature_structure, parse_grammar_str, parse_xml
+from .parse_xml import xml_to_string
+from .parse_grammar_str import parse_grammar
+
+logger = logging.getLogger(__name__)
+
+# Suggested directory of the cache files (the grammars are only written on disk if a cache directory is given)
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "lm_heuristic", "xml_grammars")
+
+# Number of grammars kept in memory by the process (the least recently used ones are evicted)
+MAX_LOADED_GRAMMARS = 16
+
+# Grammars already loaded by the process (read-only, cf freeze_grammar), by hash of the XML content
+_loaded_grammars: "OrderedDict[str, Mapping[str, tuple]]" = OrderedDict()
+
+
+class ReadOnlyMapping(abc.Mapping):
+    """
+    Read-only mapping over a dict. Unlike types.MappingProxyType, it can be pickled and deep copied
+    (ie: the leaves sent to an evaluation process by ParallelEvalBuffer with parallel_strategy="multiprocess")
+    """
+
+    __slots__ = ("_data",)
+
+    def __init__(self, data: dict):
+        self._data = data
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __repr__(self) -> str:
+        return "%s(%r)" % (type(self).__name__, self._data)
+
+    def __reduce__(self):
+        return type(self), (self._data,)
+
+
+@lru_cache(maxsize=None)
+def _parser_hash() -> str:
+    # The cache files written by another version of the parsing modules are not used
+    # (only computed when a cache file is used)
+    digest = hashlib.sha256()
+    for module in (parse_xml, parse_grammar_str, feature_structure):
+        with open(module.__file__, "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()[:16]
+
+
+def _content_hash(file: str) -> str:
+    digest = hashlib.sha256()
+    with open(file, "rb") as xml_file:
+        digest.update(xml_file.read())
+    return digest.hexdigest()
+
+
+def cache_key(file: str) -> str:
+    """
+    return the key of the cache file of the grammar of an XML file: hash of its content and of the parsing code
+    """
+    return _cache_key(_content_hash(file))
+
+
+def _cache_key(content_hash: str) -> str:
+    return hashlib.sha256((content_hash + _parser_hash()).encode()).hexdigest()[:32]
+
+
+def freeze_grammar(grammar: dict) -> Mapping[str, tuple]:
+    """
+    return a read-only version of a parsed grammar (the production bodies are tuples of read-only mappings),
+    so that the grammar can be shared by all the callers of load_grammar. The feature structures are not
+    copied: they must only be read (ie: with copy_features)
+    """
+    return ReadOnlyMapping(
+        {
+            head: tuple(
+                ReadOnlyMapping(
+                    {
+                        "head_feature": body["head_feature"],
+                        "body_symbols": tuple(body["body_symbols"]),
+                        "body_features": tuple(body["body_features"]),
+                    }
+                )
+                for body in bodies
+            )
+            for head, bodies in grammar.items()
+        }
+    )
+
+
+def load_grammar(file: str, cache_dir: Optional[str] = None) -> Mapping[str, tuple]:
+    """
+    return the grammar parsed from an XML file (cf xml_to_string and parse_grammar), as a read-only mapping
+    (cf freeze_grammar), from the cache if the file has already been parsed
+
+    :param cache_dir: directory of the cache files (ie: DEFAULT_CACHE_DIR), None (default) to only keep the grammars
+    in memory. When a grammar is written, the cache files of the previous contents of the same XML file are removed.
+    """
+    content_hash = _content_hash(file)
+    if content_hash in _loaded_grammars:
+        _loaded_grammars.move_to_end(content_hash)
+        return _loaded_grammars[content_hash]
+
+    grammar = None
+    cache_file = None
+    if cache_dir is not None:
+        # The hash of the absolute path distinguishes the XML files with the same name
+        path_hash = hashlib.sha256(os.path.abspath(file).encode()).hexdigest()[:8]
+        prefix = "%s-%s-" % (os.path.splitext(os.path.basename(file))[0], path_hash)
+        cache_file = os.path.join(cache_dir, prefix + _cache_key(content_hash) + ".pickle")
+        if os.path.exists(cache_file):
+            try:
+                with open(cache_file, "rb") as file_cache:
+                    grammar = pickle.load(file_cache)
+                logger.info("Load the grammar of %s from %s", file, cache_file)
+            except (OSError, pickle.UnpicklingError, EOFError, AttributeError) as exception:
+                logger.warning("Can not load the cache file %s: %s", cache_file, exception)
+
+    if grammar is None:
+        grammar = parse_grammar(xml_to_string(file))
+        if cache_file is not None:
+            _write_cache(grammar, cache_dir, cache_file, prefix)
+
+    frozen_grammar = freeze_grammar(grammar)
+    _loaded_grammars[content_hash] = frozen_grammar
+    if len(_loaded_grammars) > MAX_LOADED_GRAMMARS:
+        _loaded_grammars.popitem(last=False)
+    return frozen_grammar
+
+
+def _write_cache(grammar: dict, cache_dir: str, cache_file: str, prefix: str):
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        for name in os.listdir(cache_dir):  # stale entries of the same file
+            if name.startswith(prefix) and name.endswith(".pickle") and len(name) == len(prefix) + 32 + 7:
+                os.remove(os.path.join(cache_dir, name))
+        tmp_file = "%s.%d.tmp" % (cache_file, os.getpid())
+        with open(tmp_file, "wb") as file_cache:
+            pickle.dump(grammar, file_cache, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+        logger.info("Write the grammar cache file %s", cache_file)
+    except OSError as exception:
+        logger.warning("Can not write the cache file %s: %s", cache_file, exception)
@@ -24,17 +24,40 @@ def xml_to_string(file):
     
     return as_str
 
+class XMLIndex:
+    """
+    Indexes of the elements of a draw.io diagram, built in a single pass over the XML elements
+    (the element lists keep the order of the file)
+    """
+
+    def __init__(self, elements):
+        self.elements = elements
+        self.styled = []  # (element, style) of the elements with a style
+        self.with_parent = []  # elements with a parent
+        self.edges = []  # edge elements
+        self.children = {}  # parent id -> elements
+        self.edges_by_source = {}  # source id -> edge elements
+        for child in elements:
+            attributes = child.attrib
+            if "style" in attributes:
+                self.styled.append((child, attributes["style"]))
+            if "parent" in attributes:
+                self.with_parent.append(child)
+                self.children.setdefault(attributes["parent"], []).append(child)
+            if "edge" in attributes:
+                self.edges.append(child)
+                self.edges_by_source.setdefault(attributes.get("source"), []).append(child)
+
+
 def parse(file):
     dictionaries = {}
     root = ET.parse(file).getroot()
+    index = XMLIndex(root[0][0][0])
 
     # grammar classes
     grammar_classes = {}
-    for child in root[0][0][0]:
+    for child, style in index.styled:
         attributes = child.attrib
-        if not "style" in attributes:
-            continue
-        style = attributes["style"]
         if "rounded=1" in style and "verticalAlign=top" in style and not "text" in style:
             grammar_classes[attributes["value"]] = grammar_classes.get(attributes["value"], list())
             grammar_classes[attributes["value"]].append(
@@ -48,11 +71,8 @@ def parse(file):
 
     # terminals
     terminals = {}
-    for child in root[0][0][0]:
+    for child, style in index.styled:
         attributes = child.attrib
-        if not "style" in attributes:
-            continue
-        style = attributes["style"]
         if "rounded=1" in style and "collapsible=1" in style:
             dictionary = {"id": attributes["id"], "name": attributes["value"], "type": "terminal"}
             dictionaries[dictionary["id"]] = dictionary
@@ -69,9 +89,9 @@ def parse(file):
             terminals[dictionary["id"]] = {"features": [], "class": grammar_class, "symbol": dictionary["name"]}
 
     # terminal features
-    for child in root[0][0][0]:
+    for child in index.with_parent:
         attributes = child.attrib
-        if "parent" not in attributes or attributes["parent"] not in dictionaries:
+        if attributes["parent"] not in dictionaries:
             continue
         parent = dictionaries[attributes["parent"]]
         if parent["type"] == "terminal":
@@ -79,20 +99,17 @@ def parse(file):
 
     # semantic structures
     semantic_structures = {}
-    for child in root[0][0][0]:
+    for child, style in index.styled:
         attributes = child.attrib
-        if not "style" in attributes:
-            continue
-        style = attributes["style"]
         if "dashed=1" in style and "collapsible=1" in style:
             dictionary = {"id": attributes["id"], "name": attributes["value"], "type": "semantic_structure"}
             dictionaries[dictionary["id"]] = dictionary
             semantic_structures[dictionary["name"]] = {"features": {}}
 
     # semantic structure features
-    for child in root[0][0][0]:
+    for child in index.with_parent:
         attributes = child.attrib
-        if "parent" not in attributes or attributes["parent"] not in dictionaries:
+        if attributes["parent"] not in dictionaries:
             continue
         parent = dictionaries[attributes["parent"]]
         dictionaries[attributes["id"]] = {
@@ -105,10 +122,8 @@ def parse(file):
             semantic_structures[parent["name"]]["features"][attributes["value"]] = {"type": "var"}
 
     # semantic structure substructure relation
-    for child in root[0][0][0]:
+    for child in index.edges:
         attributes = child.attrib
-        if not "edge" in attributes:
-            continue
         source = attributes["source"]
         target = attributes["target"]
         if not source in dictionaries or not target in dictionaries:
@@ -122,10 +137,8 @@ def parse(file):
         parent["features"][source["name"]] = {"type": "structure", "reference": target}
 
     # semantic structure extension
-    for child in root[0][0][0]:
+    for child in index.edges:
         attributes = child.attrib
-        if not "edge" in attributes:
-            continue
         source = attributes["source"]
         target = attributes["target"]
         if not source in dictionaries or not target in dictionaries:
@@ -138,11 +151,8 @@ def parse(file):
 
     # Non-terminals
     nonterminals = {}
-    for child in root[0][0][0]:
+    for child, style in index.styled:
         attributes = child.attrib
-        if not "style" in attributes:
-            continue
-        style = attributes["style"]
         if not "rounded=1" in style and "collapsible=1" in style and not "dashed=1" in style:
             dictionary = {"id": attributes["id"], "name": attributes["value"], "type": "nonterminal"}
             dictionaries[dictionary["id"]] = dictionary
@@ -155,10 +165,8 @@ def parse(file):
                 "previous": None,
             }
     # Rules as linked lists
-    for child in root[0][0][0]:
+    for child in index.edges:
         attributes = child.attrib
-        if not "edge" in attributes:
-            continue
         source = attributes["source"]
         target = attributes["target"]
         if not source in dictionaries or not target in dictionaries:
@@ -173,25 +181,36 @@ def parse(file):
     # Nonterminal feature structures
     for nonterminal in [nonterminals[t] for t in nonterminals if nonterminals[t]["previous"] == None]:
         struct_vars = {}
-        get_non_terminal_features(nonterminal, root[0][0][0], dictionaries, semantic_structures, struct_vars)
+        get_non_terminal_features(nonterminal, index, dictionaries, semantic_structures, struct_vars)
         next = nonterminal["next"]
         while next != None:
             next_nonterminal = nonterminals[next]
-            get_non_terminal_features(next_nonterminal, root[0][0][0], dictionaries, semantic_structures, struct_vars)
+            get_non_terminal_features(next_nonterminal, index, dictionaries, semantic_structures, struct_vars)
             next = next_nonterminal["next"]
     return grammar_classes, terminals, semantic_structures, nonterminals
 
 
-def get_non_terminal_features(nonterminal, xmlentries, dictionaries, semantic_structures, struct_vars):
-    for child in xmlentries:
+def get_non_terminal_features(nonterminal, index, dictionaries, semantic_structures, struct_vars):
+    for child in index.children.get(nonterminal["id"], []):
         attributes = child.attrib
-        if "parent" not in attributes or attributes["parent"] != nonterminal["id"]:
-            continue
-        base_structure = has_base_structure(xmlentries, attributes["id"], dictionaries, semantic_structures)
+        base_structure = has_base_structure(index, attributes["id"], dictionaries, semantic_structures)
         name, feature = translate_feature(attributes["value"], semantic_structures, struct_vars, base_structure)
         nonterminal["features"][name] = feature
 
 
+def has_base_structure(index, source_id, dictionaries, semantic_structures):
+    for child in index.edges_by_source.get(source_id, []):
+        attributes = child.attrib
+        target = attributes["target"]
+        if not target in dictionaries:
+            continue
+        target = dictionaries[target]
+        if not target["type"] == "semantic_structure":
+            continue
+        return semantic_structures[target["name"]]
+    return None
+
+
 def translate_feature(as_string, semantic_structures, struct_vars, base_structure=None):
     i = as_string.index("=")
     name = as_string[:i]
@@ -221,21 +240,6 @@ def translate_feature(as_string, semantic_structures, struct_vars, base_structur
         return name, {"type": "var", "name": value}
 
 
-def has_base_structure(xmlelems, source_id, dictionaries, semantic_structures):
-    for child in xmlelems:
-        attributes = child.attrib
-        if not "edge" in attributes:
-            continue
-        target = attributes["target"]
-        if not attributes["source"] == source_id or not target in dictionaries:
-            continue
-        target = dictionaries[target]
-        if not target["type"] == "semantic_structure":
-            continue
-        return semantic_structures[target["name"]]
-    return None
-
-
 def get_feature_struct(as_string, semantic_structures, struct_vars, base_structure):
     str2 = as_string[as_string.index("[") + 1 : -1]
     features = {}
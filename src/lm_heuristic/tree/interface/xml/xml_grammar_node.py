@@ -1,27 +1,37 @@
-from copy import deepcopy
 from lm_heuristic.tree.node import Node
-from .parse_xml import xml_to_string
-from .parse_grammar_str import parse_grammar
-from .feature_structure import PStruct, is_symbol_terminal, copy_features, revert
+from .grammar_cache import load_grammar
+from .feature_structure import PStruct, is_symbol_terminal, copy_features, revert, resolve
 
 
 class XMLGrammarNode(Node):
+    """
+    The feature structures of the symbols are never modified once they are in a node: a child only
+    creates the symbols whose features have been bound by the unification (cf resolve) and shares the
+    other ones with its parent. So the string of a node is only computed once.
+    """
+
     def __init__(self, symbols: tuple, grammar, shrink=True):
         self.symbols = symbols  # a symbol <- {"str": str, "features": PStruct | PVar | PConst}
         self.grammar = grammar
         self._children = None
         self.shrink = shrink
+        self._str = None
 
     @classmethod
-    def from_file(cls, file, **kwargs):
-        grammar_as_str = xml_to_string(file)
-        grammar = parse_grammar(grammar_as_str)
+    def from_file(cls, file, cache_dir=None, **kwargs):
+        """
+        :param cache_dir: directory where the parsed grammar is cached (cf load_grammar, ie: DEFAULT_CACHE_DIR),
+        None (default) to not write it
+        """
+        grammar = load_grammar(file, cache_dir)
         return cls(({"str": "ROOT", "features": PStruct({})},), grammar, **kwargs)
 
-    def __hash__(self):
-        return hash(str(self)) # TODO optimize that
-
     def __str__(self):
+        if self._str is None:
+            self._str = self._compute_str()
+        return self._str
+
+    def _compute_str(self):
         if self.is_terminal():
             as_str = ""
             for symbol in self.symbols:
@@ -63,7 +73,7 @@ class XMLGrammarNode(Node):
                 continue
 
             new_node = XMLGrammarNode(
-                symbols=deepcopy(self.symbols[:idx_left_nt_symb] + tuple(feature_copies[1:]) + self.symbols[idx_left_nt_symb + 1 :]),
+                symbols=self._resolve_symbols(self.symbols[:idx_left_nt_symb] + tuple(feature_copies[1:]) + self.symbols[idx_left_nt_symb + 1 :]),
                 grammar=self.grammar,
             )
             child_nodes.append(new_node)
@@ -71,6 +81,19 @@ class XMLGrammarNode(Node):
 
         return child_nodes
 
+    @staticmethod
+    def _resolve_symbols(symbols):
+        # Replace the variables bound by the unification before reverting it (the symbols whose features
+        # are unchanged are shared)
+        memo = {}
+        resolved_symbols = []
+        for symbol in symbols:
+            features = resolve(symbol["features"], memo)
+            if features is not symbol["features"]:
+                symbol = {"str": symbol["str"], "features": features}
+            resolved_symbols.append(symbol)
+        return tuple(resolved_symbols)
+
     def children(self):
         if not self._children:
             self._children = self.compute_children()
@@ -5,14 +5,31 @@ a tree search on int
 
 from abc import ABC, abstractmethod
 from typing import *
+import hashlib
 import random
 
+FINGERPRINT_SIZE = 8  # in bytes -> 64-bit fingerprints
+
+
+def stable_fingerprint(string: str) -> int:
+    """
+    Digest of a string that, unlike hash(), does not depend on the process (python salts the str hashes)
+    """
+    return int.from_bytes(hashlib.blake2b(string.encode("utf-8"), digest_size=FINGERPRINT_SIZE).digest(), "big")
+
 
 class Node(ABC):
     """
     The node abstract object specifies the methods that needs to be implemented in order to 
     used a custom node object with the different tree search srategies defined in the tree_search modules. 
+
+    Each node has a fingerprint: a stable 64-bit digest of the derivation it represents, computed once
+    and then stored on the node. It is valid across processes and runs, so it is used for hashing,
+    equality and as key of the evaluation caches.
     """
+
+    __slots__ = ()  # so that the nodes that define __slots__ have no __dict__
+
     def __init__(self):
         ...
 
@@ -38,16 +55,30 @@ class Node(ABC):
             print(node)
         return node
 
+    def random_walks(self, nb_walks: int) -> List["Node"]:
+        # Override it when several random walks can be performed at once more efficiently
+        return [self.random_walk() for _ in range(nb_walks)]
+
     @abstractmethod
     def __str__(self):
         ...
 
-    @abstractmethod
+    def fingerprint(self) -> int:
+        try:
+            return self._fingerprint
+        except AttributeError:
+            self._fingerprint = stable_fingerprint(self._fingerprint_string())
+            return self._fingerprint
+
+    def _fingerprint_string(self) -> str:
+        # String that identifies the derivation, override it if str(self) is not enough
+        return str(self)
+
     def __hash__(self):
-        ...
+        return self.fingerprint()
 
     def __eq__(self, other):
-        return self.__hash__() == other.__hash__()
+        return isinstance(other, Node) and self.fingerprint() == other.fingerprint()
 
     def __repr__(self):
         return str(self)
\ No newline at end of file
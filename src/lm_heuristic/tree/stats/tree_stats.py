@@ -24,6 +24,9 @@ class TreeStats():
         self._depths: List[int] = []
         self._branching_factors: Dict[int, List[int]] = dict()
         self._progress_bar = progress_bar
+        # Exact depth distribution of the random walks (cf compute_exact_stats)
+        self._depth_probabilities: Dict[int, float] = dict()
+        self.nb_leaves: Optional[int] = None
 
     def accumulate_stats(self, nb_samples: int = 1):
         """
@@ -32,9 +35,27 @@ class TreeStats():
         """
         self._depths = []
         self._branching_factors = dict()
+        self._depth_probabilities = dict()
         for _ in tqdm(range(nb_samples), disable=not self._progress_bar):
             self.single_tree_walk()
 
+    def compute_exact_stats(self, max_depth: int = 50, tolerance: float = 1e-6) -> bool:
+        """
+        If the root can count the leaves of its subtree (cf CFGrammarNode.derivation_counter), compute
+        the exact depth distribution of the random walks and the number of leaves instead of sampling tree walks.
+        :param max_depth: depth up to which the leaves are counted
+        :param tolerance: maximal probability for a random walk to go deeper than max_depth
+        :return: False if the exact statistics are not available (the stats must then be accumulated by sampling)
+        """
+        get_counter = getattr(self.root, "derivation_counter", None)
+        counter = get_counter(max_depth) if get_counter is not None else None
+        if counter is None or counter.nb_leaves == 0 or counter.truncated_probability > tolerance:
+            return False
+
+        self._depth_probabilities = counter.walk_depth_probabilities
+        self.nb_leaves = counter.nb_leaves
+        return True
+
     def single_tree_walk(self):
         """
         Perform a single tree walk and update statistics value
@@ -59,7 +80,23 @@ class TreeStats():
             "std": round(float(np.std(array)), 2),
         }
 
+    @staticmethod
+    def weighted_dict_info(probabilities: Dict[int, float]):
+        values = np.array(sorted(probabilities), dtype=float)
+        weights = np.array([probabilities[value] for value in sorted(probabilities)])
+        weights /= weights.sum()
+        mean = float(np.dot(values, weights))
+        return {
+            "min": round(values[0], 1),
+            "max": round(values[-1], 1),
+            "mean": round(mean, 1),
+            "median": round(float(values[np.searchsorted(np.cumsum(weights), 0.5)]), 1),
+            "std": round(float(np.sqrt(np.dot((values - mean) ** 2, weights))), 2),
+        }
+
     def depths_info(self) -> Dict:
+        if self._depth_probabilities:
+            return self.weighted_dict_info(self._depth_probabilities)
         assert self._depths != [], "Try to access statistic informations before browsing the tree"
         return self.dict_info(self._depths)
 
@@ -1,2 +1,5 @@
 from .search import TreeSearch
 from .evaluator import Evaluator
+from .evaluation_memory import EvaluationMemory
+from .evaluation_history import EvaluationHistory
+from .evaluation_service import EvaluationService, EvaluationClient
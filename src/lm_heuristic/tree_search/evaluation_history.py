@@ -0,0 +1,166 @@
+"""
+Define the history used by the evaluator to keep track of all the values it returned
+"""
+
+from typing import *
+import json
+
+import numpy as np
+
+from lm_heuristic.tree import Node
+
+
+class EvaluationHistory:
+    """
+    Keep track of all the (leaf, value) returned by the evaluator (evaluations and memory hits).
+    To stay compact in long searches, the history does not keep the leaves objects but is stored column-wise:
+    - values: float array
+    - leaf_ids: int array, index of each leaf in the leaves list
+    - leaves: list of the leaves strings, each leaf string being stored only once
+      (the leaves are interned by their string, or by their fingerprint when added with append_node)
+
+    values() and leaf_ids() return views over the underlying arrays (no copy).
+
+    If a path is provided, the history is also streamed to this file (append-only) :
+    each line is "<leaf_id>\\t<value>\\t<leaf>" where leaf is only written the first time the leaf appears,
+    as a JSON string (so that the leaves containing tabs or newlines do not break the lines).
+    The file is flushed by flush and closed by close (or when leaving a with block).
+    """
+
+    def __init__(self, path: str = None, initial_capacity: int = 1024):
+        self._initial_capacity = initial_capacity
+        self._values: np.ndarray
+        self._leaf_ids: np.ndarray
+        self._size: int
+        self._leaves: List[str]
+        self._first_values: List[float]
+        self._leaf_index: Dict[Union[str, int], int]
+        self._nb_leaves_written: int
+        self.reset()
+
+        self.path = path
+        self._file = open(path, "a") if path else None
+
+    def reset(self):
+        """
+        Empty the in-memory history (the entries already streamed to the file are kept)
+        """
+        self._values = np.empty(self._initial_capacity, dtype=np.float64)
+        self._leaf_ids = np.empty(self._initial_capacity, dtype=np.int64)
+        self._size = 0
+        self._leaves = []
+        self._first_values = []
+        self._leaf_index = dict()
+        self._nb_leaves_written = 0
+
+    def append(self, leaf: str, value: float):
+        leaf_id = self._leaf_index.get(leaf)
+        if leaf_id is None:
+            leaf_id = self._intern(leaf, leaf)
+        self._append(leaf_id, value)
+
+    def append_node(self, node: Node, value: float):
+        # Only build the leaf string the first time the leaf is seen
+        fingerprint = node.fingerprint()
+        leaf_id = self._leaf_index.get(fingerprint)
+        if leaf_id is None:
+            leaf_id = self._intern(fingerprint, str(node))
+        self._append(leaf_id, value)
+
+    def _intern(self, key: Union[str, int], leaf: str) -> int:
+        leaf_id = len(self._leaves)
+        self._leaf_index[key] = leaf_id
+        self._leaves.append(leaf)
+        return leaf_id
+
+    def _append(self, leaf_id: int, value: float):
+        if self._size == len(self._values):
+            self._grow()
+        self._values[self._size] = value
+        self._leaf_ids[self._size] = leaf_id
+        self._size += 1
+        if leaf_id == len(self._first_values):
+            self._first_values.append(value)
+
+        if self._file is not None:
+            self._write(leaf_id, value)
+
+    def extend(self, leaves: List[str], values: List[float]):
+        for leaf, value in zip(leaves, values):
+            self.append(leaf, value)
+
+    def _grow(self):
+        # The previous arrays are not modified so the views already returned remain valid
+        self._values = np.concatenate([self._values, np.empty(len(self._values), dtype=np.float64)])
+        self._leaf_ids = np.concatenate([self._leaf_ids, np.empty(len(self._leaf_ids), dtype=np.int64)])
+
+    def _write(self, leaf_id: int, value: float):
+        if leaf_id == self._nb_leaves_written:
+            self._file.write("%d\t%.17g\t%s\n" % (leaf_id, float(value), json.dumps(self._leaves[leaf_id])))
+            self._nb_leaves_written += 1
+        else:
+            self._file.write("%d\t%.17g\t\n" % (leaf_id, float(value)))
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> "EvaluationHistory":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def values(self) -> np.ndarray:
+        return self._values[: self._size]
+
+    def leaf_ids(self) -> np.ndarray:
+        return self._leaf_ids[: self._size]
+
+    def leaves(self) -> List[str]:
+        """
+        Return the leaves strings in the order they appeared first (leaf_ids index this list)
+        """
+        return self._leaves
+
+    def nb_unique_leaves(self) -> int:
+        return len(self._leaves)
+
+    def has_node(self, node: Node) -> bool:
+        # Whether the leaf has been added with append_node (side-effect free)
+        return node.fingerprint() in self._leaf_index
+
+    def first_values(self) -> np.ndarray:
+        """
+        Return the value of each leaf the first time it appeared (indexed like leaves)
+        """
+        return np.array(self._first_values, dtype=np.float64)
+
+    def history_of_leaves(self) -> List[str]:
+        return [self._leaves[leaf_id] for leaf_id in self.leaf_ids()]
+
+    @classmethod
+    def from_file(cls, path: str) -> "EvaluationHistory":
+        """
+        Load in memory an history that has been streamed to a file
+        (the leaf ids are local to each reset, so they are remapped on the leaves strings)
+        """
+        history = cls()
+        leaves_by_id: Dict[int, str] = dict()
+        with open(path) as file:
+            for line in file:
+                leaf_id, value, leaf = line.rstrip("\n").split("\t", 2)
+                if leaf_id == "0" and leaf:
+                    leaves_by_id = dict()  # a new reset started
+                if leaf:
+                    leaves_by_id[int(leaf_id)] = json.loads(leaf)
+                history.append(leaves_by_id[int(leaf_id)], float(value))
+        return history
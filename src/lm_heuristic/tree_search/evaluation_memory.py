@@ -0,0 +1,191 @@
+"""
+Define the memory used by the evaluator to keep the values of the leaves that have already been evaluated
+"""
+
+from typing import *
+from collections import OrderedDict
+import sys
+
+
+# Approximate number of bytes used by the bookkeeping of an entry (dictionaries slots, LRU links and sizes,
+# plus frequencies and buckets for LFU), measured with CPython 3.11
+ENTRY_OVERHEAD = {"LRU": 120, "LFU": 280}
+
+
+def default_entry_size(key: Hashable, value: float) -> int:
+    # The stored key (leaf fingerprint) and value, the bookkeeping is added by the memory (cf ENTRY_OVERHEAD)
+    return sys.getsizeof(key) + sys.getsizeof(value)
+
+
+class EvaluationMemory:
+    """
+    Map the leaves (identified by their fingerprints, cf Node.fingerprint) to their values.
+    The memory can be bounded either by a number of entries (max_entries)
+    or by an estimated number of bytes (max_bytes, the size of each entry being computed by entry_size_fct,
+    plus the bookkeeping overhead of the eviction policy). The number of bytes is an approximation: it does not
+    count the spare slots of the dictionaries nor the leaves strings kept by the history (cf EvaluationHistory).
+    Once full, it evicts:
+    - the least recently used entries if eviction_policy = LRU
+    - the least frequently used entries if eviction_policy = LFU (the least recently used among them in case of tie)
+
+    Pinned entries (cf Evaluator.set_default_value) are never evicted and do not count in the memory size.
+
+    The memory also keeps the number of hits / misses (counted by get, the `in` operator being side-effect free)
+    and of evictions.
+    All the operations are O(1) (amortized for LFU eviction).
+    """
+
+    def __init__(
+        self,
+        max_entries: int = None,
+        max_bytes: int = None,
+        eviction_policy: str = "LRU",
+        entry_size_fct: Callable[[Hashable, float], int] = default_entry_size,
+    ):
+        assert eviction_policy in ["LRU", "LFU"], "Only the following eviction policies are implemented : LRU, LFU"
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.eviction_policy = eviction_policy
+        self._entry_size_fct = entry_size_fct
+
+        self._pinned: Dict[Hashable, float] = dict()
+        self._values: Dict[Hashable, float] = OrderedDict()
+        self._sizes: Dict[Hashable, int] = dict()
+        self._nb_bytes = 0
+
+        # For LFU only : frequency of each entry and entries grouped by frequency (in LRU order)
+        self._frequencies: Dict[Hashable, int] = dict()
+        self._frequency_buckets: Dict[int, OrderedDict] = dict()
+        self._min_frequency = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def clear(self):
+        """
+        Remove all the entries (except the pinned ones) and reset the counters
+        """
+        self._values = OrderedDict()
+        self._sizes = dict()
+        self._nb_bytes = 0
+        self._frequencies = dict()
+        self._frequency_buckets = dict()
+        self._min_frequency = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def pin(self, key: Hashable, value: float):
+        self._pinned[key] = value
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._pinned or key in self._values
+
+    def get(self, key: Hashable, count_miss: bool = True) -> Optional[float]:
+        """
+        return the value of the key (None if it is not in memory), counted as a hit or a miss
+
+        :param count_miss: False if the miss is counted elsewhere (ie: when the leaf is evaluated, cf Evaluator)
+        """
+        if key in self._pinned:
+            self.hits += 1
+            return self._pinned[key]
+        if key in self._values:
+            self.hits += 1
+            value = self._values[key]
+            self._touch(key)
+            return value
+        if count_miss:
+            self.misses += 1
+        return None
+
+    def __getitem__(self, key: Hashable) -> float:
+        if key in self._pinned:
+            return self._pinned[key]
+        value = self._values[key]
+        self._touch(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: float):
+        if key in self._pinned:
+            self._pinned[key] = value
+            return
+
+        if key in self._values:
+            self._values[key] = value
+            self._touch(key)
+            return
+
+        size = 0
+        if self.max_bytes is not None:
+            size = self._entry_size_fct(key, value) + ENTRY_OVERHEAD[self.eviction_policy]
+        while self._values and self._is_full(size):
+            self._evict()
+
+        self._values[key] = value
+        self._sizes[key] = size
+        self._nb_bytes += size
+        if self.eviction_policy == "LFU":
+            self._frequencies[key] = 1
+            self._frequency_buckets.setdefault(1, OrderedDict())[key] = None
+            self._min_frequency = 1
+
+    def __len__(self) -> int:
+        return len(self._pinned) + len(self._values)
+
+    def pinned_items(self) -> Iterator[Tuple[Hashable, float]]:
+        yield from self._pinned.items()
+
+    def items(self) -> Iterator[Tuple[Hashable, float]]:
+        yield from self._pinned.items()
+        yield from self._values.items()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._values),
+            "pinned_entries": len(self._pinned),
+            "bytes": self._nb_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _is_full(self, new_entry_size: int) -> bool:
+        if self.max_entries is not None and len(self._values) >= self.max_entries:
+            return True
+        return self.max_bytes is not None and self._nb_bytes + new_entry_size > self.max_bytes
+
+    def _touch(self, key: Hashable):
+        if self.eviction_policy == "LRU":
+            self._values.move_to_end(key)  # type: ignore
+            return
+
+        frequency = self._frequencies[key]
+        bucket = self._frequency_buckets[frequency]
+        del bucket[key]
+        if not bucket:
+            del self._frequency_buckets[frequency]
+            if self._min_frequency == frequency:
+                self._min_frequency = frequency + 1
+        self._frequencies[key] = frequency + 1
+        self._frequency_buckets.setdefault(frequency + 1, OrderedDict())[key] = None
+
+    def _evict(self):
+        if self.eviction_policy == "LRU":
+            key, _ = self._values.popitem(last=False)  # type: ignore
+        else:
+            if self._min_frequency not in self._frequency_buckets:
+                self._min_frequency = min(self._frequency_buckets)
+            bucket = self._frequency_buckets[self._min_frequency]
+            key, _ = bucket.popitem(last=False)
+            if not bucket:
+                del self._frequency_buckets[self._min_frequency]
+            del self._frequencies[key]
+            del self._values[key]
+
+        self._nb_bytes -= self._sizes.pop(key)
+        self.evictions += 1
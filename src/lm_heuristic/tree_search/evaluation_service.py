@@ -0,0 +1,260 @@
+"""
+Define an evaluation service that can be shared by several evaluators (ie: several searches running at once)
+so that the leaves they send are scored together by a single sentence scorer
+"""
+
+from typing import *
+from collections import deque
+from concurrent.futures import Future
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_NO_CONTEXT_SET = object()
+
+
+class EvaluationService:
+    """
+    The evaluation service owns a sentence scorer and a worker thread. Any number of clients (cf client method),
+    each one being used as the evaluation function of an Evaluator, can send it sentences from different threads:
+    - the pending sentences of all the clients are merged into batches of batch_size sentences
+    (the worker waits at most max_wait seconds for a batch to be full)
+    - identical (context, sentence) requests that are in flight together are only scored once
+    - each client call blocks until all its sentences have been scored, and receives its own results
+
+    The sentences are scored context by context : if the clients use different contexts, the worker calls
+    set_context on the scorer before scoring the sentences of each context (None meaning no context).
+
+    If the scorer has a score_continuations method (cf GPT2Score), the clients have one too (cf
+    ContinuationEvaluationClient), so that the evaluators can score lexical slots: each of those calls
+    is run by the worker on its own (it is not merged with other requests).
+    """
+
+    def __init__(self, sentence_scorer, batch_size: int = None, max_wait: float = 0.005):
+        """
+        :param sentence_scorer: object with a build method and a __call__(List[str]) -> List[float] method
+        (and a set_context method if the clients use contexts)
+        :param batch_size: maximal number of sentences sent at once to the scorer (default: scorer batch size)
+        :param max_wait: time (in seconds) the worker waits for more sentences when a batch is not full
+        """
+        self._scorer = sentence_scorer
+        self.batch_size = batch_size if batch_size else getattr(sentence_scorer, "batch_size", 1)
+        self.max_wait = max_wait
+
+        self._condition = threading.Condition()
+        self._queue: Deque[Tuple[Any, str]] = deque()  # (context, sentence) waiting to be scored
+        self._in_flight: Dict[Tuple[Any, str], Future] = dict()
+        # (context, left, continuations, future) waiting to be scored with score_continuations
+        self._continuations_queue: Deque[Tuple[Any, str, List[str], Future]] = deque()
+        self._current_context = _NO_CONTEXT_SET
+        self._worker: threading.Thread = None
+        self._closed = False
+
+        self.nb_requested_sentences = 0
+        self.nb_deduplicated_sentences = 0
+        self.nb_scored_sentences = 0
+        self.nb_batches = 0
+
+    def build(self):
+        with self._condition:
+            assert not self._closed, "The evaluation service is closed"
+            if self._worker is not None:
+                return
+            self._scorer.build()
+            self._worker = threading.Thread(target=self._run, daemon=True)
+            self._worker.start()
+
+    def close(self):
+        """
+        Stop the worker thread: the requests that are still pending fail with a RuntimeError
+        """
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        if self._worker is not None:
+            self._worker.join()
+
+        exception = RuntimeError("The evaluation service is closed")
+        with self._condition:
+            for key in self._queue:
+                self._in_flight.pop(key).set_exception(exception)
+            self._queue.clear()
+            for _, _, _, future in self._continuations_queue:
+                future.set_exception(exception)
+            self._continuations_queue.clear()
+
+    def __enter__(self) -> "EvaluationService":
+        self.build()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def client(self, context: str = None) -> "EvaluationClient":
+        if hasattr(self._scorer, "score_continuations"):
+            return ContinuationEvaluationClient(self, context)
+        return EvaluationClient(self, context)
+
+    def score(self, sentences: List[str], context: str = None) -> List[float]:
+        """
+        Thread-safe: block until all the sentences have been scored (with the given context)
+        """
+        assert self._worker is not None, "The evaluation service must be built before scoring sentences"
+        futures = []
+        with self._condition:
+            assert not self._closed, "The evaluation service is closed"
+            for sentence in sentences:
+                key = (context, sentence)
+                future = self._in_flight.get(key)
+                if future is None:
+                    future = Future()
+                    self._in_flight[key] = future
+                    self._queue.append(key)
+                else:
+                    self.nb_deduplicated_sentences += 1
+                futures.append(future)
+            self.nb_requested_sentences += len(sentences)
+            self._condition.notify()
+
+        return [future.result() for future in futures]
+
+    def score_continuations(self, left: str, continuations: List[str], context: str = None) -> List[float]:
+        """
+        Thread-safe: block until the scorer has scored the continuations of left (with the given context)
+        """
+        assert self._worker is not None, "The evaluation service must be built before scoring sentences"
+        assert hasattr(self._scorer, "score_continuations"), "The scorer can not score continuations"
+        future: Future = Future()
+        with self._condition:
+            assert not self._closed, "The evaluation service is closed"
+            self._continuations_queue.append((context, left, continuations, future))
+            self.nb_requested_sentences += len(continuations)
+            self._condition.notify()
+        return future.result()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "requested_sentences": self.nb_requested_sentences,
+            "deduplicated_sentences": self.nb_deduplicated_sentences,
+            "scored_sentences": self.nb_scored_sentences,
+            "batches": self.nb_batches,
+        }
+
+    def _next_batch(self) -> Optional[Tuple[Any, Any]]:
+        """
+        return the context and the requests of the next batch to score
+        (or the context and a continuations request : (left, continuations, future)),
+        None once the service is closed
+        """
+        with self._condition:
+            while not self._queue and not self._continuations_queue and not self._closed:
+                self._condition.wait()
+            if self._closed:
+                return None
+
+            if self._continuations_queue:
+                context, left, continuations, future = self._continuations_queue.popleft()
+                return context, (left, continuations, future)
+
+            # Give a chance to the other clients to complete the batch
+            deadline = time.perf_counter() + self.max_wait
+            while len(self._queue) < self.batch_size:
+                remaining_time = deadline - time.perf_counter()
+                if remaining_time <= 0:
+                    break
+                self._condition.wait(remaining_time)
+
+            # Only take the requests that share the context of the oldest one
+            context = self._queue[0][0]
+            batch, others = [], deque()
+            while self._queue and len(batch) < self.batch_size:
+                key = self._queue.popleft()
+                (batch if key[0] == context else others).append(key)
+            others.extend(self._queue)
+            self._queue = others
+            return context, batch
+
+    def _run(self):
+        logger.info("Evaluation service worker correctly launched")
+        while True:
+            request = self._next_batch()
+            if request is None:
+                break
+            context, batch = request
+            if isinstance(batch, tuple):
+                self._run_continuations(context, *batch)
+            else:
+                self._run_batch(context, batch)
+        logger.info("Evaluation service worker stopped")
+
+    def _set_context(self, context: Any):
+        if context != self._current_context:
+            # The context of the scorer is unknown if set_context fails
+            self._current_context = _NO_CONTEXT_SET
+            # A scorer without set_context (ie: ZeroScorer) can only be used without context
+            if context is not None or hasattr(self._scorer, "set_context"):
+                self._scorer.set_context(context)
+            self._current_context = context
+
+    def _run_batch(self, context: Any, batch: List[Tuple[Any, str]]):
+        try:
+            self._set_context(context)
+            scores = self._scorer([sentence for _, sentence in batch])
+        except Exception as exception:  # pylint: disable=broad-except
+            logger.exception("Error while scoring a batch of sentences")
+            with self._condition:
+                for key in batch:
+                    self._in_flight.pop(key).set_exception(exception)
+            return
+
+        with self._condition:
+            self.nb_scored_sentences += len(batch)
+            self.nb_batches += 1
+            for key, score in zip(batch, scores):
+                self._in_flight.pop(key).set_result(score)
+
+    def _run_continuations(self, context: Any, left: str, continuations: List[str], future: Future):
+        try:
+            self._set_context(context)
+            scores = self._scorer.score_continuations(left, continuations)
+        except Exception as exception:  # pylint: disable=broad-except
+            logger.exception("Error while scoring continuations")
+            future.set_exception(exception)
+            return
+        with self._condition:
+            self.nb_scored_sentences += len(continuations)
+            self.nb_batches += 1
+        future.set_result(scores)
+
+
+class EvaluationClient:
+    """
+    Evaluation function that forwards the sentences to a shared evaluation service
+    (each client can use its own context)
+    """
+
+    def __init__(self, service: EvaluationService, context: str = None):
+        self.service = service
+        self.context = context
+
+    def build(self):
+        self.service.build()
+
+    def set_context(self, context: str):
+        self.context = context
+
+    def __call__(self, sentences: List[str]) -> List[float]:
+        return self.service.score(sentences, self.context)
+
+
+class ContinuationEvaluationClient(EvaluationClient):
+    """
+    Client of a service whose scorer can score the continuations of a left part (cf Evaluator.eval_lexical_slot)
+    """
+
+    def score_continuations(self, left: str, continuations: List[str]) -> List[float]:
+        return self.service.score_continuations(left, continuations, self.context)
@@ -4,68 +4,271 @@ and return its value (or a batch of values)
 """
 
 from typing import *
+import heapq
+from itertools import count
+import threading
+
+import numpy as np
 
 from lm_heuristic.tree import Node
+from .evaluation_memory import EvaluationMemory
+from .evaluation_history import EvaluationHistory
 
 
 class Evaluator:
     """
     The evaluator is used to wrap an evaluation function and add on top of it several features :
     - a memory: so that two leave representing the same value will never be input to the
-    evaluation function twice.
-    - a history: keep track of all the call that are make to the object
+    evaluation function twice. The memory can be bounded (in number of entries or in bytes),
+    the least recently / frequently used values being then evicted (cf EvaluationMemory)
+    - a history: keep track of all the call that are make to the object. The history is stored column-wise
+    (cf EvaluationHistory) and can be streamed to an append-only file (history_path)
+    - a top-k: the top_k best leaves are kept in a bounded min-heap updated at each evaluation, so that
+    the best leaves can be queried at any time (even in the middle of a search) without sorting the memory.
+    The nodes of the other leaves are not kept: when more than top_k leaves are requested, top_n_best falls back to
+    the leaves strings of the history (cf ensure_top_k to track more leaves in the heap before a search)
+
+    By default, reset (called at the beginning of each search) empties the memory. With warm_memory=True,
+    the memory is kept as a score cache shared by all the searches (random restarts, benchmark repetitions, ...)
+    while the per-search statistics (best leaf, top-k, history, memory counters) are still reset.
+    The memory must then be cleared by hand (clear_memory) if the evaluation function changes, ie: new context.
+
+    The evaluator can be used from several threads (ie: the MCTS with parallel_strategy="multithread"):
+    the memory, the top-k and the history are guarded by a lock, which is not held while the leaves are scored.
     """
 
-    def __init__(self, evaluation_fct: Callable[[List[str]], List[float]]):
+    def __init__(
+        self,
+        evaluation_fct: Callable[[List[str]], List[float]],
+        memory_max_entries: int = None,
+        memory_max_bytes: int = None,
+        eviction_policy: str = "LRU",
+        history_path: str = None,
+        top_k: int = 10,
+        warm_memory: bool = False,
+    ):
         self._evaluation_fct = evaluation_fct
-        self._memory: Dict[Node, float] = dict()
-        self._default_values: Dict[Node, float] = dict()
-        self._call_history: List[Tuple[Node, float]] = list()
+        # The memory is keyed by the fingerprints of the leaves (cf Node.fingerprint), so it does not keep them alive
+        self._memory = EvaluationMemory(memory_max_entries, memory_max_bytes, eviction_policy)
+        self._default_nodes: Dict[int, Node] = dict()
+        self.history = EvaluationHistory(history_path)
         self._best_node: Node
         self._best_value: float = -1.0
 
+        self.top_k = top_k
+        self._top_k_heap: List[Tuple[float, int, Node]] = []
+        self._top_k_nodes: Set[Node] = set()
+        # Break the ties between equal values without comparing the nodes: the leaf seen first ranks first
+        self._heap_counter = count(0, -1)
+        # Number of best leaves of the current search the heap is exact for (top_k may grow during a search)
+        self._exact_top_k = top_k
+
+        self.warm_memory = warm_memory
+        self._lock = threading.RLock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # The lock can not be pickled (ie: spawned process of ParallelEvalBuffer with parallel_strategy="multiprocess")
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
     def reset(self):
-        self._memory = self._default_values.copy()
-        self._call_history = list()
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        if self.warm_memory:
+            self._memory.reset_stats()
+        else:
+            self._memory.clear()
+        self.history.flush()
+        self.history.reset()
         self._best_node = None
         self._best_value = -1.0
 
+        self._top_k_heap = []
+        self._top_k_nodes = set()
+        self._exact_top_k = self.top_k
+        for fingerprint, value in self._memory.pinned_items():
+            self._update_top_k(self._default_nodes[fingerprint], value)
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
+
+    def close(self):
+        # Close the file the history is streamed to (if any)
+        self.history.close()
+
+    def __enter__(self) -> "Evaluator":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
     def build(self):
         self._evaluation_fct.build() # To load the LM in memory from the evaluator
 
     def set_default_value(self, node: Node, value: float):
         # Sometimes it is interesting to specificy default values
         # For instance, when using FeatureGrammarNode, we can set a value to DEAD_END node
-        self._default_values[node] = value
-        self._memory.update(self._default_values)
+        # Those values are pinned in memory : they will never be evicted
+        with self._lock:
+            self._memory.pin(node.fingerprint(), value)
+            self._default_nodes[node.fingerprint()] = node
+            self._update_top_k(node, value)
+
+    def ensure_top_k(self, top_k: int):
+        """
+        Track at least the top_k best leaves in the heap. The leaves already evicted from the heap are not kept,
+        so it must be called before the search (cf Search.track_top_n_leaves): called in the middle of a search,
+        the larger heap is only used from the next reset
+        """
+        with self._lock:
+            if top_k <= self.top_k:
+                return
+            self.top_k = top_k
+            if len(self.history) == 0:
+                self._exact_top_k = top_k
+
+    def memory_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return self._memory.stats()
 
     def has_already_eval(self, node: Node) -> bool:
-        return node in self._memory
+        # Side-effect free (the hits and misses are not counted)
+        return node.fingerprint() in self._memory
 
-    def value_from_memory(self, node: Node) -> float:
-        self._call_history.append((node, self._memory[node]))
-        return self._memory[node]
+    def value_from_memory(self, node: Node) -> Optional[float]:
+        """
+        return the value of the node if it is in memory, None otherwise. Only the hits are counted here:
+        a leaf that is not in memory is counted as a miss when it is evaluated (cf eval)
+        """
+        with self._lock:
+            value = self._memory.get(node.fingerprint(), count_miss=False)
+            if value is not None:
+                # With a warm memory, the value may come from a previous search
+                self._record(node, value)
+            return value
 
     def eval(self, nodes: List[Node]) -> List[float]:
-        values = self._evaluation_fct(list(map(str, nodes)))
+        """
+        Return the values of the nodes: the values already in memory are served from it
+        and only the other leaves are input to the evaluation function (each of them once)
+        """
+        values: List[Optional[float]] = [None] * len(nodes)
+        to_eval: Dict[Node, List[int]] = dict()
+        with self._lock:
+            for i, node in enumerate(nodes):
+                if node in to_eval:
+                    to_eval[node].append(i)
+                    continue
+                value = self._memory.get(node.fingerprint())
+                if value is not None:
+                    values[i] = value
+                    self._record(node, value)
+                else:
+                    to_eval[node] = [i]
 
-        for node, value in zip(nodes, values):
-            self._memory[node] = value
-            if value > self._best_value:
-                self._best_node, self._best_value = node, value 
+        if to_eval:
+            # The lock is not held while the leaves are scored
+            eval_nodes = list(to_eval)
+            eval_values = self._evaluation_fct(list(map(str, eval_nodes)))
+            with self._lock:
+                self._store(eval_nodes, eval_values)
+                for node, value in zip(eval_nodes, eval_values):
+                    values[to_eval[node][0]] = value
+                    # The other occurrences of the leaf are recorded in the history too
+                    for i in to_eval[node][1:]:
+                        values[i] = value
+                        self._record(node, value)
+        return values  # type: ignore
+
+    def can_eval_lexical_slot(self, node: Node) -> bool:
+        return (
+            hasattr(self._evaluation_fct, "score_continuations")
+            and hasattr(node, "lexical_slot")
+            and node.lexical_slot() is not None
+        )
 
-        self._call_history += list(zip(nodes, values))
+    def eval_lexical_slot(self, node: Node) -> List[float]:
+        """
+        Evaluate all the children of a node whose children only differ by one word (cf CFGrammarNode.lexical_slot)
+        with a single call to the score_continuations method of the evaluation function
+        """
+        if not self.can_eval_lexical_slot(node):
+            return self.eval(node.children())
 
+        left, continuations = node.lexical_slot()
+        values = self._evaluation_fct.score_continuations(left, continuations)
+        with self._lock:
+            self._store(node.children(), values)
         return values
 
-    def history_of_terminal_nodes(self):
-        return [x[0] for x in self._call_history]
+    def _store(self, nodes: List[Node], values: List[float]):
+        for node, value in zip(nodes, values):
+            self._memory[node.fingerprint()] = value
+            self._record(node, value)
+
+    def _record(self, node: Node, value: float):
+        # Update the best leaf, the top-k and the history with a value returned by the evaluator
+        if value > self._best_value:
+            self._best_node, self._best_value = node, value
+        self._update_top_k(node, value)
+        self.history.append_node(node, value)
+
+    def _update_top_k(self, node: Node, value: float):
+        if node in self._top_k_nodes:
+            return
+        if len(self._top_k_heap) < self.top_k:
+            heapq.heappush(self._top_k_heap, (value, next(self._heap_counter), node))
+            self._top_k_nodes.add(node)
+        elif value > self._top_k_heap[0][0]:
+            _, _, removed_node = heapq.heapreplace(self._top_k_heap, (value, next(self._heap_counter), node))
+            self._top_k_nodes.remove(removed_node)
+            self._top_k_nodes.add(node)
+
+    def history_of_leaves(self) -> List[str]:
+        # Only the leaves strings are kept in the history (not the nodes)
+        return self.history.history_of_leaves()
+
+    def history_of_values(self) -> np.ndarray:
+        # View over the history values (no copy)
+        return self.history.values()
 
-    def history_of_values(self):
-        return [x[1] for x in self._call_history]
+    def top_n_best(self, top_n: int) -> List[Tuple[Union[Node, str], float]]:
+        """
+        Return the top_n best (leaf, value) of the current search. The leaves are nodes when they are tracked
+        by the heap (top_n <= top_k), and leaves strings otherwise (cf _top_n_best_from_history)
+        """
+        with self._lock:
+            if top_n > self._exact_top_k:
+                return self._top_n_best_from_history(top_n)
+            return [(node, value) for value, _, node in heapq.nlargest(top_n, self._top_k_heap)]
 
-    def top_n_best(self, top_n):
-        return sorted(self._memory.items(), key=lambda x: x[1], reverse=True)[:top_n]
+    def _top_n_best_from_history(self, top_n: int) -> List[Tuple[str, float]]:
+        # The pinned leaves that were not returned during the search come first, as when they were set
+        leaves, values = [], []
+        for fingerprint, value in self._memory.pinned_items():
+            if not self.history.has_node(self._default_nodes[fingerprint]):
+                leaves.append(str(self._default_nodes[fingerprint]))
+                values.append(value)
+        leaves.extend(self.history.leaves())
+        values = np.concatenate([np.array(values, dtype=np.float64), self.history.first_values()])
+        if top_n < len(values):
+            # Partial selection of the candidates (the leaves tied with the last one are all kept)
+            threshold = np.partition(values, len(values) - top_n)[len(values) - top_n]
+            candidates = np.flatnonzero(values >= threshold)
+        else:
+            candidates = np.arange(len(values))
+        # Stable sort: the leaf seen first ranks first among equal values
+        order = candidates[np.argsort(-values[candidates], kind="stable")][:top_n]
+        return [(leaves[idx], float(values[idx])) for idx in order]
 
     def best_result(self):
-        return self._best_node, self._best_value
\ No newline at end of file
+        with self._lock:
+            return self._best_node, self._best_value
\ No newline at end of file
@@ -39,6 +39,7 @@ class EvalBuffer:
     - if at any time the buffer contains couple of (counter_node, leaf) that share the same leaf
         ie: (counter_node_1, leaf_A), (counter_node_2, leaf_A)
     only one instance of the leaf will be sent to the evaluation function
+    (the leaves are identified by their fingerprint, cf Node.fingerprint)
 
     - the leaf are sent to the evaluation function by batch of buffer_size
     """
@@ -47,7 +48,7 @@ class EvalBuffer:
         self, buffer_size: int, evaluator: Evaluator, load_LM_in_memory: bool = True
     ):
         self._buffer_size = buffer_size
-        self._index_table: Dict[Node, List[CounterNode]] = dict()
+        self._index_table: Dict[int, Tuple[Node, List[CounterNode]]] = dict()
         self._evaluator = evaluator
 
         # load_LM_in_memory condition enable to not directly load the model in memory for class that inherate of EvalBuffer
@@ -57,26 +58,25 @@ class EvalBuffer:
         self._results: List[Tuple[CounterNode, Node, float]] = []
 
     def add(self, counter_node: CounterNode, leaf: Node):
-        if self._evaluator.has_already_eval(leaf):
-            reward = self._evaluator.value_from_memory(leaf)
+        reward = self._evaluator.value_from_memory(leaf)
+        if reward is not None:
             self._results.append((counter_node, leaf, reward))
 
         else:
-            self._index_table.setdefault(leaf, [])
-            self._index_table[leaf].append(counter_node)
+            self._index_table.setdefault(leaf.fingerprint(), (leaf, []))[1].append(counter_node)
 
             if len(self._index_table) == self._buffer_size:
                 self._compute()
 
     def _compute(self):
-        leaves = list(self._index_table.keys())
+        leaves = [leaf for leaf, _ in self._index_table.values()]
         results = self._evaluator.eval(leaves)
         self._handle_results(leaves, self._index_table, results)
         self._index_table = dict()
 
     def _handle_results(self, leaves, index_table, results):
         for leaf, reward in zip(leaves, results):
-            for counter_node in index_table[leaf]:
+            for counter_node in index_table[leaf.fingerprint()][1]:
                 self._results.append((counter_node, leaf, reward))
 
     def pop_results(self):
@@ -173,7 +173,7 @@ class ParallelEvalBuffer(EvalBuffer):
         self._max_nb_of_tasks_in_advance = max_nb_of_tasks_in_advance
 
     def _compute(self):
-        leave = list(self._index_table.keys())
+        leave = [leaf for leaf, _ in self._index_table.values()]
         if len(self._in_progress_tasks) == self._max_nb_of_tasks_in_advance:
             self._retrieve_from_results_queue(block=True)
 
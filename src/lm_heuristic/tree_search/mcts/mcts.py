@@ -53,6 +53,9 @@ class MonteCarloTreeSearch(TreeSearch):
     - choose to accumulate a certain amount of leaves before evaluating in one pass
 
     - perform the evaluation in another thread/process
+
+    - evaluate at once all the leaves of a lexical slot (ie: leaves that only differ by one word) when
+    it is expanded, if the evaluation function supports it (cf Evaluator.eval_lexical_slot)
     """
 
     def __init__(
@@ -67,6 +70,7 @@ class MonteCarloTreeSearch(TreeSearch):
         name: str = "MCTS",
         progress_bar: bool = False,
         parallel_strategy: str = "none",
+        lexical_slot_evaluation: bool = False,
     ):
         TreeSearch.__init__(self, evaluator, name, progress_bar)
         self.expansion_threshold = expansion_threshold
@@ -83,6 +87,12 @@ class MonteCarloTreeSearch(TreeSearch):
 
         self.child_root_selection = child_root_selection
 
+        # The lexical slots are evaluated directly from the search, so not in the evaluation worker
+        assert not (
+            lexical_slot_evaluation and parallel_strategy != "none"
+        ), "lexical_slot_evaluation can only be used with parallel_strategy = none"
+        self.lexical_slot_evaluation = lexical_slot_evaluation
+
     def _search(self, root: Node, nb_of_tree_walks: int):
         nb_tree_walks_per_search = nb_of_tree_walks // self.nb_random_restarts
 
@@ -171,6 +181,17 @@ class MonteCarloTreeSearch(TreeSearch):
 
         counter_node.expand()  
 
+        if self.lexical_slot_evaluation:
+            self.eval_lexical_slot(counter_node.reference_node)
+
+    def eval_lexical_slot(self, node: Node):
+        # If all the children of the node are leaves that only differ by one word, evaluate them at once
+        # so that the next simulations from this node will directly retrieve the leaf value from memory
+        if self._evaluator.can_eval_lexical_slot(node) and not all(
+            self._evaluator.has_already_eval(child) for child in node.children()
+        ):
+            self._evaluator.eval_lexical_slot(node)
+
     @time_function
     def simulation_phase(self, counter_node: CounterNode) -> Node:
         return counter_node.reference_node.random_walk()
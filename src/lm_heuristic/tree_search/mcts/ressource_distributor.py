@@ -88,13 +88,20 @@ class RessourceDistributor:
         if self.strategy == AllocationStrategy.UNIFORM or self.strategy == AllocationStrategy.LINEAR:
             logger.info("Computing statistic values on the tree.")
             stats = TreeStats(tree)
-            stats.accumulate_stats(nb_samples=self.stats_samples)
-            self.depth_max = int(stats.depths_info()["mean"])
-            logger.info(
-                "Stats results :\n- depth = %s,\n- branching_factor = %s",
-                str(stats.depths_info()),
-                str(stats.branching_factors_info()),
-            )
+            # When the leaves of the tree can be counted, the depth statistics are exact and cost no tree walk
+            if stats.compute_exact_stats():
+                self.depth_max = int(stats.depths_info()["mean"])
+                logger.info(
+                    "Exact stats results :\n- depth = %s,\n- nb of leaves = %d", str(stats.depths_info()), stats.nb_leaves
+                )
+            else:
+                stats.accumulate_stats(nb_samples=self.stats_samples)
+                self.depth_max = int(stats.depths_info()["mean"])
+                logger.info(
+                    "Stats results :\n- depth = %s,\n- branching_factor = %s",
+                    str(stats.depths_info()),
+                    str(stats.branching_factors_info()),
+                )
 
         if self.strategy == AllocationStrategy.LINEAR:
             self.a = 2 / (1 - self.depth_max) * (ressources / (self.depth_max))
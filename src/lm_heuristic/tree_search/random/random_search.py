@@ -12,7 +12,8 @@ from lm_heuristic.tree import Node
 class RandomSearch(TreeSearch):
     """
     Randomly sample the tree. 
-    Except sending the leave by batches, there is no optimization at all.
+    Except sending the leave by batches (the leaves of a batch being sampled at once, cf Node.random_walks),
+    there is no optimization at all.
     """
     def __init__(
         self,
@@ -25,13 +26,8 @@ class RandomSearch(TreeSearch):
         self._buffer_size = buffer_size
 
     def _search(self, root: Node, nb_of_tree_walks: int):
-        leave_buffer = []
-
-        for _ in tqdm(range(nb_of_tree_walks), disable=not self._progress_bar):
-            leave_buffer.append(root.random_walk())
-            if len(leave_buffer) == self._buffer_size:
+        with tqdm(total=nb_of_tree_walks, disable=not self._progress_bar) as progress_bar:
+            for begin in range(0, nb_of_tree_walks, self._buffer_size):
+                leave_buffer = root.random_walks(min(self._buffer_size, nb_of_tree_walks - begin))
                 self._evaluator.eval(leave_buffer)
-                leave_buffer = []
-
-        if len(leave_buffer) > 0:
-            self._evaluator.eval(leave_buffer)
+                progress_bar.update(len(leave_buffer))
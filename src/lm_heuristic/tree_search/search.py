@@ -11,6 +11,7 @@ import seaborn as sns
 from lm_heuristic.tree import Node
 from lm_heuristic.utils.timer import time_function, Timer
 from .evaluator import Evaluator
+from .evaluation_history import EvaluationHistory
 
 class TreeSearch(ABC, Timer):
     """
@@ -36,19 +37,26 @@ class TreeSearch(ABC, Timer):
 
     def plot_leaf_values_distribution(self):
         values = self._evaluator.history_of_values()
-        assert values != [], "Try to plot leaf values distribution, but no search was performed yet"
+        assert len(values) > 0, "Try to plot leaf values distribution, but no search was performed yet"
 
         series_values = pd.Series(values, name="Leaf values")
         sns.set()
         sns.distplot(series_values, label=str(self))
 
+    def evaluation_history(self) -> EvaluationHistory:
+        return self._evaluator.history
+
     def set_name(self, name: str):
         self._name = name
 
     def __str__(self) -> str:
         return self._name
 
-    def top_n_leaves(self, top_n: int = 1) -> List[Tuple[Node, float]]:
+    def track_top_n_leaves(self, top_n: int):
+        # To call when more than the top_k leaves of the evaluator will be requested (cf top_n_leaves)
+        self._evaluator.ensure_top_k(top_n)
+
+    def top_n_leaves(self, top_n: int = 1) -> List[Tuple[Union[Node, str], float]]:
         return self._evaluator.top_n_best(top_n)
 
     @abstractmethod
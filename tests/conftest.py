@@ -0,0 +1,92 @@
+"""
+Tiny randomly initialized GPT2 / BERT models and their tokenizers, built from vocabulary files written
+in a temporary folder, so that the sentence scorers can be tested without downloading any pretrained model
+"""
+
+import json
+
+import pytest
+
+# A few merges so that some words are single tokens (ie: " cat", " dog") and the others are split in characters
+GPT2_MERGES = ["Ġ c", "Ġc a", "Ġca t", "Ġ d", "Ġd o", "Ġdo g", "Ġ t", "Ġt h", "Ġth e", "Ġ a"]
+
+BERT_WORDS = ["the", "a", "cat", "dog", "sat", "on", "mat", "is", "here", "and", "it", "ran", "."]
+
+
+@pytest.fixture(scope="session")
+def gpt2_tokenizer(tmp_path_factory):
+    from transformers import GPT2TokenizerFast
+    from transformers.tokenization_gpt2 import bytes_to_unicode
+
+    folder = tmp_path_factory.mktemp("gpt2")
+    vocab = {char: idx for idx, char in enumerate(bytes_to_unicode().values())}
+    for merge in GPT2_MERGES:
+        vocab.setdefault(merge.replace(" ", ""), len(vocab))
+    vocab["<|endoftext|>"] = len(vocab)
+
+    with open(folder / "vocab.json", "w") as file:
+        json.dump(vocab, file)
+    with open(folder / "merges.txt", "w") as file:
+        file.write("#version: 0.2\n" + "\n".join(GPT2_MERGES) + "\n")
+    return GPT2TokenizerFast(str(folder / "vocab.json"), str(folder / "merges.txt"))
+
+
+@pytest.fixture(scope="session")
+def gpt2_model(gpt2_tokenizer):
+    import torch
+    from transformers import GPT2Config, GPT2LMHeadModel
+
+    torch.manual_seed(0)
+    config = GPT2Config(
+        vocab_size=len(gpt2_tokenizer), n_positions=128, n_ctx=128, n_embd=32, n_layer=2, n_head=2
+    )
+    return GPT2LMHeadModel(config).eval()
+
+
+@pytest.fixture(scope="session")
+def bert_tokenizer(tmp_path_factory):
+    from transformers import BertTokenizerFast
+
+    folder = tmp_path_factory.mktemp("bert")
+    with open(folder / "vocab.txt", "w") as file:
+        file.write("\n".join(["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"] + BERT_WORDS) + "\n")
+    return BertTokenizerFast(str(folder / "vocab.txt"))
+
+
+@pytest.fixture(scope="session")
+def bert_model(bert_tokenizer):
+    import torch
+    from transformers import BertConfig, BertForMaskedLM
+
+    torch.manual_seed(0)
+    config = BertConfig(
+        vocab_size=len(bert_tokenizer),
+        hidden_size=32,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=64,
+        max_position_embeddings=128,
+    )
+    return BertForMaskedLM(config).eval()
+
+
+def built_scorer(scorer_class, model, tokenizer, **kwargs):
+    # Same state as after SentenceScore.build, with the tiny model instead of a pretrained one
+    scorer = scorer_class(model=model, device="cpu", **kwargs)
+    scorer.tokenizer = tokenizer
+    scorer.is_already_built = True
+    return scorer
+
+
+@pytest.fixture
+def gpt2_scorer(gpt2_model, gpt2_tokenizer):
+    from lm_heuristic.sentence_score import GPT2Score
+
+    return lambda **kwargs: built_scorer(GPT2Score, gpt2_model, gpt2_tokenizer, **kwargs)
+
+
+@pytest.fixture
+def bert_scorer(bert_model, bert_tokenizer):
+    from lm_heuristic.sentence_score import BertScore
+
+    return lambda **kwargs: built_scorer(BertScore, bert_model, bert_tokenizer, **kwargs)
@@ -0,0 +1,19 @@
+"""
+The packed scoring of BertScore (block-diagonal attention) must give the same scores as the padded one
+"""
+
+import pytest
+
+SENTENCES = ["the cat sat", "a dog", "the dog sat on the mat and it ran", "cat", "the mat is here ."]
+CONTEXT = "the cat is here and the dog ran ."
+
+
+@pytest.mark.parametrize("context", [None, CONTEXT])
+@pytest.mark.parametrize("packing_length", [16, 40, 128])
+def test_packed_scores_match_compute_score(bert_scorer, context, packing_length):
+    packed_scorer = bert_scorer(batch_size=2, packing_length=packing_length)
+    scorer = bert_scorer(batch_size=5)
+    packed_scorer.set_context(context)
+    scorer.set_context(context)
+
+    assert packed_scorer.compute_score(SENTENCES) == pytest.approx(scorer.compute_score(SENTENCES), rel=1e-4)
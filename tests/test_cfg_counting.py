@@ -0,0 +1,81 @@
+"""
+The counts of DerivationCounter must match an exhaustive enumeration of the tree of a left to right CFGrammarNode
+"""
+
+import os
+from collections import defaultdict
+
+import pytest
+from nltk import CFG
+
+from lm_heuristic.tree.interface.cfg_counting import MAX_DERIVATION_COUNTERS
+from lm_heuristic.tree.interface.nltk_grammar import CFGrammarNode
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "cfg")
+
+SMALL_GRAMMARS = {
+    # Recursion, single choice chains (shrunk nodes) and a non productive symbol
+    "recursive": """
+        S -> NP VP | S 'and' S
+        NP -> 'he' | 'the' N
+        N -> ADJ N | 'dog' | 'cat'
+        ADJ -> 'big'
+        VP -> V | V NP | DEAD
+        V -> 'runs'
+        DEAD -> DEAD 'x'
+    """,
+    # Ambiguous grammar: a same string is reached by several derivations
+    "ambiguous": """
+        S -> A B | A 'b' | 'a' B
+        A -> 'a' | A 'a'
+        B -> 'b' | 'b' B
+    """,
+}
+
+
+def enumerate_tree(root: CFGrammarNode, max_depth: int):
+    # Number of leaves and probability that a random walk reaches a leaf, by depth (root's depth = 1)
+    counts, probabilities = defaultdict(int), defaultdict(float)
+    stack = [(root, 1, 1.0)]
+    while stack:
+        node, depth, probability = stack.pop()
+        if node.is_terminal():
+            if str(node) != "DEAD_END.":
+                counts[depth] += 1
+                probabilities[depth] += probability
+            continue
+        if depth < max_depth:
+            children = node.children()
+            stack.extend((child, depth + 1, probability / len(children)) for child in children)
+    return counts, probabilities
+
+
+def check_counter(root: CFGrammarNode, max_depth: int):
+    counter = root.derivation_counter(max_depth)
+    counts, probabilities = enumerate_tree(root, max_depth)
+
+    assert {depth: count for depth, count in counter.depth_counts.items() if count} == dict(counts)
+    assert counter.nb_leaves == sum(counts.values())
+    for depth in set(probabilities) | set(counter.walk_depth_probabilities):
+        assert counter.walk_depth_probabilities.get(depth, 0.0) == pytest.approx(probabilities[depth], abs=1e-12)
+
+
+@pytest.mark.parametrize("max_depth", [3, 6, 9])
+@pytest.mark.parametrize("name", sorted(SMALL_GRAMMARS))
+def test_counts_match_enumeration(name, max_depth):
+    check_counter(CFGrammarNode.from_string(SMALL_GRAMMARS[name]), max_depth)
+
+
+def test_counts_match_enumeration_on_data_grammar():
+    check_counter(CFGrammarNode.from_cfg_file(os.path.join(DATA_DIR, "ex_1_small.cfg")), 15)
+
+
+def test_counters_are_bounded():
+    root = CFGrammarNode.from_string(SMALL_GRAMMARS["recursive"])
+    first_counter = root.derivation_counter(2)
+    assert root.derivation_counter(2) is first_counter
+
+    for max_depth in range(3, MAX_DERIVATION_COUNTERS + 4):
+        root.derivation_counter(max_depth)
+    assert len(root.compiled_cfg._derivation_counters) == MAX_DERIVATION_COUNTERS
+    assert root.derivation_counter(2) is not first_counter
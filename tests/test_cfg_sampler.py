@@ -0,0 +1,94 @@
+"""
+The leaves sampled by CFGSampler (sample and the vectorized sample_many) must follow the distribution
+of the left to right random walks of CFGrammarNode
+"""
+
+import math
+import random
+from collections import Counter, defaultdict
+
+import numpy as np
+import pytest
+
+from lm_heuristic.tree.interface.cfg_sampler import cfg_sampler
+from lm_heuristic.tree.interface.nltk_grammar import CFGrammarNode
+
+# Uneven branching, a single-choice chain (ADJ2) and a same symbol used twice in a rule (NP2)
+GRAMMAR = """
+    S -> NP VP | 'hello'
+    NP -> 'the' N | 'a' ADJ N | NP2 'and' NP2
+    NP2 -> 'he' | 'she'
+    N -> 'cat' | 'dog' | 'mouse'
+    ADJ -> 'big' | ADJ2
+    ADJ2 -> 'very' 'small'
+    VP -> 'runs' | 'sees' NP
+"""
+NB_SAMPLES = 20000
+
+
+def leaf_probabilities(root: CFGrammarNode):
+    # Probability that a random walk of the nodes (uniform choice among the children) reaches each leaf
+    probabilities = defaultdict(float)
+    stack = [(root, 1.0)]
+    while stack:
+        node, probability = stack.pop()
+        if node.is_terminal():
+            probabilities[str(node)] += probability
+            continue
+        children = node.children()
+        stack.extend((child, probability / len(children)) for child in children)
+    return probabilities
+
+
+def check_distribution(leaves, probabilities):
+    counts = Counter(leaves)
+    assert set(counts) <= set(probabilities)
+    for leaf, probability in probabilities.items():
+        frequency = counts[leaf] / len(leaves)
+        # 5 standard deviations
+        assert abs(frequency - probability) <= 5 * math.sqrt(probability * (1 - probability) / len(leaves)) + 1e-9
+
+
+@pytest.fixture
+def root():
+    return CFGrammarNode.from_string(GRAMMAR)
+
+
+def test_probabilities_sum_to_one(root):
+    assert sum(leaf_probabilities(root).values()) == pytest.approx(1.0)
+
+
+def test_sample_distribution(root):
+    random.seed(0)
+    sampler = cfg_sampler(root.compiled_cfg)
+    leaves = [root.compiled_cfg.to_string(sampler.sample(root._ids())) for _ in range(NB_SAMPLES)]
+    check_distribution(leaves, leaf_probabilities(root))
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_sample_many_distribution(root, seed):
+    sampler = cfg_sampler(root.compiled_cfg)
+    leaves = sampler.sample_many(root._ids(), NB_SAMPLES, rng=np.random.default_rng(seed))
+    check_distribution(list(map(root.compiled_cfg.to_string, leaves)), leaf_probabilities(root))
+
+
+def test_sample_many_from_a_derivation(root):
+    # Sampling from an inner node (derivation with terminal and non terminal symbols)
+    node = root.children()[0].children()[1]
+    leaves = cfg_sampler(root.compiled_cfg).sample_many(node._ids(), NB_SAMPLES, rng=np.random.default_rng(0))
+    check_distribution(list(map(root.compiled_cfg.to_string, leaves)), leaf_probabilities(node))
+
+
+def test_sample_many_is_reproducible_with_random_seed(root):
+    random.seed(0)
+    leaves = root.random_walks(50)
+    random.seed(0)
+    assert root.random_walks(50) == leaves
+
+
+def test_dead_end_samples():
+    root = CFGrammarNode.from_string("S -> A 'x'\nA -> A 'y'")
+    sampler = cfg_sampler(root.compiled_cfg)
+    assert sampler.sample(root._ids()) is None
+    assert sampler.sample_many(root._ids(), 10) == [None] * 10
+    assert all(str(leaf) == "DEAD_END." for leaf in root.random_walks(10))
@@ -0,0 +1,69 @@
+"""
+CompactCFGrammarNode must represent the same tree as CFGrammarNode (same children, leaves and lexical slots)
+"""
+
+import os
+import random
+
+import pytest
+
+from lm_heuristic.tree.interface.compact_cfg import CompactCFGrammarNode
+from lm_heuristic.tree.interface.nltk_grammar import CFGrammarNode
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "cfg")
+
+
+def compare_trees(node, compact_node, max_depth: int):
+    stack = [(node, compact_node, 1)]
+    nb_nodes = 0
+    while stack:
+        node, compact_node, depth = stack.pop()
+        nb_nodes += 1
+        assert str(node) == str(compact_node)
+        assert node.is_terminal() == compact_node.is_terminal()
+        if node.is_terminal() or depth == max_depth:
+            continue
+        assert node.lexical_slot() == compact_node.lexical_slot()
+        children, compact_children = node.children(), compact_node.children()
+        assert list(map(str, children)) == list(map(str, compact_children))
+        stack.extend((child, compact_child, depth + 1) for child, compact_child in zip(children, compact_children))
+    return nb_nodes
+
+
+@pytest.mark.parametrize("left_to_right_generation, max_depth", [(True, 8), (False, 5)])
+@pytest.mark.parametrize("name", ["ex_1_small", "ex_4"])
+def test_same_tree_as_cfg_grammar_node(name, left_to_right_generation, max_depth):
+    path = os.path.join(DATA_DIR, name + ".cfg")
+    root = CFGrammarNode.from_cfg_file(path, left_to_right_generation=left_to_right_generation)
+    compact_root = CompactCFGrammarNode.from_cfg_file(path, left_to_right_generation=left_to_right_generation)
+    assert compare_trees(root, compact_root, max_depth) > 100
+
+
+def test_same_children_without_shrink():
+    # CFGrammarNode does not pass the shrink option down to its children, so only the root children are compared
+    path = os.path.join(DATA_DIR, "ex_4.cfg")
+    root = CFGrammarNode.from_cfg_file(path, shrink=False)
+    compact_root = CompactCFGrammarNode.from_cfg_file(path, shrink=False)
+    assert list(map(str, root.children())) == list(map(str, compact_root.children()))
+
+
+def test_dead_end():
+    grammar = "S -> 'a' A | 'b'\nA -> B\nB -> A"
+    compare_trees(CFGrammarNode.from_string(grammar), CompactCFGrammarNode.from_string(grammar), 5)
+
+
+@pytest.mark.parametrize("left_to_right_generation", [True, False])
+def test_same_random_walks(left_to_right_generation):
+    path = os.path.join(DATA_DIR, "ex_4.cfg")
+    leaves = []
+    for node_class in [CFGrammarNode, CompactCFGrammarNode]:
+        root = node_class.from_cfg_file(path, left_to_right_generation=left_to_right_generation)
+        random.seed(0)
+        leaves.append(list(map(str, root.random_walks(20) + [root.random_walk() for _ in range(20)])))
+    assert leaves[0] == leaves[1]
+
+
+def test_compact_nodes_have_no_dict():
+    compact_root = CompactCFGrammarNode.from_cfg_file(os.path.join(DATA_DIR, "ex_4.cfg"))
+    assert not hasattr(compact_root, "__dict__")
+    assert all(not hasattr(child, "__dict__") for child in compact_root.children())
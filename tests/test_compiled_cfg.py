@@ -0,0 +1,198 @@
+"""
+The children of CFGrammarNode, generated from the tables of the compiled grammar (cf CompiledCFG),
+must be the same as the ones generated from the nltk grammar (grammar.productions(lhs=...)),
+except for the children that can never lead to a terminal string, which are pruned by the grammar analysis
+"""
+
+import math
+import os
+
+import nltk
+import pytest
+from nltk import CFG
+
+from lm_heuristic.tree import Node
+from lm_heuristic.tree.interface.compiled_cfg import compile_cfg
+from lm_heuristic.tree.interface.nltk_grammar import CFGrammarNode
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "cfg")
+GRAMMAR_NAMES = sorted(name[: -len(".cfg")] for name in os.listdir(DATA_DIR) if name.endswith(".cfg"))
+
+
+class NltkCFGrammarNode(Node):
+    # Old implementation: the children are generated from the productions of the nltk grammar
+
+    def __init__(self, symbols: tuple, cfg: CFG, left_to_right_generation=True, shrink=True):
+        Node.__init__(self)
+        self.cfg = cfg
+        self.symbols = (symbols,) if not isinstance(symbols, tuple) else symbols
+        self._children = None
+        self.left_to_right_generation = left_to_right_generation
+        self.shrink = shrink
+
+    def is_terminal(self) -> bool:
+        return not any(isinstance(symbol, nltk.grammar.Nonterminal) for symbol in self.symbols)
+
+    def children(self):
+        if not self._children:
+            self._children = (
+                self.compute_children_left_to_right() if self.left_to_right_generation else self.compute_all_children()
+            )
+        if (len(self._children) == 1) and (not self._children[0].is_terminal()) and (self.shrink):
+            self._children = self._children[0].children()
+        return self._children
+
+    def compute_children_left_to_right(self):
+        idx = next(idx for idx, symbol in enumerate(self.symbols) if isinstance(symbol, nltk.grammar.Nonterminal))
+        child_nodes = [
+            NltkCFGrammarNode(
+                self.symbols[:idx] + production.rhs() + self.symbols[idx + 1 :], self.cfg, self.left_to_right_generation
+            )
+            for production in self.cfg.productions(lhs=self.symbols[idx])
+        ]
+        return child_nodes if len(child_nodes) != 0 else [NltkCFGrammarNode(("DEAD_END",), None)]
+
+    def compute_all_children(self):
+        child_nodes = []
+        for idx, symbol in enumerate(self.symbols):
+            if isinstance(symbol, nltk.grammar.Nonterminal):
+                for production in self.cfg.productions(lhs=symbol):
+                    child_nodes.append(
+                        NltkCFGrammarNode(
+                            self.symbols[:idx] + production.rhs() + self.symbols[idx + 1 :],
+                            self.cfg,
+                            self.left_to_right_generation,
+                        )
+                    )
+        return child_nodes if len(child_nodes) != 0 else [NltkCFGrammarNode(("DEAD_END",), None)]
+
+    def __str__(self):
+        return " ".join(map(str, self.symbols)) + "."
+
+
+def compare_trees(node: CFGrammarNode, nltk_node: NltkCFGrammarNode, max_depth: int):
+    stack = [(node, nltk_node, 1)]
+    while stack:
+        node, nltk_node, depth = stack.pop()
+        assert str(node) == str(nltk_node)
+        assert node.is_terminal() == nltk_node.is_terminal()
+        if node.is_terminal() or depth == max_depth:
+            continue
+        children, nltk_children = node.children(), nltk_node.children()
+        assert [child.symbols for child in children] == [nltk_child.symbols for nltk_child in nltk_children]
+        stack.extend((child, nltk_child, depth + 1) for child, nltk_child in zip(children, nltk_children))
+
+
+@pytest.mark.parametrize("left_to_right_generation, max_depth", [(True, 8), (False, 4)])
+@pytest.mark.parametrize("name", GRAMMAR_NAMES)
+def test_same_children_as_nltk_grammar(name, left_to_right_generation, max_depth):
+    with open(os.path.join(DATA_DIR, name + ".cfg")) as file:
+        cfg = CFG.fromstring(file.read())
+    compare_trees(
+        CFGrammarNode(cfg.start(), cfg, left_to_right_generation),
+        NltkCFGrammarNode(cfg.start(), cfg, left_to_right_generation),
+        max_depth,
+    )
+
+
+@pytest.mark.parametrize("shrink", [True, False])
+def test_unit_production_chains(shrink):
+    # Single-choice chains, resolved in the closures with shrink
+    cfg = CFG.fromstring(
+        """
+        S -> A | 'x' B | C D
+        A -> 'a' E
+        E -> F
+        F -> 'f' | 'g' G
+        G -> 'end'
+        B -> B2 'y'
+        B2 -> C
+        C -> 'c'
+        D -> 'd' | C
+        """
+    )
+    compare_trees(CFGrammarNode(cfg.start(), cfg, shrink=shrink), NltkCFGrammarNode(cfg.start(), cfg, shrink=shrink), 8)
+
+
+# Unproductive symbols (cycle B <-> B2, symbol without production rule NONE) and an unreachable one (UNUSED)
+DEAD_GRAMMAR = """
+    S -> A | 'x' B | C D | 'y' NONE | S 'and' C
+    A -> 'a' E | B 'a'
+    E -> F
+    F -> 'f' | 'g' G | 'g' F G
+    G -> 'end' | 'the' 'end'
+    B -> B2
+    B2 -> B 'b' | NONE
+    C -> 'c'
+    D -> 'd' | C | D D
+    UNUSED -> 'unused' C
+"""
+
+
+def leaves(root, max_depth: int):
+    leaves, stack = set(), [(root, 1)]
+    while stack:
+        node, depth = stack.pop()
+        if node.is_terminal():
+            leaves.add(str(node))
+        elif depth < max_depth:
+            stack.extend((child, depth + 1) for child in node.children())
+    return leaves
+
+
+def shortest_derivations(cfg: CFG, symbol, max_depth: int):
+    # Minimum number of production rules and minimum length of the terminal strings derived from symbol
+    # (breadth first search over the derivations without shrink)
+    min_derivation_length, min_yield_length = math.inf, math.inf
+    layer = [NltkCFGrammarNode(symbol, cfg, left_to_right_generation=False, shrink=False)]
+    for depth in range(max_depth):
+        next_layer = []
+        for node in layer:
+            if node.is_terminal():
+                if node.symbols != ("DEAD_END",):
+                    min_derivation_length = min(min_derivation_length, depth)
+                    min_yield_length = min(min_yield_length, len(node.symbols))
+            else:
+                next_layer.extend(node.compute_all_children())
+        layer = next_layer
+    return min_derivation_length, min_yield_length
+
+
+def test_pruned_tree_keeps_the_same_leaves():
+    cfg = CFG.fromstring(DEAD_GRAMMAR)
+    root, nltk_root = CFGrammarNode(cfg.start(), cfg), NltkCFGrammarNode(cfg.start(), cfg)
+    nltk_leaves = leaves(nltk_root, 9)
+    assert "DEAD_END." in nltk_leaves
+    # The pruned tree does not go deeper than the old one to reach a leaf, so it has at least the same leaves
+    assert leaves(root, 9) >= nltk_leaves - {"DEAD_END."}
+    assert "DEAD_END." not in leaves(root, 12)
+
+
+def test_min_lengths_match_shortest_derivations():
+    cfg = CFG.fromstring(DEAD_GRAMMAR)
+    compiled_cfg = compile_cfg(cfg)
+    for nonterminal in set(production.lhs() for production in cfg.productions()):
+        idx = -compiled_cfg.symbol_id(nonterminal) - 1
+        expected = shortest_derivations(cfg, nonterminal, 7)
+        assert (compiled_cfg.min_derivation_length[idx], compiled_cfg.min_yield_length[idx]) == expected
+        assert compiled_cfg.is_productive(-idx - 1) == (expected[0] < math.inf)
+
+
+def test_report():
+    compiled_cfg = compile_cfg(CFG.fromstring(DEAD_GRAMMAR))
+    reachable = [idx for idx, is_reachable in enumerate(compiled_cfg.reachable) if is_reachable]
+    assert {str(compiled_cfg.symbol(-idx - 1)) for idx in reachable} == {"S", "A", "E", "F", "G", "C", "D"}
+    assert compiled_cfg.report().split("\n") == [
+        "- non terminal symbols without production rule: NONE",
+        "- unproductive non terminal symbols: B, B2",
+        "- 6 production rules can never lead to a terminal string and were removed",
+        "- unreachable non terminal symbols: UNUSED",
+    ]
+    with open(os.path.join(DATA_DIR, "ex_4.cfg")) as file:
+        assert compile_cfg(CFG.fromstring(file.read())).report() == ""
+
+
+def test_unproductive_start_symbol():
+    root = CFGrammarNode.from_string("S -> A 'x'\nA -> A 'y'")
+    assert [str(child) for child in root.children()] == ["DEAD_END."]
+    assert root.lexical_slot() is None
@@ -0,0 +1,70 @@
+"""
+An history streamed to a file must be loaded back (EvaluationHistory.from_file) with the same leaves and values,
+across the resets and whatever the characters of the leaves
+"""
+
+import random
+
+import numpy as np
+
+from lm_heuristic.tree_search import EvaluationHistory, Evaluator
+
+LEAVES = ["the cat sat.", "a\ttab", "two\nlines", "trailing tab\t", "", "quote \" and \\ backslash", "é ü 猫"]
+
+
+def random_entries(seed: int, nb_entries: int = 100):
+    rng = random.Random(seed)
+    return [(rng.choice(LEAVES), rng.random() * 10 ** rng.randint(-20, 20)) for _ in range(nb_entries)]
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "history.tsv")
+    entries = []
+    with EvaluationHistory(path, initial_capacity=4) as history:
+        for seed in range(3):
+            # Each reset starts a new numbering of the leaves in the file
+            history.reset()
+            for leaf, value in random_entries(seed):
+                history.append(leaf, value)
+                entries.append((leaf, value))
+            assert history.history_of_leaves() == [leaf for leaf, _ in entries[-100:]]
+
+    loaded_history = EvaluationHistory.from_file(path)
+    assert len(loaded_history) == len(entries)
+    assert loaded_history.history_of_leaves() == [leaf for leaf, _ in entries]
+    # The values are written with all their digits
+    assert np.array_equal(loaded_history.values(), np.array([value for _, value in entries]))
+    assert sorted(loaded_history.leaves()) == sorted(set(leaf for leaf, _ in entries))
+
+
+def test_reset_before_any_new_leaf(tmp_path):
+    # The first line after a reset always writes its leaf (leaf id 0), even if the leaf was seen before the reset
+    path = str(tmp_path / "history.tsv")
+    with EvaluationHistory(path) as history:
+        history.extend(["a", "b", "a"], [1.0, 2.0, 3.0])
+        history.reset()
+        history.extend(["b", "b", "a"], [4.0, 5.0, 6.0])
+
+    loaded_history = EvaluationHistory.from_file(path)
+    assert loaded_history.history_of_leaves() == ["a", "b", "a", "b", "b", "a"]
+    assert loaded_history.values().tolist() == [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]
+
+
+def test_evaluator_history_file(tmp_path):
+    from test_evaluator import Leaf, evaluation_fct
+
+    path = str(tmp_path / "history.tsv")
+    leaves = []
+    with Evaluator(evaluation_fct, history_path=path) as evaluator:
+        for seed in range(2):
+            evaluator.reset()
+            rng = random.Random(seed)
+            batch = [Leaf("leaf %d\tpart\n%d" % (rng.randrange(10), seed)) for _ in range(30)]
+            evaluator.eval(batch)
+            # Every occurrence is recorded, the leaves of the batch being grouped by leaf
+            assert sorted(evaluator.history_of_leaves()) == sorted(str(leaf) for leaf in batch)
+            leaves.extend(evaluator.history_of_leaves())
+
+    loaded_history = EvaluationHistory.from_file(path)
+    assert loaded_history.history_of_leaves() == leaves
+    assert loaded_history.values().tolist() == evaluation_fct(leaves)
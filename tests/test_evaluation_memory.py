@@ -0,0 +1,103 @@
+"""
+The entries evicted by EvaluationMemory must be the ones a naive LRU / LFU cache would evict,
+and the pinned entries must never be evicted
+"""
+
+import random
+
+import pytest
+
+from lm_heuristic.tree_search import EvaluationMemory, Evaluator
+from lm_heuristic.tree_search.evaluation_memory import ENTRY_OVERHEAD
+
+
+class NaiveMemory:
+    # Scan all the entries to find the one to evict: the least recently used one (LRU),
+    # or the least frequently used one, the least recently used among them in case of tie (LFU)
+    def __init__(self, max_entries: int, eviction_policy: str):
+        self.max_entries = max_entries
+        self.eviction_policy = eviction_policy
+        self.values, self.last_uses, self.frequencies = dict(), dict(), dict()
+        self.time = 0
+
+    def _touch(self, key):
+        self.time += 1
+        self.last_uses[key] = self.time
+        self.frequencies[key] = self.frequencies.get(key, 0) + 1
+
+    def get(self, key):
+        if key in self.values:
+            self._touch(key)
+        return self.values.get(key)
+
+    def set(self, key, value):
+        if key not in self.values and len(self.values) == self.max_entries:
+            if self.eviction_policy == "LRU":
+                evicted = min(self.values, key=lambda k: self.last_uses[k])
+            else:
+                evicted = min(self.values, key=lambda k: (self.frequencies[k], self.last_uses[k]))
+            for table in [self.values, self.last_uses, self.frequencies]:
+                del table[evicted]
+        self.values[key] = value
+        self._touch(key)
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("eviction_policy", ["LRU", "LFU"])
+def test_evictions_match_naive_memory(eviction_policy, seed):
+    rng = random.Random(seed)
+    memory = EvaluationMemory(max_entries=8, eviction_policy=eviction_policy)
+    naive_memory = NaiveMemory(8, eviction_policy)
+    memory.pin("DEAD_END", -1.0)
+
+    for _ in range(2000):
+        # Skewed keys, so that the frequencies differ
+        key = int(rng.paretovariate(1.0)) % 30
+        if rng.random() < 0.5:
+            assert memory.get(key) == naive_memory.get(key)
+        else:
+            value = rng.random()
+            memory[key] = value
+            naive_memory.set(key, value)
+        assert dict(memory._values) == naive_memory.values
+
+    assert memory.get("DEAD_END") == -1.0
+    assert memory.stats()["entries"] == 8 and memory.stats()["pinned_entries"] == 1
+
+
+def test_pinned_entries_are_not_evicted_nor_counted():
+    memory = EvaluationMemory(max_entries=2)
+    memory.pin("DEAD_END", -1.0)
+    for key in range(10):
+        memory[key] = float(key)
+        # Updating a pinned entry does not move it to the evictable entries
+        memory["DEAD_END"] = -1.0
+    assert set(memory._values) == {8, 9}
+    assert memory["DEAD_END"] == -1.0
+    assert memory.stats()["evictions"] == 8
+
+    memory.clear()
+    assert len(memory) == 1 and "DEAD_END" in memory
+
+
+def test_memory_bytes_are_bounded():
+    entry_size = 16 + ENTRY_OVERHEAD["LFU"]
+    memory = EvaluationMemory(max_bytes=5 * entry_size, eviction_policy="LFU", entry_size_fct=lambda k, v: 16)
+    for key in range(20):
+        memory[key] = float(key)
+        assert memory.stats()["bytes"] <= memory.max_bytes
+    assert memory.stats()["entries"] == 5
+    assert memory.stats()["bytes"] == 5 * entry_size
+
+
+def test_evaluator_keeps_the_pinned_values():
+    from test_evaluator import Leaf, evaluation_fct
+
+    evaluator = Evaluator(evaluation_fct, memory_max_entries=4)
+    evaluator.set_default_value(Leaf("DEAD_END."), -1.0)
+    evaluator.reset()
+    evaluator.eval([Leaf("leaf %d" % idx) for idx in range(20)])
+
+    assert evaluator.memory_stats()["entries"] == 4
+    assert evaluator.value_from_memory(Leaf("DEAD_END.")) == -1.0
+    assert evaluator.eval([Leaf("DEAD_END.")]) == [-1.0]
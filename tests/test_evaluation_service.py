@@ -0,0 +1,102 @@
+"""
+The evaluation service must score once the identical (context, sentence) requests that are in flight together,
+and give each client the scores of its own sentences with its own context
+"""
+
+import threading
+import time
+
+import pytest
+
+from lm_heuristic.tree_search import EvaluationService
+
+
+class BlockingScorer:
+    """
+    Scorer whose first call blocks until release is set, so that the requests of the clients pile up meanwhile
+    """
+
+    batch_size = 16
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = []
+        self.context = None
+
+    def build(self):
+        pass
+
+    def set_context(self, context):
+        self.context = context
+
+    def __call__(self, sentences):
+        if not self.calls:
+            self.release.wait(timeout=30)
+        self.calls.append((self.context, list(sentences)))
+        if "error" in sentences:
+            raise ValueError("Can not score the sentence")
+        return [score(self.context, sentence) for sentence in sentences]
+
+
+def score(context, sentence):
+    return len(sentence) + (100.0 if context else 0.0)
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        assert time.perf_counter() < deadline, "Timed out"
+        time.sleep(0.001)
+
+
+def test_identical_in_flight_requests_are_scored_once():
+    scorer = BlockingScorer()
+    with EvaluationService(scorer, max_wait=0.0) as service:
+        requests = [
+            (None, ["a cat", "a dog", "a cat"]),
+            (None, ["a dog", "the mat"]),
+            ("Where is the dog ?", ["a dog", "a cat"]),
+            ("Where is the dog ?", ["a dog"]),
+        ]
+        results = [None] * len(requests)
+
+        def run_client(idx, context, sentences):
+            results[idx] = service.client(context)(sentences)
+
+        # The first request keeps the worker busy while the others are sent
+        first_client = threading.Thread(target=run_client, args=(0, *requests[0]))
+        first_client.start()
+        wait_for(lambda: service.nb_requested_sentences == 3 and not service._queue)
+        threads = [threading.Thread(target=run_client, args=(idx, *requests[idx])) for idx in range(1, len(requests))]
+        for thread in threads:
+            thread.start()
+        wait_for(lambda: service.nb_requested_sentences == sum(len(sentences) for _, sentences in requests))
+        scorer.release.set()
+        for thread in [first_client] + threads:
+            thread.join()
+
+    for (context, sentences), result in zip(requests, results):
+        assert result == [score(context, sentence) for sentence in sentences]
+
+    # Each (context, sentence) is only scored once, and the batches are scored context by context
+    scored = [(context, sentence) for context, sentences in scorer.calls for sentence in sentences]
+    assert sorted(scored, key=str) == sorted(
+        set((context, sentence) for context, sentences in requests for sentence in sentences), key=str
+    )
+    stats = service.stats()
+    assert stats["requested_sentences"] == 8
+    assert stats["scored_sentences"] == len(scored) == 5
+    assert stats["deduplicated_sentences"] == 3
+
+
+def test_failed_batch_does_not_stop_the_service():
+    scorer = BlockingScorer()
+    scorer.release.set()
+    with EvaluationService(scorer, max_wait=0.0) as service:
+        client = service.client()
+        with pytest.raises(ValueError):
+            client(["a cat", "error"])
+        assert client(["a cat"]) == [score(None, "a cat")]
+
+    with pytest.raises(AssertionError):
+        client(["a cat"])
@@ -0,0 +1,143 @@
+"""
+The top-k heap of the Evaluator must give the same leaves as a full sort of the leaves of the search,
+and the Evaluator must be picklable (to be sent to a spawned evaluation process)
+"""
+
+import gc
+import multiprocessing
+import pickle
+import random
+import weakref
+
+import pytest
+
+from lm_heuristic.tree import Node
+from lm_heuristic.tree_search import Evaluator
+from lm_heuristic.tree_search.mcts.evaluation_buffer import ParallelEvalWorker
+
+
+class Leaf(Node):
+    def __init__(self, text: str):
+        Node.__init__(self)
+        self.text = text
+
+    def is_terminal(self) -> bool:
+        return True
+
+    def children(self):
+        return []
+
+    def __str__(self):
+        return self.text
+
+
+def evaluation_fct(leaves):
+    # Few different values, so that there are many ties
+    return [float(int(leaf.split()[1]) % 7) / 7 for leaf in leaves]
+
+
+class Scorer:
+    # Picklable evaluation function with a build method (cf ParallelEvalWorker)
+    def build(self):
+        pass
+
+    def __call__(self, leaves):
+        return evaluation_fct(leaves)
+
+
+def full_sort(leaves, top_n):
+    # Old implementation: stable sort of every leaf of the search (in the order they were first evaluated)
+    values = dict()
+    for leaf in leaves:
+        values.setdefault(str(leaf), evaluation_fct([str(leaf)])[0] if str(leaf) != "DEAD_END." else -1.0)
+    return sorted(values.items(), key=lambda x: x[1], reverse=True)[:top_n]
+
+
+@pytest.fixture
+def searched_evaluator():
+    random.seed(0)
+    evaluator = Evaluator(evaluation_fct, top_k=10)
+    evaluator.set_default_value(Leaf("DEAD_END."), -1.0)
+    evaluator.reset()
+
+    leaves = [Leaf("DEAD_END.")]
+    for _ in range(20):
+        batch = [Leaf("leaf %d" % random.randrange(60)) for _ in range(8)]
+        evaluator.eval(batch)
+        leaves.extend(batch)
+    return evaluator, leaves
+
+
+@pytest.mark.parametrize("top_n", [1, 5, 10, 25, 100])
+def test_top_n_best_matches_full_sort(searched_evaluator, top_n):
+    evaluator, leaves = searched_evaluator
+    result = [(str(node), value) for node, value in evaluator.top_n_best(top_n)]
+    assert result == full_sort(leaves, top_n)
+
+
+def test_pinned_dead_end_is_ranked(searched_evaluator):
+    evaluator, leaves = searched_evaluator
+    nb_leaves = len(set(map(str, leaves)))
+    assert evaluator.top_n_best(nb_leaves)[-1] == ("DEAD_END.", -1.0)
+
+
+def test_top_n_best_beyond_top_k_gives_leaves_strings(searched_evaluator):
+    evaluator, leaves = searched_evaluator
+    assert all(isinstance(node, Leaf) for node, _ in evaluator.top_n_best(10))
+    assert all(isinstance(leaf, str) for leaf, _ in evaluator.top_n_best(11))
+
+
+def test_ensure_top_k_before_the_search():
+    evaluator = Evaluator(evaluation_fct, top_k=10)
+    evaluator.ensure_top_k(30)
+    evaluator.reset()
+    leaves = [Leaf("leaf %d" % idx) for idx in range(60)]
+    evaluator.eval(leaves)
+    result = evaluator.top_n_best(30)
+    assert all(isinstance(node, Leaf) for node, _ in result)
+    assert [(str(node), value) for node, value in result] == full_sort(leaves, 30)
+
+    # In the middle of a search, the leaves already evicted from the heap are lost: the larger heap is only used
+    # from the next reset
+    evaluator.ensure_top_k(40)
+    assert [(str(node), value) for node, value in evaluator.top_n_best(40)] == full_sort(leaves, 40)
+    evaluator.reset()
+    evaluator.eval(leaves)
+    assert all(isinstance(node, Leaf) for node, _ in evaluator.top_n_best(40))
+
+
+def test_evaluator_only_keeps_the_top_k_leaves():
+    evaluator = Evaluator(evaluation_fct, memory_max_entries=20, top_k=10)
+    evaluator.reset()
+    references = []
+    for batch_idx in range(50):
+        batch = [Leaf("leaf %d" % (8 * batch_idx + idx)) for idx in range(8)]
+        references.extend(map(weakref.ref, batch))
+        evaluator.eval(batch)
+    del batch
+    gc.collect()
+    # The top-k heap and the best leaf (the memory and the history do not keep the nodes)
+    assert sum(reference() is not None for reference in references) <= 11
+    assert [leaf for leaf, _ in evaluator.top_n_best(400)[:10]] == [str(node) for node, _ in evaluator.top_n_best(10)]
+
+
+def test_pickled_evaluator_keeps_its_state(searched_evaluator):
+    evaluator, leaves = searched_evaluator
+    copy = pickle.loads(pickle.dumps(evaluator))
+    assert copy._lock is not evaluator._lock
+    assert [(str(node), value) for node, value in copy.top_n_best(10)] == full_sort(leaves, 10)
+    assert copy.eval([Leaf("leaf 3")]) == evaluation_fct(["leaf 3"])
+
+
+def test_evaluator_in_spawned_process():
+    # As in ParallelEvalBuffer with parallel_strategy="multiprocess", but with the spawn start method
+    context = multiprocessing.get_context("spawn")
+    tasks_queue, results_queue = context.Queue(), context.Queue()
+    worker = context.Process(target=ParallelEvalWorker(Evaluator(Scorer()), tasks_queue, results_queue), daemon=True)
+    worker.start()
+    try:
+        batch = [Leaf("leaf %d" % idx) for idx in range(10)]
+        tasks_queue.put(batch)
+        assert results_queue.get(timeout=60) == evaluation_fct([str(leaf) for leaf in batch])
+    finally:
+        worker.terminate()
@@ -0,0 +1,50 @@
+"""
+The context-free grammar grounded from a finite feature grammar (cf ground_feature_grammar) must produce
+the same sentences as the FeatureGrammarNode tree of the feature grammar
+"""
+
+import os
+
+from nltk.grammar import FeatureGrammar
+
+from lm_heuristic.tree.interface.fcfg_grounding import ground_feature_grammar, grammar_root
+from lm_heuristic.tree.interface.nltk_grammar import CFGrammarNode, FeatureGrammarNode
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "fcfg")
+
+
+def load_grammar(name: str) -> FeatureGrammar:
+    with open(os.path.join(DATA_DIR, name)) as file:
+        return FeatureGrammar.fromstring(file.read())
+
+
+def all_leaves(root) -> set:
+    leaves, stack = set(), [root]
+    while stack:
+        node = stack.pop()
+        if node.is_terminal():
+            if str(node) != "DEAD_END.":
+                leaves.add(str(node))
+        else:
+            stack.extend(node.children())
+    return leaves
+
+
+def test_grounded_grammar_produces_the_same_sentences():
+    feature_grammar = load_grammar("agreement.fcfg")
+    grounded_grammar = ground_feature_grammar(feature_grammar)
+    assert grounded_grammar is not None
+
+    cfg_leaves = all_leaves(CFGrammarNode(grounded_grammar.cfg.start(), grounded_grammar.cfg))
+    feature_leaves = all_leaves(
+        FeatureGrammarNode(feature_grammar.start(), feature_grammar, left_to_right_generation=True)
+    )
+    assert cfg_leaves == feature_leaves
+    assert "these dogs see a cat." in cfg_leaves and "she walk." not in cfg_leaves
+
+
+def test_grammar_root_falls_back_to_feature_grammar_node():
+    assert isinstance(grammar_root(load_grammar("agreement.fcfg")), CFGrammarNode)
+    # Nested feature structures can not be grounded
+    root = grammar_root(load_grammar("former_try/foaf_3.fcfg"), only_keep_valid_node=True)
+    assert isinstance(root, FeatureGrammarNode) and root.only_keep_valid_node
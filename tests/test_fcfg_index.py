@@ -0,0 +1,91 @@
+"""
+The candidates of ProductionIndex must be the production rules of grammar.productions(lhs=...), in the same order,
+minus only rules whose left hand side can not unify with the symbol
+"""
+
+import glob
+import os
+
+import pytest
+from nltk.featstruct import find_variables, rename_variables, unify
+from nltk.grammar import FeatureGrammar, FeatStructNonterminal
+
+from lm_heuristic.tree.interface.fcfg_index import ProductionIndex
+from lm_heuristic.tree.interface.nltk_grammar import FeatureGrammarNode
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "fcfg")
+GRAMMAR_FILES = sorted(glob.glob(os.path.join(DATA_DIR, "**", "*.fcfg"), recursive=True))
+
+# Number of derivations whose symbols are looked up for each grammar
+NB_EXPLORED_NODES = 100
+
+
+def load_grammar(path: str) -> FeatureGrammar:
+    with open(path) as file:
+        try:
+            return FeatureGrammar.fromstring(file.read())
+        except ValueError as exception:
+            pytest.skip("%s can not be parsed by nltk: %s" % (os.path.basename(path), exception))
+
+
+def explored_symbols(feature_grammar: FeatureGrammar):
+    # Non terminal symbols of the derivations met in a breadth first exploration of the tree
+    frontier = [FeatureGrammarNode(feature_grammar.start(), feature_grammar)]
+    symbols = []
+    while frontier and len(symbols) < NB_EXPLORED_NODES:
+        node = frontier.pop(0)
+        if node.feature_grammar is None or node.is_terminal():
+            continue
+        symbols.extend(symbol for symbol in node.symbols if isinstance(symbol, FeatStructNonterminal))
+        frontier.extend(node.children())
+    return symbols
+
+
+def can_unify(production, symbol) -> bool:
+    lhs = rename_variables(production.lhs(), used_vars=find_variables(symbol))
+    return unify(lhs, symbol) is not None
+
+
+@pytest.mark.parametrize("path", GRAMMAR_FILES, ids=os.path.basename)
+def test_candidates_only_skip_failing_productions(path):
+    feature_grammar = load_grammar(path)
+    index = ProductionIndex(feature_grammar)
+    symbols = explored_symbols(feature_grammar)
+    assert symbols
+
+    for symbol in symbols:
+        productions = list(feature_grammar.productions(lhs=symbol))
+        candidates = index.candidates(symbol)
+        # Same order as grammar.productions
+        positions = [productions.index(candidate) for candidate in candidates]
+        assert positions == sorted(positions)
+        assert [production for production in productions if can_unify(production, symbol)] == [
+            candidate for candidate in candidates if can_unify(candidate, symbol)
+        ]
+
+
+def test_discriminating_features():
+    feature_grammar = FeatureGrammar.fromstring(
+        """
+        % start S
+        S -> NP[NUM=sg] | NP[NUM=pl] | NP[NUM=?n, CASE=acc]
+        NP[NUM=sg, CASE=nom] -> 'he'
+        NP[NUM=pl, CASE=nom] -> 'they'
+        NP[NUM=sg, CASE=acc] -> 'him'
+        NP[CASE=acc] -> 'you'
+        NP[NUM=?n] -> 'the' N[NUM=?n]
+        N[NUM=sg] -> 'dog'
+        """
+    )
+    index = ProductionIndex(feature_grammar)
+
+    def candidates(string: str):
+        return [str(production.rhs()) for production in index.candidates(FeatStructNonterminal(string))]
+
+    assert candidates("NP[NUM=pl]") == ["('they',)", "('you',)", "('the', N[NUM=?n])"]
+    assert candidates("NP[NUM=sg, CASE=acc]") == ["('him',)", "('you',)", "('the', N[NUM=?n])"]
+    # A value that no left hand side has only keeps the rules without value for the feature
+    assert candidates("NP[NUM=du]") == ["('you',)", "('the', N[NUM=?n])"]
+    # Variables and features that are not discriminating do not filter anything
+    assert len(candidates("NP[NUM=?x, GENDER=f]")) == 5
+    assert index.stats()["skipped_productions"] == 2 + 2 + 3
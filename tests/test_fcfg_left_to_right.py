@@ -0,0 +1,81 @@
+"""
+With left_to_right_generation, FeatureGrammarNode only expands the leftmost non terminal symbol:
+the tree must have the same leaves as when all the symbols are expanded, each derivation being reached once
+"""
+
+from collections import Counter
+
+import pytest
+from nltk.grammar import FeatureGrammar, Nonterminal
+
+from lm_heuristic.tree.interface.nltk_grammar import FeatureGrammarNode
+
+# Small version of data/fcfg/agreement.fcfg (the tree without left to right generation grows fast)
+GRAMMAR = """
+    % start S
+    S -> NP[NUM=?n] VP[NUM=?n]
+    NP[NUM=?n] -> Det[NUM=?n] N[NUM=?n] | PRO[NUM=?n]
+    VP[NUM=?n] -> V[NUM=?n] | V[NUM=?n] NP
+    Det[NUM=sg] -> 'a'
+    Det -> 'the'
+    N[NUM=sg] -> 'dog'
+    N[NUM=pl] -> 'dogs'
+    PRO[NUM=pl] -> 'they'
+    V[NUM=sg] -> 'sees'
+    V[NUM=pl] -> 'see'
+"""
+
+
+@pytest.fixture(scope="module")
+def feature_grammar():
+    return FeatureGrammar.fromstring(GRAMMAR)
+
+
+def leaf_counts(root: FeatureGrammarNode) -> Counter:
+    # Number of paths from the root to each valid leaf (the grammar is finite)
+    counts, stack = Counter(), [root]
+    while stack:
+        node = stack.pop()
+        if node.is_terminal():
+            if str(node) != "DEAD_END.":
+                counts[str(node)] += 1
+        else:
+            stack.extend(node.children())
+    return counts
+
+
+@pytest.mark.parametrize("unification", ["nltk", "terms"])
+def test_same_leaves_as_all_children(feature_grammar, unification):
+    start = feature_grammar.start()
+    left_to_right_counts = leaf_counts(
+        FeatureGrammarNode(start, feature_grammar, left_to_right_generation=True, unification=unification)
+    )
+    all_children_counts = leaf_counts(FeatureGrammarNode(start, feature_grammar, unification=unification))
+
+    assert set(left_to_right_counts) == set(all_children_counts)
+    assert "the dogs see a dog." in left_to_right_counts and "a dogs see." not in left_to_right_counts
+    # The grammar is not ambiguous: a single path leads to each leaf with left to right generation,
+    # while the leaves are reached once per order of expansion of the symbols otherwise
+    assert set(left_to_right_counts.values()) == {1}
+    assert sum(all_children_counts.values()) > len(all_children_counts)
+
+
+def test_only_the_leftmost_symbol_is_expanded(feature_grammar):
+    stack = [FeatureGrammarNode(feature_grammar.start(), feature_grammar, left_to_right_generation=True)]
+    while stack:
+        node = stack.pop()
+        if node.is_terminal():
+            continue
+        idx = next(idx for idx, symbol in enumerate(node.symbols) if isinstance(symbol, Nonterminal))
+        for child in node.children():
+            assert child.left_to_right_generation
+            if str(child) != "DEAD_END.":
+                # The terminal prefix is kept
+                assert child.symbols[:idx] == node.symbols[:idx]
+            stack.append(child)
+
+
+def test_leftmost_symbol_without_valid_production_is_a_dead_end():
+    feature_grammar = FeatureGrammar.fromstring("% start S\nS -> A[F=b] B\nA[F=a] -> 'a'\nB -> 'b'")
+    root = FeatureGrammarNode(feature_grammar.start(), feature_grammar, left_to_right_generation=True)
+    assert [str(child) for child in root.children()[0].children()] == ["DEAD_END."]
@@ -0,0 +1,140 @@
+"""
+The memo table of the valid leaf search (cf FeatureGrammarMemo) is keyed by the symbols up to a renaming
+of their variables: the canonical keys must only identify such symbols, and the memoized search must give
+the same results as the search without memo table
+"""
+
+import os
+import random
+
+import pytest
+from nltk.featstruct import rename_variables
+from nltk.grammar import FeatStructNonterminal, FeatureGrammar
+
+from lm_heuristic.tree.interface.fcfg_memo import FeatureGrammarMemo, canonical_key, feature_grammar_memo
+from lm_heuristic.tree.interface.nltk_grammar import FeatureGrammarNode
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "fcfg")
+AGREEMENT_PATH = os.path.join(DATA_DIR, "agreement.fcfg")
+
+# Finite grammar with symbols without valid leaf: there is no plural verb, and X can never be derived
+NOGOOD_GRAMMAR = """
+    % start S
+    S -> NP[NUM=?n] VP[NUM=?n] | 'maybe' X[NUM=?n] NP[NUM=?n]
+    NP[NUM=?n] -> Det[NUM=?n] N[NUM=?n]
+    VP[NUM=?n] -> V[NUM=?n] | V[NUM=?n] NP[NUM=?m]
+    Det[NUM=sg] -> 'a'
+    Det -> 'the'
+    N[NUM=sg] -> 'dog'
+    N[NUM=pl] -> 'dogs'
+    V[NUM=sg] -> 'runs' | 'sees'
+    X[NUM=?n] -> Y[NUM=?n, OTHER=?n]
+    Y[NUM=sg, OTHER=pl] -> 'y'
+"""
+
+
+def symbol(string: str) -> FeatStructNonterminal:
+    return FeatStructNonterminal(string)
+
+
+@pytest.mark.parametrize(
+    "first, second",
+    [
+        ("NP[NUM=?n, PER=?p]", "NP[NUM=?a, PER=?b]"),
+        # The features are sorted, the variables are numbered in their order of appearance in the sorted symbol
+        ("NP[NUM=?n, PER=?p]", "NP[PER=?b, NUM=?a]"),
+        ("S[fact=[head=?f, tail=?t], other=?f]", "S[other=?x, fact=[tail=?y, head=?x]]"),
+        ("VP[NUM=?n2, PER=?n]", "VP[NUM=?n, PER=?n2]"),
+    ],
+)
+def test_renamed_symbols_have_the_same_key(first, second):
+    assert canonical_key(symbol(first)) == canonical_key(symbol(second))
+    assert canonical_key(symbol(first)) == canonical_key(rename_variables(symbol(first)))
+
+
+@pytest.mark.parametrize(
+    "first, second",
+    [
+        ("NP[NUM=?n, PER=?p]", "NP[NUM=?n, PER=?n]"),
+        ("NP[NUM=sg]", "NP[NUM=pl]"),
+        ("NP[NUM=?n]", "NP[NUM=sg]"),
+        ("NP[NUM=?n]", "VP[NUM=?n]"),
+        ("S[fact=[head=?f, tail=?t], other=?f]", "S[fact=[head=?f, tail=?t], other=?t]"),
+    ],
+)
+def test_different_symbols_have_different_keys(first, second):
+    assert canonical_key(symbol(first)) != canonical_key(symbol(second))
+
+
+def independent_leaves(symbol: FeatStructNonterminal, feature_grammar: FeatureGrammar, cache: dict):
+    # Old implementation without memo table: all the leaves that the search can return, each non terminal symbol
+    # of a derivation being derived independently (the grammars are finite)
+    if repr(symbol) not in cache:
+        leaves = set()
+        for child in FeatureGrammarNode(symbol, feature_grammar).children():
+            if str(child) == "DEAD_END.":
+                continue
+            child_leaves = {""}
+            for child_symbol in child.symbols:
+                if isinstance(child_symbol, str):
+                    symbol_leaves = {child_symbol}
+                else:
+                    symbol_leaves = independent_leaves(child_symbol, feature_grammar, cache)
+                child_leaves = {(left + " " + right).strip() for left in child_leaves for right in symbol_leaves}
+            leaves |= child_leaves
+        cache[repr(symbol)] = leaves
+    return cache[repr(symbol)]
+
+
+def tree_symbols(feature_grammar: FeatureGrammar):
+    # The different non terminal symbols of all the derivations of the tree
+    symbols = dict()
+    stack = [FeatureGrammarNode(feature_grammar.start(), feature_grammar, left_to_right_generation=True)]
+    while stack:
+        node = stack.pop()
+        if not node.is_terminal():
+            symbols.update((repr(symbol), symbol) for symbol in node.symbols if not isinstance(symbol, str))
+            stack.extend(node.children())
+    return list(symbols.values())
+
+
+@pytest.mark.parametrize("name", ["nogood", "agreement"])
+def test_memoized_search_matches_the_search_without_memo(name):
+    if name == "nogood":
+        feature_grammar = FeatureGrammar.fromstring(NOGOOD_GRAMMAR)
+    else:
+        with open(AGREEMENT_PATH) as file:
+            feature_grammar = FeatureGrammar.fromstring(file.read())
+    symbols = tree_symbols(feature_grammar)
+    cache = dict()
+    expected_leaves = [independent_leaves(symbol, feature_grammar, cache) for symbol in symbols]
+    assert any(not leaves for leaves in expected_leaves) == (name == "nogood")
+
+    random.seed(0)
+    # The second pass is served by the memo table filled by the first one
+    for _ in range(2):
+        for symbol, leaves in zip(symbols, expected_leaves):
+            node = FeatureGrammarNode(symbol, feature_grammar)
+            assert node.has_valid_leaf() == bool(leaves)
+            leaf = node.find_random_valid_leaf()
+            assert (leaf in leaves) if leaves else leaf is None
+
+    stats = feature_grammar_memo(feature_grammar).stats()
+    assert stats["solution_hits"] > 0
+    assert (stats["nogoods"] > 0) == (name == "nogood")
+
+
+def test_memo_table_is_bounded():
+    memo = FeatureGrammarMemo(max_entries=3, max_solutions=2)
+    memo.add_nogood("a")
+    for leaf in ["b1", "b2", "b3", "b1"]:
+        memo.add_solution("b", leaf)
+    assert memo.lookup("b") == (True, ["b1", "b2"])
+    memo.add_solution("c", "c1")
+    # "a" is the least recently used entry
+    memo.lookup("a")
+    memo.add_solution("d", "d1")
+    assert memo.lookup("b") == (False, None)
+    assert memo.lookup("a") == (True, None)
+    assert len(memo) == 3
+    assert memo.stats() == {"entries": 3, "nogoods": 1, "nogood_hits": 2, "solution_hits": 1, "misses": 1}
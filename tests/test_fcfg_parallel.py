@@ -0,0 +1,94 @@
+"""
+The parallel filtering of the children of FeatureGrammarNode (cf ValidLeafPool) must keep the order of the derivations
+and give the same results as the serial filtering
+"""
+
+import os
+
+import pytest
+from nltk.grammar import FeatureGrammar
+
+from lm_heuristic.tree.interface import nltk_grammar
+from lm_heuristic.tree.interface.fcfg_parallel import ValidLeafPool
+from lm_heuristic.tree.interface.nltk_grammar import FeatureGrammarNode
+
+GRAMMAR_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "fcfg", "former_try", "foaf_3.fcfg"
+)
+
+# Number of derivations checked by the pool
+NB_DERIVATIONS = 40
+
+
+@pytest.fixture
+def feature_grammar():
+    with open(GRAMMAR_PATH) as file:
+        return FeatureGrammar.fromstring(file.read())
+
+
+def derivations(feature_grammar):
+    # Breadth first exploration of the tree, mixing derivations with and without valid leaf
+    frontier = [FeatureGrammarNode(feature_grammar.start(), feature_grammar, left_to_right_generation=True)]
+    result = []
+    while frontier and len(result) < NB_DERIVATIONS:
+        for child in frontier.pop(0).children():
+            if child.feature_grammar is not None:
+                result.append(child.symbols)
+                frontier.append(child)
+    return result
+
+
+def serial_filter(feature_grammar, symbols_list):
+    return [FeatureGrammarNode(symbols, feature_grammar).has_valid_leaf() for symbols in symbols_list]
+
+
+def test_pool_keeps_the_order_and_matches_the_serial_filter(feature_grammar):
+    symbols_list = derivations(feature_grammar)
+    expected = serial_filter(feature_grammar, symbols_list)
+    assert True in expected and False in expected
+
+    pool = ValidLeafPool(feature_grammar, nb_workers=2, timeout=60.0)
+    try:
+        assert pool.has_valid_leaf(symbols_list) == expected
+        # The workers (and their memo tables) are reused by the next batch
+        assert pool.has_valid_leaf(symbols_list[::-1]) == expected[::-1]
+    finally:
+        pool.close()
+    assert pool.nb_timeouts == 0 and pool.nb_restarts == 0
+
+
+def test_only_the_timed_out_workers_are_restarted(feature_grammar):
+    symbols_list = derivations(feature_grammar)[:4]
+    pool = ValidLeafPool(feature_grammar, nb_workers=2, timeout=0.0)
+    try:
+        valid = pool.has_valid_leaf(symbols_list)
+        assert valid.count(None) == pool.nb_timeouts == pool.nb_restarts
+        expected = serial_filter(feature_grammar, symbols_list)
+        assert all(is_valid is None or is_valid == result for is_valid, result in zip(valid, expected))
+
+        pool.timeout = 60.0
+        assert pool.has_valid_leaf(symbols_list) == expected
+    finally:
+        pool.close()
+
+
+def test_parallel_children_match_the_serial_children(feature_grammar):
+    for symbols in derivations(feature_grammar)[:5]:
+        serial = FeatureGrammarNode(symbols, feature_grammar, only_keep_valid_node=True)
+        parallel = FeatureGrammarNode(
+            symbols, feature_grammar, only_keep_valid_node=True, nb_filtering_workers=2, filtering_timeout=60.0
+        )
+        assert [child.symbols for child in parallel.children()] == [child.symbols for child in serial.children()]
+        # Only the children of the node on which only_keep_valid_node is set are filtered
+        assert not any(child.only_keep_valid_node for child in parallel.children())
+    parallel.close()
+
+
+def test_daemonic_process_filters_serially(feature_grammar, monkeypatch):
+    monkeypatch.setattr(nltk_grammar, "can_start_workers", lambda: False)
+    symbols = derivations(feature_grammar)[0]
+    node = FeatureGrammarNode(symbols, feature_grammar, only_keep_valid_node=True, nb_filtering_workers=2)
+    serial = FeatureGrammarNode(symbols, feature_grammar, only_keep_valid_node=True)
+
+    assert [child.symbols for child in node.children()] == [child.symbols for child in serial.children()]
+    assert getattr(feature_grammar, "_valid_leaf_pool", None) is None
@@ -0,0 +1,79 @@
+"""
+Parity between the term-based unification engine (cf FeatureUnifier) and the nltk featstruct functions:
+for each grammar of data/fcfg, the children of the derivations met in a breadth first exploration
+must be the same with unification="terms" and unification="nltk" (up to the names of the variables,
+and to the whitespaces that align the printed feature structures).
+The nltk functions stay the default engine, so that the strings and fingerprints of the nodes do not change.
+"""
+
+import glob
+import os
+import re
+
+import pytest
+from nltk.grammar import FeatureGrammar
+
+from lm_heuristic.tree.interface.nltk_grammar import FeatureGrammarNode
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "fcfg")
+GRAMMAR_FILES = sorted(glob.glob(os.path.join(DATA_DIR, "**", "*.fcfg"), recursive=True))
+
+# Number of derivations whose children are compared for each grammar
+NB_EXPLORED_NODES = 150
+
+VARIABLE_PATTERN = re.compile(r"\?[A-Za-z_][A-Za-z0-9_]*")
+
+
+def canonical(node: FeatureGrammarNode) -> str:
+    # The variables are renamed by order of first appearance
+    names = dict()
+    return VARIABLE_PATTERN.sub(lambda match: names.setdefault(match.group(), "?v%d" % len(names)), repr(node.symbols))
+
+
+def canonical_string(node: FeatureGrammarNode) -> str:
+    # Same as canonical, on the string of the node (which is used for its fingerprint)
+    names = dict()
+    string = VARIABLE_PATTERN.sub(lambda match: names.setdefault(match.group(), "?v%d" % len(names)), str(node))
+    return " ".join(string.split())
+
+
+def load_grammar(path: str) -> FeatureGrammar:
+    with open(path) as file:
+        try:
+            return FeatureGrammar.fromstring(file.read())
+        except ValueError as exception:
+            pytest.skip("%s can not be parsed by nltk: %s" % (os.path.basename(path), exception))
+
+
+@pytest.mark.parametrize("left_to_right_generation", [True, False])
+@pytest.mark.parametrize("path", GRAMMAR_FILES, ids=os.path.basename)
+def test_terms_and_nltk_children_are_the_same(path, left_to_right_generation):
+    feature_grammar = load_grammar(path)
+
+    frontier = [feature_grammar.start()]
+    nb_explored_nodes = 0
+    while frontier and nb_explored_nodes < NB_EXPLORED_NODES:
+        symbols = frontier.pop(0)
+        nodes = {
+            unification: FeatureGrammarNode(
+                symbols, feature_grammar, left_to_right_generation=left_to_right_generation, unification=unification
+            )
+            for unification in ["terms", "nltk"]
+        }
+        nltk_children = nodes["nltk"].children()
+        terms_children = nodes["terms"].children()
+        assert list(map(canonical, terms_children)) == list(map(canonical, nltk_children)), symbols
+        assert list(map(canonical_string, terms_children)) == list(map(canonical_string, nltk_children)), symbols
+
+        nb_explored_nodes += 1
+        frontier.extend(child.symbols for child in nltk_children if child.feature_grammar is not None)
+
+
+@pytest.mark.parametrize("path", GRAMMAR_FILES, ids=os.path.basename)
+def test_nltk_is_the_default_engine(path):
+    feature_grammar = load_grammar(path)
+    default_children = FeatureGrammarNode(feature_grammar.start(), feature_grammar).children()
+    nltk_children = FeatureGrammarNode(feature_grammar.start(), feature_grammar, unification="nltk").children()
+
+    assert list(map(str, default_children)) == list(map(str, nltk_children))
+    assert [child.fingerprint() for child in default_children] == [child.fingerprint() for child in nltk_children]
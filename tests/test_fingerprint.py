@@ -0,0 +1,82 @@
+"""
+The fingerprints of the nodes must only depend on the derivation they represent:
+equal across node classes and across processes, different for different derivations
+"""
+
+import os
+import subprocess
+import sys
+
+from lm_heuristic.tree import Node
+from lm_heuristic.tree.interface.compact_cfg import CompactCFGrammarNode
+from lm_heuristic.tree.interface.nltk_grammar import CFGrammarNode
+from lm_heuristic.tree_search import Evaluator
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "cfg")
+GRAMMAR_PATH = os.path.join(DATA_DIR, "ex_1_small.cfg")
+
+
+def tree_nodes(root: Node, max_depth: int):
+    nodes, stack = [], [(root, 1)]
+    while stack:
+        node, depth = stack.pop()
+        nodes.append(node)
+        if depth < max_depth and not node.is_terminal():
+            stack.extend((child, depth + 1) for child in reversed(node.children()))
+    return nodes
+
+
+def test_same_derivations_in_different_node_classes():
+    nodes = tree_nodes(CFGrammarNode.from_cfg_file(GRAMMAR_PATH), 6)
+    compact_nodes = tree_nodes(CompactCFGrammarNode.from_cfg_file(GRAMMAR_PATH), 6)
+    assert len(nodes) == len(compact_nodes)
+
+    for node, compact_node in zip(nodes, compact_nodes):
+        assert str(node) == str(compact_node)
+        assert node.fingerprint() == compact_node.fingerprint()
+        assert node == compact_node and hash(node) == hash(compact_node)
+
+    # A node of one class finds the node of the other class in a set
+    assert set(nodes) == set(compact_nodes)
+
+
+def test_different_derivations_have_different_fingerprints():
+    nodes = tree_nodes(CFGrammarNode.from_cfg_file(GRAMMAR_PATH), 8)
+    strings = set(map(str, nodes))
+    assert len(set(node.fingerprint() for node in nodes)) == len(strings)
+    assert all(0 <= node.fingerprint() < 2 ** 64 for node in nodes)
+
+
+def test_fingerprints_are_stable_across_processes():
+    # The str hashes are salted differently in each process (PYTHONHASHSEED), the fingerprints must not change
+    code = (
+        "from lm_heuristic.tree.interface.nltk_grammar import CFGrammarNode\n"
+        "root = CFGrammarNode.from_cfg_file(%r)\n"
+        "print([child.fingerprint() for child in root.children()])\n" % GRAMMAR_PATH
+    )
+    expected = [child.fingerprint() for child in CFGrammarNode.from_cfg_file(GRAMMAR_PATH).children()]
+    for seed in ["1", "2"]:
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            env=dict(os.environ, PYTHONHASHSEED=seed),
+            stdout=subprocess.PIPE,
+            check=True,
+            universal_newlines=True,
+        ).stdout
+        assert output.strip() == str(expected)
+
+
+def test_evaluator_memory_is_shared_across_node_classes():
+    leaves = CFGrammarNode.from_cfg_file(GRAMMAR_PATH).random_walks(20)
+    compact_leaves = [CompactCFGrammarNode(leaf._ids(), leaf.compiled_cfg) for leaf in leaves]
+    calls = []
+
+    def evaluation_fct(sentences):
+        calls.append(sentences)
+        return [float(len(sentence)) for sentence in sentences]
+
+    evaluator = Evaluator(evaluation_fct)
+    values = evaluator.eval(leaves)
+    assert all(evaluator.has_already_eval(leaf) for leaf in compact_leaves)
+    assert evaluator.eval(compact_leaves) == values
+    assert len(calls) == 1
@@ -0,0 +1,94 @@
+"""
+The optimized scoring paths of GPT2Score must give the same scores as compute_score
+"""
+
+import pytest
+
+# Single token continuations (cf GPT2_MERGES) and multi token ones sharing prefixes
+SINGLE_TOKEN_CONTINUATIONS = ["cat", "dog", "the", "a"]
+MULTI_TOKEN_CONTINUATIONS = ["cat sat", "cat sat here", "dog", "do", "dogs", "mat", "the cat", "a"]
+
+
+@pytest.mark.parametrize("continuations", [SINGLE_TOKEN_CONTINUATIONS, MULTI_TOKEN_CONTINUATIONS])
+@pytest.mark.parametrize("left", ["the cat saw", ""])
+@pytest.mark.parametrize("context", [None, "Where is the dog ?"])
+def test_score_continuations_matches_compute_score(gpt2_scorer, left, continuations, context):
+    scorer = gpt2_scorer(batch_size=3)
+    scorer.set_context(context)
+
+    sentences = [left + " " + continuation if left else continuation for continuation in continuations]
+    assert scorer.score_continuations(left, continuations) == pytest.approx(scorer.compute_score(sentences), rel=1e-4)
+
+
+def test_eval_lexical_slot_matches_eval(gpt2_scorer):
+    from nltk import CFG
+
+    from lm_heuristic.tree.interface.nltk_grammar import CFGrammarNode
+    from lm_heuristic.tree_search import Evaluator
+
+    cfg = CFG.fromstring("S -> 'the' 'cat' N | 'a' N\nN -> 'dog' | 'cat' | 'the' 'mat' | 'a' 'dog'")
+    node = CFGrammarNode(cfg.start(), cfg).children()[0]
+    evaluator = Evaluator(gpt2_scorer(batch_size=2))
+    assert evaluator.can_eval_lexical_slot(node)
+
+    values = evaluator.eval_lexical_slot(node)
+    assert all(evaluator.has_already_eval(child) for child in node.children())
+    expected = Evaluator(gpt2_scorer(batch_size=2)).eval(node.children())
+    assert values == pytest.approx(expected, rel=1e-4)
+
+
+SENTENCES = ["the cat sat", "a dog", "the dog sat on the mat and it ran", "cat", "the mat is here", "a cat and a dog"]
+CONTEXT = "Where is the dog ? the cat sat on the mat and a dog ran here"
+
+
+@pytest.mark.parametrize("context", [None, CONTEXT])
+@pytest.mark.parametrize("packing_length", [16, 40, 128])
+def test_packed_scores_match_compute_score(gpt2_scorer, context, packing_length):
+    packed_scorer = gpt2_scorer(batch_size=2, packing_length=packing_length)
+    scorer = gpt2_scorer(batch_size=3)
+    packed_scorer.set_context(context)
+    scorer.set_context(context)
+
+    assert packed_scorer.compute_score(SENTENCES) == pytest.approx(scorer.compute_score(SENTENCES), rel=1e-4)
+
+
+def test_pack_rows(gpt2_scorer):
+    scorer = gpt2_scorer(batch_size=2, packing_length=10)
+    # A sequence longer than packing_length gets its own row
+    assert scorer._pack([3, 4, 3, 12, 5, 5, 1]) == [3, 1, 2, 1]
+    # Batches of batch_size rows
+    assert list(scorer._packed_batches([3, 4, 3, 12, 5, 5, 1])) == [(0, 4, [3, 1]), (4, 7, [2, 1])]
+
+
+def test_packing_and_context_window_are_rejected(gpt2_scorer):
+    with pytest.raises(AssertionError):
+        gpt2_scorer(packing_length=40, context_window=16)
+
+
+@pytest.mark.parametrize("context_window, context_stride", [(64, 1), (12, 4), (8, 8)])
+def test_cached_context_scores_match_compute_score(gpt2_scorer, context_window, context_stride):
+    cached_scorer = gpt2_scorer(batch_size=4, context_window=context_window, context_stride=context_stride)
+    cached_scorer.set_context(CONTEXT)
+
+    # Reference: the same (possibly truncated) context, input again with each sentence
+    scorer = gpt2_scorer(batch_size=4)
+    scorer.set_context(CONTEXT)
+    assert len(cached_scorer.context_ids) <= context_window
+    assert scorer.context_ids[len(scorer.context_ids) - len(cached_scorer.context_ids) :] == cached_scorer.context_ids
+    scorer.context_ids = cached_scorer.context_ids
+
+    assert cached_scorer.compute_score(SENTENCES) == pytest.approx(scorer.compute_score(SENTENCES), rel=1e-4)
+
+
+@pytest.mark.parametrize("context_window, context_stride", [(64, 1), (12, 4)])
+def test_growing_context_updates_the_cache(gpt2_scorer, context_window, context_stride):
+    # The context grows word by word, the cached states being updated (or recomputed when the window moves)
+    cached_scorer = gpt2_scorer(batch_size=4, context_window=context_window, context_stride=context_stride)
+    words = CONTEXT.split()
+    for nb_words in range(1, len(words) + 1):
+        cached_scorer.set_context(" ".join(words[:nb_words]))
+
+    fresh_scorer = gpt2_scorer(batch_size=4, context_window=context_window, context_stride=context_stride)
+    fresh_scorer.set_context(CONTEXT)
+    assert cached_scorer.context_ids == fresh_scorer.context_ids
+    assert cached_scorer.compute_score(SENTENCES) == pytest.approx(fresh_scorer.compute_score(SENTENCES), rel=1e-4)
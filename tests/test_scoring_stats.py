@@ -0,0 +1,47 @@
+"""
+The statistics tracked by a sentence scorer (track_stats=True) must count the sentences, tokens and batches
+that were actually input to the model, without changing the scores
+"""
+
+import pytest
+
+SENTENCES = ["the cat sat", "a dog", "the dog sat on the mat and it ran", "cat", "the mat is here"]
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 5])
+def test_gpt2_stats(gpt2_scorer, batch_size):
+    scorer = gpt2_scorer(batch_size=batch_size, track_stats=True)
+    scores = scorer.compute_score(SENTENCES)
+    assert scores == pytest.approx(gpt2_scorer(batch_size=batch_size).compute_score(SENTENCES), rel=1e-4)
+
+    # [BOS] sentence, padded to the longest sequence of each batch
+    lengths = [1 + len(scorer.tokenizer.tokenize(sentence)) for sentence in SENTENCES]
+    batches = [lengths[idx : idx + batch_size] for idx in range(0, len(lengths), batch_size)]
+    stats = scorer.stats.summary()
+    assert stats["nb_calls"] == 1 and stats["nb_sentences"] == len(SENTENCES)
+    assert stats["nb_tokens"] == sum(lengths)
+    assert stats["nb_pad_tokens"] == sum(len(batch) * max(batch) - sum(batch) for batch in batches)
+    assert sum(stats["batch_size_histogram"].values()) == len(batches)
+    assert stats["batch_size_histogram"].get(batch_size) == len(SENTENCES) // batch_size
+
+    wall_time = stats["wall_time_ms"]
+    assert all(value >= 0 for value in wall_time.values())
+    assert wall_time["total"] >= wall_time["tokenization"] + wall_time["forward"] + wall_time["normalization"]
+
+
+def test_bert_stats_are_reset(bert_scorer):
+    scorer = bert_scorer(batch_size=2, track_stats=True)
+    expected_scores = bert_scorer(batch_size=2).compute_score(SENTENCES)
+    assert scorer.compute_score(SENTENCES) == pytest.approx(expected_scores, rel=1e-4)
+    scorer.compute_score(SENTENCES[:2])
+    assert scorer.stats.nb_calls == 2 and scorer.stats.nb_sentences == len(SENTENCES) + 2
+    assert scorer.stats.nb_tokens > 0 and 0.0 <= scorer.stats.padding_ratio() < 1.0
+
+    scorer.stats.reset()
+    assert scorer.stats.summary()["nb_sentences"] == 0 and scorer.stats.wall_time["total"] == 0.0
+
+
+def test_stats_are_disabled_by_default(gpt2_scorer):
+    scorer = gpt2_scorer()
+    scorer.compute_score(SENTENCES)
+    assert scorer.stats is None
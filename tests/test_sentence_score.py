@@ -0,0 +1,107 @@
+"""
+The batches assembled in the reusable buffers of SentenceScore._pad must be the same as the ones padded
+with pad_sequence, and the buffers of a thread must be freed with it
+"""
+
+import gc
+import pickle
+import random
+import threading
+import weakref
+
+import torch
+from torch.nn.utils.rnn import pad_sequence
+
+PAD_TOKEN_ID = 7
+
+
+def random_batches(seed: int, nb_batches: int = 20):
+    rng = random.Random(seed)
+    return [
+        [[rng.randrange(100) for _ in range(rng.randint(1, 12))] for _ in range(rng.randint(1, 8))]
+        for _ in range(nb_batches)
+    ]
+
+
+def expected_padding(sequences):
+    input_ids = pad_sequence([torch.tensor(ids) for ids in sequences], batch_first=True, padding_value=PAD_TOKEN_ID)
+    no_pad_mask = pad_sequence([torch.ones(len(ids)) for ids in sequences], batch_first=True)
+    return input_ids, no_pad_mask
+
+
+def check_pad(scorer, sequences):
+    input_ids, no_pad_mask = scorer._pad(*scorer._flatten(sequences), pad_token_id=PAD_TOKEN_ID)
+    expected_input_ids, expected_no_pad_mask = expected_padding(sequences)
+    assert torch.equal(input_ids, expected_input_ids)
+    assert torch.equal(no_pad_mask, expected_no_pad_mask)
+
+
+def test_pad_matches_pad_sequence(gpt2_scorer):
+    # The buffers grow and are reused by the smaller batches
+    scorer = gpt2_scorer()
+    for sequences in random_batches(seed=0):
+        check_pad(scorer, sequences)
+
+
+def test_pad_from_several_threads(gpt2_scorer):
+    scorer = gpt2_scorer()
+    errors = []
+
+    def pad_batches(seed):
+        try:
+            for sequences in random_batches(seed, nb_batches=200):
+                check_pad(scorer, sequences)
+        except AssertionError as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=pad_batches, args=(seed,)) for seed in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+
+def test_pad_reuses_the_buffers(gpt2_scorer):
+    scorer = gpt2_scorer()
+    input_ids, _ = scorer._pad(*scorer._flatten([[1, 2, 3], [4]]), pad_token_id=PAD_TOKEN_ID)
+    data_ptr = input_ids.data_ptr()
+    staging_ptr = scorer._local.buffers["ids_staging"].data_ptr()
+    check_pad(scorer, [[5], [6, 7]])
+    assert scorer._pad(*scorer._flatten([[8, 9]]), pad_token_id=PAD_TOKEN_ID)[0].data_ptr() == data_ptr
+    assert scorer._local.buffers["ids_staging"].data_ptr() == staging_ptr
+
+
+def test_buffers_are_freed_with_their_thread(gpt2_scorer):
+    scorer = gpt2_scorer()
+    buffers = []
+
+    def pad_batch():
+        check_pad(scorer, [[1, 2, 3], [4]])
+        buffers.append(weakref.ref(scorer._local.buffers["input_ids"]))
+
+    thread = threading.Thread(target=pad_batch)
+    thread.start()
+    thread.join()
+    del thread
+    gc.collect()
+    assert buffers[0]() is None
+    assert not hasattr(scorer._local, "buffers")
+
+
+def test_pad_packed_positions_and_segments(gpt2_scorer):
+    scorer = gpt2_scorer()
+    sequences = [[1, 2, 3], [4], [5, 6], [7, 8, 9, 10]]
+    flat_ids, offsets = scorer._flatten(sequences)
+    input_ids, position_ids, segment_ids = scorer._pad_packed(flat_ids, offsets, [2, 1, 1], PAD_TOKEN_ID)
+    assert input_ids.tolist() == [[1, 2, 3, 4], [5, 6, 7, 7], [7, 8, 9, 10]]
+    assert position_ids.tolist() == [[0, 1, 2, 0], [0, 1, 0, 0], [0, 1, 2, 3]]
+    assert segment_ids.tolist() == [[0, 0, 0, 1], [2, 2, -1, -1], [3, 3, 3, 3]]
+
+
+def test_pickled_scorer_gets_new_buffers(gpt2_scorer):
+    scorer = gpt2_scorer()
+    check_pad(scorer, [[1, 2, 3], [4]])
+    copy = pickle.loads(pickle.dumps(scorer))
+    assert not hasattr(copy._local, "buffers")
+    check_pad(copy, [[1, 2], [3, 4, 5]])
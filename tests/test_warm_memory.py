@@ -0,0 +1,65 @@
+"""
+With warm_memory=True, the searches must give the same results as with a cold evaluator
+while only the leaves never scored before are input to the evaluation function
+"""
+
+import os
+import random
+
+from lm_heuristic.tree.interface.nltk_grammar import CFGrammarNode
+from lm_heuristic.tree_search import Evaluator
+from lm_heuristic.tree_search.random import RandomSearch
+
+GRAMMAR_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "cfg", "ex_4.cfg")
+
+
+class CountingScorer:
+    def __init__(self):
+        self.nb_sentences = 0
+
+    def __call__(self, sentences):
+        self.nb_sentences += len(sentences)
+        return [(sum(map(ord, sentence)) % 101) / 100 for sentence in sentences]
+
+
+def run_searches(warm_memory: bool, nb_searches: int = 4):
+    random.seed(0)
+    scorer = CountingScorer()
+    evaluator = Evaluator(scorer, warm_memory=warm_memory)
+    searcher = RandomSearch(evaluator)
+    root = CFGrammarNode.from_cfg_file(GRAMMAR_PATH)
+    results = []
+    for _ in range(nb_searches):
+        best_node, best_value = searcher.search(root, nb_of_tree_walks=30)
+        history = evaluator.history_of_leaves()
+        results.append((str(best_node), best_value, searcher.top_n_leaves(5), history, evaluator.memory_stats()))
+    return results, scorer.nb_sentences
+
+
+def test_warm_memory_gives_the_same_searches():
+    cold_results, nb_cold_sentences = run_searches(warm_memory=False)
+    warm_results, nb_warm_sentences = run_searches(warm_memory=True)
+    assert nb_warm_sentences < nb_cold_sentences
+
+    for (*cold_result, cold_stats), (*warm_result, warm_stats) in zip(cold_results, warm_results):
+        # Same best leaf, top-k and history: the per-search state is reset
+        assert warm_result == cold_result
+        assert warm_stats["hits"] + warm_stats["misses"] == cold_stats["hits"] + cold_stats["misses"]
+
+    # The hits of the later searches come from the previous ones
+    assert warm_results[-1][-1]["hits"] > cold_results[-1][-1]["hits"]
+    assert warm_results[-1][-1]["entries"] > cold_results[-1][-1]["entries"]
+
+
+def test_clear_warm_memory():
+    scorer = CountingScorer()
+    evaluator = Evaluator(scorer, warm_memory=True)
+    leaves = CFGrammarNode.from_cfg_file(GRAMMAR_PATH).random_walks(10)
+    evaluator.eval(leaves)
+    evaluator.reset()
+    assert all(evaluator.has_already_eval(leaf) for leaf in leaves)
+
+    evaluator.clear_memory()
+    assert not any(evaluator.has_already_eval(leaf) for leaf in leaves)
+    evaluator.eval(leaves)
+    assert scorer.nb_sentences == 2 * len(set(map(str, leaves)))
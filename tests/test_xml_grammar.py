@@ -0,0 +1,299 @@
+"""
+Grammars parsed from the draw.io file data/grammar.xml (cf load_grammar and XMLGrammarNode)
+"""
+
+import multiprocessing
+import os
+import pickle
+import random
+import xml.etree.ElementTree as ET
+from copy import deepcopy
+
+import pytest
+
+from lm_heuristic.tree.interface.xml import XMLGrammarNode, grammar_cache, parse_xml
+from lm_heuristic.tree.interface.xml.feature_structure import PConstant, PStruct, PVar, copy_features, resolve, revert
+from lm_heuristic.tree.interface.xml.grammar_cache import load_grammar
+from lm_heuristic.tree.interface.xml.parse_grammar_str import parse_grammar
+from lm_heuristic.tree.interface.xml.parse_xml import xml_to_string
+from lm_heuristic.tree_search import Evaluator
+from lm_heuristic.tree_search.mcts.evaluation_buffer import ParallelEvalWorker
+
+XML_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "grammar.xml")
+
+
+@pytest.fixture(autouse=True)
+def empty_loaded_grammars():
+    grammar_cache._loaded_grammars.clear()
+    yield
+    grammar_cache._loaded_grammars.clear()
+
+
+def leaves(root: XMLGrammarNode, nb_walks: int = 50):
+    random.seed(0)
+    return [str(root.random_walk()) for _ in range(nb_walks)]
+
+
+def test_loaded_grammar_is_read_only_and_shared():
+    grammar = load_grammar(XML_PATH)
+    assert load_grammar(XML_PATH) is grammar
+
+    head = next(iter(grammar))
+    with pytest.raises(TypeError):
+        grammar[head] = ()
+    with pytest.raises(TypeError):
+        grammar[head][0]["body_symbols"] = ()
+    with pytest.raises(AttributeError):
+        grammar[head].append(None)
+
+
+def test_loaded_grammar_matches_parse():
+    parsed_grammar = parse_grammar(xml_to_string(XML_PATH))
+    grammar = load_grammar(XML_PATH)
+    assert list(grammar) == list(parsed_grammar)
+    for head, bodies in parsed_grammar.items():
+        assert [list(body["body_symbols"]) for body in grammar[head]] == [body["body_symbols"] for body in bodies]
+
+
+def test_loaded_grammars_are_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(grammar_cache, "MAX_LOADED_GRAMMARS", 2)
+    paths = []
+    with open(XML_PATH) as file:
+        content = file.read()
+    for idx in range(3):
+        # Different contents (the comment changes the hash) for the same grammar
+        paths.append(tmp_path / ("grammar_%d.xml" % idx))
+        paths[-1].write_text(content + "<!-- %d -->" % idx)
+        load_grammar(str(paths[-1]))
+    assert len(grammar_cache._loaded_grammars) == 2
+
+
+def test_leaf_pickle_round_trip():
+    random.seed(0)
+    leaf = XMLGrammarNode.from_file(XML_PATH).random_walk()
+    copied_leaf = pickle.loads(pickle.dumps(leaf))
+    assert str(copied_leaf) == str(leaf)
+    assert list(copied_leaf.grammar) == list(leaf.grammar)
+    with pytest.raises(TypeError):
+        copied_leaf.grammar["ROOT"] = ()
+    assert str(deepcopy(leaf)) == str(leaf)
+
+
+class LengthScorer:
+    # Picklable evaluation function with a build method (cf ParallelEvalWorker)
+    def build(self):
+        pass
+
+    def __call__(self, leaves):
+        return [float(len(leaf)) for leaf in leaves]
+
+
+def test_leaves_sent_to_an_evaluation_process():
+    # As in ParallelEvalBuffer with parallel_strategy="multiprocess" (the leaves are put on a multiprocessing queue)
+    context = multiprocessing.get_context("spawn")
+    tasks_queue, results_queue = context.Queue(), context.Queue()
+    worker = context.Process(
+        target=ParallelEvalWorker(Evaluator(LengthScorer()), tasks_queue, results_queue), daemon=True
+    )
+    worker.start()
+    try:
+        batch = [XMLGrammarNode.from_file(XML_PATH).random_walk() for _ in range(5)]
+        tasks_queue.put(batch)
+        assert results_queue.get(timeout=60) == LengthScorer()(list(map(str, batch)))
+    finally:
+        worker.terminate()
+
+
+def test_disk_cache_gives_the_same_leaves(tmp_path):
+    expected_leaves = leaves(XMLGrammarNode.from_file(XML_PATH))
+
+    grammar_cache._loaded_grammars.clear()
+    XMLGrammarNode.from_file(XML_PATH, cache_dir=str(tmp_path))
+    assert len(list(tmp_path.glob("*.pickle"))) == 1
+
+    # The grammar is now read from the cache file
+    grammar_cache._loaded_grammars.clear()
+    assert leaves(XMLGrammarNode.from_file(XML_PATH, cache_dir=str(tmp_path))) == expected_leaves
+
+
+class DeepcopyXMLGrammarNode(XMLGrammarNode):
+    # Old implementation: the symbols of each child are deep copied instead of resolved
+
+    @staticmethod
+    def _resolve_symbols(symbols):
+        return deepcopy(symbols)
+
+    def compute_children(self):
+        return [DeepcopyXMLGrammarNode(child.symbols, child.grammar) for child in XMLGrammarNode.compute_children(self)]
+
+
+def signature(symbols):
+    # Text of the symbols where the bound variables are replaced by their values (the deep copied symbols keep them)
+    # and the free variables are numbered by identity, so that the shared variables are visible
+    variable_ids = dict()
+
+    def term_signature(term):
+        if term.isVar:
+            if term.ref is not None:
+                return term_signature(term.ref)
+            return "?%d" % variable_ids.setdefault(id(term), len(variable_ids))
+        if term.isConst:
+            return str(term.value)
+        return "[%s]" % ", ".join(f + "=" + term_signature(value) for f, value in term.features.items())
+
+    return " ".join(symbol["str"] + term_signature(symbol["features"]) for symbol in symbols)
+
+
+def test_resolved_children_match_deep_copied_children():
+    grammar = load_grammar(XML_PATH)
+    root = XMLGrammarNode(({"str": "ROOT", "features": PStruct({})},), grammar)
+    stack = [(root, DeepcopyXMLGrammarNode(root.symbols, grammar))]
+    nb_nodes = 0
+    while stack:
+        node, copied_node = stack.pop()
+        nb_nodes += 1
+        root_signature = signature(node.symbols)
+        assert str(node) == str(copied_node)
+        assert root_signature == signature(copied_node.symbols)
+        if node.is_terminal():
+            continue
+        children, copied_children = node.children(), copied_node.children()
+        assert len(children) == len(copied_children)
+        # The parent is not modified by the unifications of its children
+        assert signature(node.symbols) == root_signature
+        stack.extend(zip(children, copied_children))
+    assert nb_nodes > 1000
+
+
+def test_resolve_shares_the_unchanged_terms():
+    unchanged = PStruct({"number": PConstant("sg")})
+    variable, free_variable = PVar("X"), PVar("Y")
+    term = PStruct({"a": variable, "b": unchanged, "c": PStruct({"d": variable, "e": free_variable})})
+    assert resolve(term) is term
+
+    bindings = []
+    assert variable.unify(PConstant("pl"), bindings)
+    resolved = resolve(term)
+    revert(bindings)
+    assert resolved is not term and variable.ref is None
+    assert resolved.features["a"].value == resolved.features["c"].features["d"].value == "pl"
+    assert resolved.features["b"] is unchanged
+    assert resolved.features["c"].features["e"] is free_variable
+
+
+def test_resolve_keeps_the_variables_shared_between_symbols():
+    body = {
+        "head_feature": PStruct({"n": PVar("N"), "m": PVar("M")}),
+        "body_features": [PStruct({"n": PVar("N")}), PStruct({"n": PVar("N"), "m": PVar("M")})],
+        "body_symbols": ["A", "B"],
+    }
+    head, first, second = copy_features(body)
+    bindings = []
+    assert head["features"].unify(PStruct({"n": PConstant("sg")}), bindings)
+    symbols = XMLGrammarNode._resolve_symbols((first, second))
+    revert(bindings)
+
+    assert symbols[0]["features"].features["n"].value == "sg"
+    # The unbound variable M is still the same object in both symbols
+    assert symbols[1]["features"].features["m"] is head["features"].features["m"]
+    assert symbols[0]["features"] is not first["features"]
+
+
+class ScanIndex:
+    # Old implementation of the lookups of parse: each stage and each lookup scans all the elements
+    # (cf scanning_non_terminal_features)
+
+    def __init__(self, elements):
+        self.elements = elements
+        self.children = ScanLookup(elements, "parent")
+        self.edges_by_source = ScanLookup([child for child in elements if "edge" in child.attrib], "source")
+
+    @property
+    def styled(self):
+        return [(child, child.attrib["style"]) for child in self.elements if "style" in child.attrib]
+
+    @property
+    def with_parent(self):
+        return [child for child in self.elements if "parent" in child.attrib]
+
+    @property
+    def edges(self):
+        return [child for child in self.elements if "edge" in child.attrib]
+
+
+class ScanLookup:
+    def __init__(self, elements, attribute: str):
+        self.elements = elements
+        self.attribute = attribute
+
+    def get(self, key, default=None):
+        found = [child for child in self.elements if child.attrib.get(self.attribute) == key]
+        return found if found else default
+
+
+def scanning_non_terminal_features(nonterminal, index, dictionaries, semantic_structures, struct_vars):
+    for child in index.elements:
+        attributes = child.attrib
+        if "parent" not in attributes or attributes["parent"] != nonterminal["id"]:
+            continue
+        base_structure = scanning_base_structure(index, attributes["id"], dictionaries, semantic_structures)
+        name, feature = parse_xml.translate_feature(
+            attributes["value"], semantic_structures, struct_vars, base_structure
+        )
+        nonterminal["features"][name] = feature
+
+
+def scanning_base_structure(index, source_id, dictionaries, semantic_structures):
+    for child in index.elements:
+        attributes = child.attrib
+        if not "edge" in attributes:
+            continue
+        target = attributes["target"]
+        if not attributes["source"] == source_id or not target in dictionaries:
+            continue
+        target = dictionaries[target]
+        if not target["type"] == "semantic_structure":
+            continue
+        return semantic_structures[target["name"]]
+    return None
+
+
+def replicated_diagram(path, nb_copies: int):
+    # The diagram of data/grammar.xml copied nb_copies times, with renamed ids
+    tree = ET.parse(XML_PATH)
+    elements = tree.getroot()[0][0][0]
+    cells = [cell for cell in elements if cell.attrib["id"] not in ("0", "1")]
+    for copy_idx in range(1, nb_copies):
+        for cell in cells:
+            cell = deepcopy(cell)
+            for attribute in ("id", "parent", "source", "target"):
+                if attribute in cell.attrib and cell.attrib[attribute] not in ("0", "1"):
+                    cell.attrib[attribute] += "-%d" % copy_idx
+            elements.append(cell)
+    tree.write(str(path))
+    return str(path)
+
+
+@pytest.mark.parametrize("nb_copies", [1, 3])
+def test_indexed_parse_matches_the_scanning_parse(tmp_path, monkeypatch, nb_copies):
+    path = replicated_diagram(tmp_path / "grammar.xml", nb_copies)
+    parsed, as_str = parse_xml.parse(path), xml_to_string(path)
+    # Each copy adds its rules
+    assert as_str.count(" -> ") == nb_copies * xml_to_string(XML_PATH).count(" -> ")
+
+    monkeypatch.setattr(parse_xml, "XMLIndex", ScanIndex)
+    monkeypatch.setattr(parse_xml, "get_non_terminal_features", scanning_non_terminal_features)
+    assert parse_xml.parse(path) == parsed
+    assert xml_to_string(path) == as_str
+
+
+def test_index_keeps_the_order_of_the_file():
+    elements = ET.parse(XML_PATH).getroot()[0][0][0]
+    index, scan_index = parse_xml.XMLIndex(elements), ScanIndex(elements)
+    assert index.styled == scan_index.styled
+    assert index.with_parent == scan_index.with_parent
+    assert index.edges == scan_index.edges
+    for child in elements:
+        key = child.attrib["id"]
+        assert index.children.get(key, []) == scan_index.children.get(key, [])
+        assert index.edges_by_source.get(key, []) == scan_index.edges_by_source.get(key, [])